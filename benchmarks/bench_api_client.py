@@ -0,0 +1,59 @@
+"""Fetching a month of REE prices with one plain request per day against the pooled, concurrent ApiClient.
+
+The requests go to a local stand-in of the ESIOS API with an artificial latency. Run from the repository root:
+    python -m benchmarks.bench_api_client [--latency 0.1] [--days 30]
+"""
+
+import argparse
+import datetime
+import time
+
+import requests
+
+from pyems.core.iodata.ioapis import ApiClient, ESIOS_API_URL, REE_TARIFF_INDICATORS, request_ree_prices_by_day
+from pyems.config import Parameter
+from pyems.tools.api_standin import ApiStandIn
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def fetch_sequential(server, days):
+    url = f'{server.url_overrides[ESIOS_API_URL]}/indicators/{REE_TARIFF_INDICATORS["tariff_2.0A"]}'
+    for day in range(days):
+        start = START + datetime.timedelta(days=day)
+        end = start + datetime.timedelta(hours=23)
+        payload = {
+            'start_date': start.strftime(Parameter.O_CLOCK_FORMAT), 'end_date': end.strftime(Parameter.O_CLOCK_FORMAT)
+        }
+        requests.get(url, params=payload).json()
+
+
+def fetch_concurrent(server, days, max_workers):
+    client = ApiClient(url_overrides=server.url_overrides, max_workers=max_workers)
+    request_ree_prices_by_day(START, START + datetime.timedelta(days=days, hours=-1), token='token', client=client)
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--days', type=int, default=30)
+    arguments = parser.parse_args()
+
+    runs = [('sequential requests.get', lambda server: fetch_sequential(server, arguments.days))]
+    for max_workers in [1, 4, 8]:
+        runs.append((
+            f'ApiClient, {max_workers} workers',
+            lambda server, max_workers=max_workers: fetch_concurrent(server, arguments.days, max_workers)
+        ))
+
+    for label, run in runs:
+        with ApiStandIn(latency=arguments.latency) as server:
+            start = time.perf_counter()
+            run(server)
+            elapsed = time.perf_counter() - start
+            print(f'{label:>24}: {elapsed:6.2f} s, {server.requests} requests, {len(server.connections)} connections')
+
+
+if __name__ == '__main__':
+    main()
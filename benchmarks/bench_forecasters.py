@@ -0,0 +1,81 @@
+"""Rolling day-ahead backtest of the lightweight NumPy forecasters against ProphetOracle on the same history.
+
+A synthetic 15 minute load with daily and weekly seasonality, a temperature regressor and noise is forecast day by
+day. For every model the mean latency per forecast (fit plus predict) and the MAE are reported. ProphetOracle is
+included when fbprophet is installed. Run from the repository root:
+    python -m benchmarks.bench_forecasters [--history-days 28] [--steps 14]
+"""
+
+import argparse
+import datetime
+import time
+
+import numpy
+import pandas
+
+from pyems.core.forecasting.lightweight import (
+    SeasonalNaiveForecaster, HoltWintersForecaster, RidgeForecaster, RecursiveLeastSquaresForecaster
+)
+
+START = datetime.datetime(2020, 1, 6)
+
+
+def synthetic_data(days, seed=0):
+    index = pandas.date_range(start=START, periods=days * 96, freq='15T')
+    hours = index.hour + index.minute / 60
+    random = numpy.random.default_rng(seed)
+    temperature = 10 + 5 * numpy.cos(2 * numpy.pi * (hours - 15) / 24) + random.standard_normal(index.shape[0])
+    load = (
+        1.0 + 0.5 * numpy.sin(2 * numpy.pi * (hours - 7) / 24) + 0.3 * (index.dayofweek >= 5)
+        + 0.03 * temperature + 0.1 * random.standard_normal(index.shape[0])
+    )
+    return pandas.DataFrame({'load': load, 'temperature': temperature}, index=index)
+
+
+def backtest(model, data, labels, history_days, steps):
+    latencies, errors = [], []
+    for step in range(steps):
+        forecast_start = START + datetime.timedelta(days=history_days + step)
+        forecast_end = forecast_start + datetime.timedelta(days=1)
+        window = data[(data.index >= forecast_start - datetime.timedelta(days=history_days))
+                      & (data.index < forecast_end)][labels].copy()
+        observed = window.loc[window.index >= forecast_start, 'load'].values
+        window.loc[window.index >= forecast_start, 'load'] = numpy.nan
+
+        start = time.perf_counter()
+        forecast = model.forecast([forecast_start, forecast_end], window, 'load', '15m')
+        latencies.append(time.perf_counter() - start)
+        errors.append(numpy.mean(numpy.abs(forecast['load'].values[:observed.shape[0]] - observed)))
+
+    return numpy.mean(latencies), numpy.mean(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--history-days', type=int, default=28)
+    parser.add_argument('--steps', type=int, default=14)
+    arguments = parser.parse_args()
+
+    data = synthetic_data(arguments.history_days + arguments.steps)
+    runs = [
+        ('seasonal naive (1d)', SeasonalNaiveForecaster('1d'), ['load']),
+        ('seasonal naive (7d)', SeasonalNaiveForecaster('7d'), ['load']),
+        ('Holt-Winters', HoltWintersForecaster(), ['load']),
+        ('ridge', RidgeForecaster(), ['load']),
+        ('ridge + temperature', RidgeForecaster(), ['load', 'temperature']),
+        ('online RLS + temperature', RecursiveLeastSquaresForecaster(), ['load', 'temperature']),
+    ]
+
+    try:
+        from pyems.core.forecasting.prophet import ProphetOracle
+        runs.append(('Prophet + temperature', ProphetOracle(), ['load', 'temperature']))
+    except ImportError:
+        print('fbprophet is not installed, ProphetOracle skipped.')
+
+    for label, model, labels in runs:
+        latency, mae = backtest(model, data, labels, arguments.history_days, arguments.steps)
+        print(f'{label:>24}: {1000 * latency:9.2f} ms per forecast, MAE {mae:.4f}')
+
+
+if __name__ == '__main__':
+    main()
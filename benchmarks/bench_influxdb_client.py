@@ -0,0 +1,47 @@
+"""Compares a new InfluxDB client per call against the pooled clients of ioinflux.
+
+Run from the repository root:
+    python -m benchmarks.bench_influxdb_client
+"""
+
+import time
+
+from influxdb import InfluxDBClient
+
+from pyems.core.iodata.ioinflux import connect_to_influxdb, close_influxdb_clients
+from pyems.tools.influxdb_standin import InfluxDBStandIn
+
+CALLS = 500
+QUERY = 'SELECT INTEGRAL("value") FROM "kW" WHERE "entity_id"=\'load\' GROUP BY time(1h)'
+DB_CREDENTIALS = {'username': 'root', 'password': 'root', 'database': 'benchmark'}
+
+
+def run_fresh_clients(network_route):
+    for _ in range(CALLS):
+        client = InfluxDBClient(**DB_CREDENTIALS, **network_route)
+        client.query(QUERY)
+        client.close()
+
+
+def run_pooled_clients(network_route):
+    for _ in range(CALLS):
+        client = connect_to_influxdb(db_credentials=DB_CREDENTIALS, db_network_route=network_route)
+        client.query(QUERY)
+
+
+def main():
+    with InfluxDBStandIn() as server:
+        for label, function in [('fresh client', run_fresh_clients), ('pooled client', run_pooled_clients)]:
+            server.connections.clear()
+            start = time.perf_counter()
+            function(server.network_route)
+            elapsed = time.perf_counter() - start
+            print(
+                f'{label:>14}: {CALLS / elapsed:8.0f} queries/s, '
+                f'{elapsed / CALLS * 1e3:6.3f} ms/query, {len(server.connections)} TCP connections'
+            )
+        close_influxdb_clients()
+
+
+if __name__ == '__main__':
+    main()
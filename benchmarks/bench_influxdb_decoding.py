@@ -0,0 +1,55 @@
+"""Micro-benchmark of the conversion of InfluxDB responses into time series.
+
+Compares influxdb_response_to_series (per-point dicts plus string timestamps parsed afterwards) against
+influxdb_response_to_arrays on a response with epoch times. Run from the repository root:
+    python -m benchmarks.bench_influxdb_decoding
+"""
+
+import timeit
+
+import numpy
+import pandas
+from influxdb.resultset import ResultSet
+
+from pyems.core.iodata.ioinflux import influxdb_response_to_series, influxdb_response_to_arrays
+
+REPEAT = 5
+SAMPLES = [24 * 4 * 7, 24 * 4 * 365, 24 * 12 * 365]  # Week and year at 15 min, year at 5 min
+
+
+def build_responses(samples):
+    index = pandas.date_range(start='2019-01-01', periods=samples, freq='5T', tz='UTC')
+    values = numpy.random.default_rng(0).random(samples).tolist()
+    string_rows = [list(row) for row in zip(index.strftime('%Y-%m-%dT%H:%M:%SZ'), values)]
+    epoch_rows = [list(row) for row in zip((index.asi8 // 10 ** 9).tolist(), values)]
+
+    def response(rows):
+        return ResultSet({'statement_id': 0, 'series': [{'columns': ['time', 'integral'], 'values': rows}]})
+
+    return response(string_rows), response(epoch_rows)
+
+
+def decode_points(response):
+    series = influxdb_response_to_series(response, 'INTEGRAL')
+    series.index = pandas.to_datetime(series.index)
+    return series
+
+
+def decode_arrays(response):
+    times, values = influxdb_response_to_arrays(response, 'INTEGRAL', epoch='s')
+    return pandas.Series(values, index=times)
+
+
+def main():
+    for samples in SAMPLES:
+        string_response, epoch_response = build_responses(samples)
+        points = min(timeit.repeat(lambda: decode_points(string_response), number=1, repeat=REPEAT))
+        arrays = min(timeit.repeat(lambda: decode_arrays(epoch_response), number=1, repeat=REPEAT))
+        print(
+            f'{samples:>7} samples: points {points * 1e3:8.2f} ms, arrays {arrays * 1e3:8.2f} ms, '
+            f'speed-up x{points / arrays:5.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
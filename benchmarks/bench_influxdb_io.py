@@ -0,0 +1,102 @@
+"""Query and write throughput of ioinflux against the local InfluxDB stand-in.
+
+The stand-in database is filled with a year of 1 minute samples per entity and served over HTTP, so the figures include
+the client, the JSON transfer and the decoding. Run from the repository root:
+    python -m benchmarks.bench_influxdb_io [--entities 20] [--days 365]
+"""
+
+import argparse
+import datetime
+import time
+
+import numpy
+import pandas
+
+from pyems.core.iodata.ioinflux import (
+    get_df_from_influxdb, write_series_to_influxdb, InfluxDBBufferedWriter, close_influxdb_clients,
+)
+from pyems.tools.influxdb_standin import InMemoryInfluxDB, InfluxDBStandIn
+
+DB_CREDENTIALS = {'username': 'root', 'password': 'root', 'database': 'benchmark'}
+START = datetime.datetime(2019, 1, 1)
+
+
+def fill_database(entities, days):
+    database = InMemoryInfluxDB()
+    index = pandas.date_range(start=START, periods=days * 24 * 60, freq='1T')
+    generator = numpy.random.default_rng(0)
+    for entity in entities:
+        database.add_series('kW', entity, index, generator.random(index.size))
+    return database
+
+
+def timed(callable_, **kwargs):
+    start = time.perf_counter()
+    result = callable_(**kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_queries(server, entities, days):
+    interval = [START, START + datetime.timedelta(days=days)]
+    options = {
+        'entities': {'kW': entities}, 'time_interval': interval, 'timestep': '15m', 'function': 'MEAN',
+        'db_credentials': DB_CREDENTIALS, 'db_network_route': server.network_route,
+    }
+    modes = [
+        ('per entity', {}),
+        ('batched', {'batch_entities': True}),
+        ('batched, 1 week chunks', {'batch_entities': True, 'chunk_periods': 7 * 24 * 4}),
+    ]
+    for label, mode_options in modes:
+        requests = server.requests
+        df, elapsed = timed(get_df_from_influxdb, **options, **mode_options)
+        print(
+            f'query {label:>24}: {elapsed:7.3f} s, {df.size / elapsed:10.0f} values/s, '
+            f'{server.requests - requests} requests'
+        )
+
+
+def benchmark_writes(server, samples):
+    series = pandas.Series(
+        numpy.random.default_rng(1).random(samples),
+        index=pandas.date_range(start=START, periods=samples, freq='15T'), name='write_test'
+    )
+
+    _, elapsed = timed(
+        write_series_to_influxdb, series=series, measurement='kW', db_credentials=DB_CREDENTIALS,
+        db_network_route=server.network_route
+    )
+    print(f'write {"write_series_to_influxdb":>24}: {elapsed:7.3f} s, {samples / elapsed:10.0f} points/s')
+
+    writer = InfluxDBBufferedWriter(
+        db_credentials=DB_CREDENTIALS, db_network_route=server.network_route, max_buffer_lines=2 * samples
+    )
+    start = time.perf_counter()
+    for chunk in numpy.array_split(numpy.arange(samples), 100):
+        writer.write_series(series.iloc[chunk], measurement='kW', entity_id='buffered_test')
+    enqueued = time.perf_counter() - start
+    writer.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f'write {"buffered writer":>24}: {elapsed:7.3f} s, {samples / elapsed:10.0f} points/s '
+        f'({enqueued / 100 * 1e3:.3f} ms blocking per call)'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entities', type=int, default=20)
+    parser.add_argument('--days', type=int, default=365)
+    arguments = parser.parse_args()
+
+    entities = [f'meter_{i}' for i in range(arguments.entities)]
+    database = fill_database(entities, arguments.days)
+
+    with InfluxDBStandIn(database) as server:
+        benchmark_queries(server, entities, arguments.days)
+        benchmark_writes(server, samples=arguments.days * 24 * 4)
+        close_influxdb_clients()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Forecasting 8 metered loads one after another against the ForecastPool with an increasing number of workers.
+
+Every load uses a CPU-bound stand-in of a Prophet fit (a pure Python optimisation loop), so the wall time is dominated
+by the model and not by shipping the data. Run from the repository root:
+    python -m benchmarks.bench_parallel_forecasts [--loads 8] [--iterations 300000]
+"""
+
+import argparse
+import datetime
+import os
+import time
+
+import numpy
+import pandas
+
+from pyems.core.forecasting.pool import ForecastPool
+
+START = datetime.datetime(2020, 1, 1)
+
+
+class BusyForecaster:
+    """Spends a fixed amount of pure Python work per fit and forecasts the mean daily profile."""
+
+    def __init__(self, iterations):
+        self.iterations = iterations
+
+    def forecast(self, forecast_interval, input_data, target_label, timestep):
+        x = 0.0
+        for i in range(self.iterations):
+            x = (x + i * 1e-9) % 1.0
+        index = pandas.date_range(start=forecast_interval[0], end=forecast_interval[1], freq='15T', closed='left')
+        profile = input_data[target_label].values.reshape(-1, 96).mean(axis=0)
+        return pandas.DataFrame({target_label: numpy.resize(profile, index.shape[0])}, index=index)
+
+
+def tasks(loads, iterations):
+    index = pandas.date_range(start=START, periods=28 * 96, freq='15T')
+    interval = [START + datetime.timedelta(days=28), START + datetime.timedelta(days=29)]
+    random = numpy.random.default_rng(0)
+    return [
+        (BusyForecaster(iterations), interval, pandas.DataFrame({'load': random.random(index.shape[0])}, index=index),
+         'load', '15m')
+        for _ in range(loads)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--loads', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=300000)
+    arguments = parser.parse_args()
+
+    step_tasks = tasks(arguments.loads, arguments.iterations)
+
+    start = time.perf_counter()
+    for model, interval, data, label, timestep in step_tasks:
+        model.forecast(interval, data, label, timestep)
+    sequential = time.perf_counter() - start
+    print(f'{"sequential":>12}: {sequential:6.2f} s')
+
+    for workers in sorted({1, 2, 4, min(arguments.loads, os.cpu_count() or 1)}):
+        pool = ForecastPool(max_workers=workers)
+        pool.forecast(step_tasks[:workers])  # Start the workers, the pool lives across steps
+        start = time.perf_counter()
+        pool.forecast(step_tasks)
+        elapsed = time.perf_counter() - start
+        pool.close()
+        print(f'{workers:>4} workers: {elapsed:6.2f} s, speed-up {sequential / elapsed:4.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Data preparation overhead of ProphetOracle: the former string round trip against the datetime64 path.
+
+The former path formatted the index with strftime, rebuilt the frames with reset_index/rename/copy passes and parsed
+the forecast index back with pandas.to_datetime. The current one (ProphetOracle.split_input and
+forecast_table_to_frame) passes datetime64 columns directly. Only the preparation is timed, Prophet is not fitted.
+Run from the repository root:
+    python -m benchmarks.bench_prophet_preparation [--days 365] [--timestep 5] [--repeat 5]
+"""
+
+import argparse
+import datetime
+import time
+
+import numpy
+import pandas
+
+from pyems.core.forecasting.prophet import ProphetOracle
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+START = datetime.datetime(2019, 1, 1)
+
+
+def string_round_trip(forecast_interval, input_data, target_label):
+    """Preparation steps of the former ProphetOracle.forecast."""
+
+    input_data.interpolate(inplace=True)
+
+    training_data = input_data[input_data.index < forecast_interval[0]].copy()
+    test_data = input_data[input_data.index >= forecast_interval[0]].copy()
+
+    training_data['index'] = training_data.index.strftime(DATETIME_FORMAT)
+    training_data.reset_index(inplace=True, drop=True)
+    training_data.rename(index=str, columns={'index': 'ds', target_label: 'y'}, inplace=True)
+
+    test_data['index'] = test_data.index.strftime(DATETIME_FORMAT)
+    test_data.reset_index(inplace=True, drop=True)
+    test_data.rename(index=str, columns={'index': 'ds', target_label: 'y'}, inplace=True)
+    test_data.drop(columns=['y'], inplace=True)
+
+    forecast_table = test_data.assign(yhat=1.0)  # Stand-in of the Prophet prediction
+    forecast_table.set_index('ds', drop=True, inplace=True)
+    forecast_table.index = pandas.to_datetime(forecast_table.index, format=DATETIME_FORMAT, utc=True)
+    forecast = forecast_table.loc[:, ['yhat']]
+    forecast.rename(columns={'yhat': target_label}, inplace=True)
+
+    return training_data, forecast
+
+
+def datetime64_path(oracle, forecast_interval, input_data, target_label):
+    training_data, test_data, _ = oracle.split_input(forecast_interval, input_data, target_label, timestep='5m')
+    forecast_table = test_data.assign(yhat=1.0)  # Stand-in of the Prophet prediction
+    return training_data, oracle.forecast_table_to_frame(forecast_table, target_label)
+
+
+def best_of(repeat, function):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--timestep', type=int, default=5, help='Minutes.')
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    periods = arguments.days * 24 * 60 // arguments.timestep
+    index = pandas.date_range(start=START, periods=periods, freq=f'{arguments.timestep}T')
+    random = numpy.random.default_rng(0)
+    data = pandas.DataFrame(
+        {'load': random.random(periods), 'temperature': random.random(periods), 'irradiance': random.random(periods)},
+        index=index
+    )
+    forecast_interval = [index[-288].to_pydatetime(), index[-1].to_pydatetime()]
+    data.loc[data.index >= forecast_interval[0], 'load'] = numpy.nan
+
+    oracle = ProphetOracle()
+    former = best_of(arguments.repeat, lambda: string_round_trip(forecast_interval, data.copy(), 'load'))
+    current = best_of(arguments.repeat, lambda: datetime64_path(oracle, forecast_interval, data.copy(), 'load'))
+    copy = best_of(arguments.repeat, lambda: data.copy())
+
+    old_training, old_forecast = string_round_trip(forecast_interval, data.copy(), 'load')
+    new_training, new_forecast = datetime64_path(oracle, forecast_interval, data.copy(), 'load')
+    assert (pandas.to_datetime(old_training['ds']).values == new_training['ds'].values).all()
+    assert old_forecast.index.equals(new_forecast.index)
+
+    print(f'{periods} samples, {data.shape[1] - 1} regressors (input copy: {1000 * copy:.1f} ms, included below)')
+    print(f'   string round trip: {1000 * former:8.1f} ms')
+    print(f'     datetime64 path: {1000 * current:8.1f} ms, {former / current:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Rolling backtest of ProphetOracle refitting every step from scratch against warm-started refits.
+
+A synthetic hourly load with daily and weekly seasonality is forecast day by day. For every mode the total fit time
+and the mean absolute error of the day-ahead forecasts are reported. Run from the repository root:
+    python -m benchmarks.bench_prophet_warm_start [--history-days 28] [--steps 14]
+"""
+
+import argparse
+import datetime
+import time
+
+import numpy
+import pandas
+
+from pyems.core.forecasting.prophet import ProphetOracle
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def synthetic_load(days, seed=0):
+    index = pandas.date_range(start=START, periods=days * 24, freq='1H')
+    hours = numpy.arange(index.shape[0])
+    random = numpy.random.default_rng(seed)
+    load = (
+        1.0 + 0.5 * numpy.sin(2 * numpy.pi * (hours % 24 - 7) / 24) + 0.2 * (index.dayofweek >= 5)
+        + 0.1 * random.standard_normal(hours.shape[0])
+    )
+    return pandas.DataFrame({'load': load}, index=index)
+
+
+def backtest(oracle, data, history_days, steps):
+    errors = []
+    start = time.perf_counter()
+    for step in range(steps):
+        forecast_start = START + datetime.timedelta(days=history_days + step)
+        forecast_end = forecast_start + datetime.timedelta(hours=23)
+        input_data = data[data.index < forecast_start].copy()
+        forecast = oracle.forecast([forecast_start, forecast_end], input_data, 'load', '1h')
+        observed = data.loc[forecast_start:forecast_end, 'load'].values
+        errors.append(numpy.mean(numpy.abs(forecast['load'].values - observed)))
+    return time.perf_counter() - start, float(numpy.mean(errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--history-days', type=int, default=28)
+    parser.add_argument('--steps', type=int, default=14)
+    arguments = parser.parse_args()
+
+    data = synthetic_load(arguments.history_days + arguments.steps + 1)
+
+    for label, oracle in [('cold fits', ProphetOracle()), ('warm-started fits', ProphetOracle(warm_start=True))]:
+        elapsed, mae = backtest(oracle, data, arguments.history_days, arguments.steps)
+        print(f'{label:>18}: {elapsed:6.2f} s, {oracle.fits} fits, {elapsed / oracle.fits:6.3f} s/fit, MAE {mae:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,7 @@ class Parameter:
     FILE_DATETIME_FORMAT: str = '%Y%m%d_%H%M%S'
     O_CLOCK_FORMAT: str = '%Y-%m-%dT%H:00:00Z'
     INFLUX_VALUE_LABEL = 'value'
+    INFLUX_EPOCH_PRECISION = 's'
 
 
 @dataclass
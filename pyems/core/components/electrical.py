@@ -61,9 +61,8 @@ class StochasticElectricalGenerator(BaseElectricalGenerator):
     def data_handler(self, data_handler):
         self.data_handler = weakref.ref(data_handler)
 
-    def forecast_generation(self, prediction_interval):
-        """This class connect to the InfluxDB to obtain historical data of the building consumption and uses the
-        Facebook Prophet to produce a forecast."""
+    def get_forecast_input(self, prediction_interval):
+        """Gets the historical (and regressors) data used to forecast the prediction interval."""
         prediction_interval = check_time_interval(prediction_interval)
         historical_interval = [
             prediction_interval[0] - datetime.timedelta(
@@ -80,10 +79,10 @@ class StochasticElectricalGenerator(BaseElectricalGenerator):
         if self._preprocessing_callback is not None:
             data = self._preprocessing_callback(data)
 
-        forecast = self.forecast_model.forecast(
-            prediction_interval, data, self.historical_label, timestep=self.timestep
-        )
+        return prediction_interval, data
 
+    def store_forecast(self, forecast):
+        """Postprocessing and storage of the forecast of the model, either run in this process or in a pool."""
         # Postprocessing forecast
         # self.capacity_postprocessing(forecast)
 
@@ -93,6 +92,16 @@ class StochasticElectricalGenerator(BaseElectricalGenerator):
         self.generation_forecast_array = forecast
         return forecast
 
+    def forecast_generation(self, prediction_interval):
+        """This class connect to the InfluxDB to obtain historical data of the building consumption and uses the
+        Facebook Prophet to produce a forecast."""
+        prediction_interval, data = self.get_forecast_input(prediction_interval)
+        forecast = self.forecast_model.forecast(
+            prediction_interval, data, self.historical_label, timestep=self.timestep
+        )
+
+        return self.store_forecast(forecast)
+
 
 class DispatchableElectricalGenerator(BaseElectricalGenerator):
     def __init__(self):
@@ -141,9 +150,8 @@ class FixElectricalLoad(BaseElectricalLoad):
     def data_handler(self, data_handler):
         self.data_handler = weakref.ref(data_handler)
 
-    def forecast_load(self, prediction_interval):
-        """This class connect to the InfluxDB to obtain historical data of the building consumption and uses the
-        Facebook Prophet to produce a forecast."""
+    def get_forecast_input(self, prediction_interval):
+        """Gets the historical (and regressors) data used to forecast the prediction interval."""
         prediction_interval = check_time_interval(prediction_interval)
         historical_interval = [
             prediction_interval[0] - datetime.timedelta(
@@ -160,10 +168,10 @@ class FixElectricalLoad(BaseElectricalLoad):
         if self._preprocessing_callback is not None:
             data = self._preprocessing_callback(data)
 
-        forecast = self.forecast_model.forecast(
-            prediction_interval, data, self.historical_label, timestep=self.timestep
-        )
+        return prediction_interval, data
 
+    def store_forecast(self, forecast):
+        """Postprocessing and storage of the forecast of the model, either run in this process or in a pool."""
         # Postprocessing forecast
         if self._postprocessing_callback is not None:
             forecast = self._postprocessing_callback(forecast)
@@ -171,6 +179,16 @@ class FixElectricalLoad(BaseElectricalLoad):
         self.load_forecast_array = forecast
         return forecast
 
+    def forecast_load(self, prediction_interval):
+        """This class connect to the InfluxDB to obtain historical data of the building consumption and uses the
+        Facebook Prophet to produce a forecast."""
+        prediction_interval, data = self.get_forecast_input(prediction_interval)
+        forecast = self.forecast_model.forecast(
+            prediction_interval, data, self.historical_label, timestep=self.timestep
+        )
+
+        return self.store_forecast(forecast)
+
 
 class SchedulableElectricalLoad(BaseElectricalLoad):
     def __init__(self):
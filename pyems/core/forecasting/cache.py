@@ -0,0 +1,168 @@
+"""Cache of forecast results shared across components and simulation steps.
+
+A forecast is identified by the model configuration, the target label, the regressors, a hash of the input data
+(training window and future regressors) and the prediction interval and timestep, so identical requests (components
+sharing a historical_label, re-solves within a step, parameter sweeps) are computed once.
+
+The forecasts of stateful models (stateful = True, e.g. the RecursiveLeastSquaresForecaster) also depend on the
+history they have seen, so their cache_identity includes their state.
+
+Example of use:
+    cache = ForecastCache(max_size=512, ttl=3600)
+    load = FixElectricalLoad(..., forecast_model=CachedForecaster(RidgeForecaster(), cache))
+"""
+
+import hashlib
+import inspect
+import logging
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+import pandas
+
+from pyems.config import Parameter
+from pyems.core.utils.hashing import hash_inputs
+
+
+def identity_values(value):
+    """Replaces the objects without a repr of their own (e.g. a nested model), whose default repr holds their memory
+    address, by their identity.
+    """
+
+    if isinstance(value, dict):
+        return {key: identity_values(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [identity_values(item) for item in value]
+    if type(value).__repr__ is object.__repr__:
+        return model_identity(value)
+    return value
+
+
+def configuration_identity(model):
+    """Class of the model plus a digest of its configuration: the constructor arguments kept as attributes of the same
+    name. The arrays are hashed with their full bytes. The fitted state and counters are not part of it.
+    """
+
+    parameters = inspect.signature(type(model).__init__).parameters
+    configuration = {name: getattr(model, name) for name in parameters if name != 'self' and hasattr(model, name)}
+    return f'{type(model).__module__}.{type(model).__qualname__}', hash_inputs(identity_values(configuration))
+
+
+def model_identity(model):
+    """The cache_identity attribute of the model, if it defines one, or its configuration_identity."""
+
+    identity = getattr(model, 'cache_identity', None)
+    if identity is not None:
+        return identity
+    return configuration_identity(model)
+
+
+def copy_forecast(forecast):
+    """Copy of a forecast DataFrame, or of a (forecast, scenarios) pair."""
+
+    if isinstance(forecast, tuple):
+        return tuple(item.copy() for item in forecast)
+    return forecast.copy()
+
+
+def hash_input_data(input_data):
+    """Digest of the values, index and columns of a DataFrame."""
+
+    digest = hashlib.sha1(pandas.util.hash_pandas_object(input_data, index=True).values.tobytes())
+    digest.update(repr(list(input_data.columns)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ForecastCache:
+    """Thread-safe LRU cache of forecasts with an optional time to live (in seconds) and hit/miss statistics."""
+
+    def __init__(self, max_size=256, ttl=None):
+        if max_size < 1:
+            raise ValueError('The cache must hold at least one forecast.')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (insertion time, forecast)
+        self._lock = threading.Lock()
+        self.hits, self.misses, self.evictions, self.expirations = 0, 0, 0, 0
+        self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.ForecastCache')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions, 'expirations': self.expirations, 'size': len(self._entries),
+        }
+
+    @staticmethod
+    def make_key(model, forecast_interval, input_data, target_label, timestep):
+        regressors = tuple(sorted(column for column in input_data.columns if column != target_label))
+        interval = tuple(pandas.Timestamp(t).isoformat() for t in forecast_interval)
+        return model_identity(model), target_label, regressors, hash_input_data(input_data), interval, timestep
+
+    def get(self, key):
+        """Returns a copy of the cached forecast, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy_forecast(entry[1])
+
+    def put(self, key, forecast):
+        with self._lock:
+            self._entries[key] = (monotonic(), copy_forecast(forecast))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def forecast(self, model, forecast_interval, input_data, target_label, timestep):
+        """Returns the cached forecast or computes it with model.forecast and stores it."""
+
+        key = self.make_key(model, forecast_interval, input_data, target_label, timestep)  # Before the model mutates it
+        forecast = self.get(key)
+        if forecast is None:
+            forecast = model.forecast(forecast_interval, input_data, target_label, timestep=timestep)
+            self.put(key, forecast)
+        else:
+            self.logger.info(f'Forecast of {target_label} served from the cache.')
+
+        return forecast
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CachedForecaster:
+    """Puts a ForecastCache in front of the forecast method of a model. The cache can be shared by many components."""
+
+    def __init__(self, model, cache=None):
+        self.model = model
+        self.cache = ForecastCache() if cache is None else cache
+
+    def forecast(self, forecast_interval, input_data, target_label, timestep):
+        return self.cache.forecast(self.model, forecast_interval, input_data, target_label, timestep)
@@ -0,0 +1,421 @@
+"""Pure NumPy forecast models with the same forecast(forecast_interval, input_data, target_label, timestep) contract
+as ProphetOracle. They need neither fbprophet nor pystan and fit in milliseconds, so they can replace the default
+forecast_model of FixElectricalLoad and StochasticElectricalGenerator.
+"""
+
+import logging
+
+import numpy
+import pandas
+
+from pyems.config import Parameter, Constant
+from pyems.core.forecasting.cache import configuration_identity
+from pyems.core.utils.hashing import hash_inputs
+from pyems.core.utils.time import check_time_interval, timestep_conversion, timestep_to_seconds
+
+NS = 10 ** 9
+DAY_NS = Constant.DAY_SECONDS * NS
+WEEK_NS = 7 * DAY_NS
+EPOCH_WEEKDAY = 3  # 1970-01-01 was a Thursday
+
+
+def calendar_features(timestamps, daily_harmonics=4, weekly_harmonics=3, weekend=True):
+    """Design matrix of Fourier terms of the daily and weekly cycles plus a weekend flag, for int64 ns timestamps."""
+
+    columns = []
+    for period, harmonics in [(DAY_NS, daily_harmonics), (WEEK_NS, weekly_harmonics)]:
+        phase = 2 * numpy.pi * (timestamps % period) / period
+        for k in range(1, harmonics + 1):
+            columns.append(numpy.sin(k * phase))
+            columns.append(numpy.cos(k * phase))
+    if weekend:
+        columns.append(((timestamps // DAY_NS + EPOCH_WEEKDAY) % 7 >= 5).astype(float))
+
+    return numpy.column_stack(columns) if columns else numpy.empty((timestamps.shape[0], 0))
+
+
+def residual_scenarios(residuals, horizon, n_scenarios, seed=None):
+    """Block bootstrap of the in-sample residuals: every scenario is a contiguous run of residuals of the horizon
+    length, which keeps their autocorrelation. Returns an array (n_scenarios, horizon).
+    """
+
+    residuals = residuals[~numpy.isnan(residuals)]
+    random = numpy.random.default_rng(seed)
+
+    if residuals.shape[0] >= horizon:
+        starts = random.integers(0, residuals.shape[0] - horizon + 1, n_scenarios)
+        return residuals[starts[:, None] + numpy.arange(horizon)]
+
+    return random.choice(residuals, (n_scenarios, horizon))
+
+
+def period_to_ns(period):
+    """Length of a period like '1d' or '7d' in nanoseconds. Unlike the timesteps, it may be longer than one hour."""
+    return timestep_to_seconds(period, check_length=False, check_hour_subdivision=False) * NS
+
+
+def naive_utc(datetime):
+    timestamp = pandas.Timestamp(datetime)
+    return timestamp if timestamp.tz is None else timestamp.tz_convert(None)
+
+
+class NumpyForecaster:
+    """Base class of the NumPy forecast models. It splits the input data in training and future samples as
+    ProphetOracle does and formats the output in the same way: a DataFrame with the target label as column and a utc
+    index named 'index'. Without future regressor rows, the forecast covers the interval with the end excluded, as the
+    simulation periods do. Subclasses implement fit_predict on plain arrays.
+    """
+
+    def __init__(self):
+        self.raw_index_label = 'index'
+        self.residuals = None  # In-sample residuals of the last fit, used to sample scenarios
+        self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.{type(self).__name__}')
+
+    def split_input(self, forecast_interval, input_data, target_label, timestep):
+        """Returns the training timestamps (int64 ns), target and regressors, and the future timestamps and regressors.
+        """
+
+        forecast_interval = check_time_interval(forecast_interval)
+
+        try:
+            input_data = input_data.tz_convert(None)
+        except TypeError:
+            pass
+
+        regressors = [column for column in input_data.columns if column != target_label]
+        input_data = input_data.interpolate()
+
+        start = naive_utc(forecast_interval[0])
+        training = input_data[input_data.index < start]
+        training = training[training[target_label].notna()]
+        test = input_data[input_data.index >= start]
+
+        if test.empty:
+            if regressors:
+                raise ValueError(f'Future values of the regressors {regressors} are required to forecast.')
+            freq = timestep_conversion(timestep, pd_units=True)
+            future_index = pandas.date_range(
+                start=naive_utc(forecast_interval[0]), end=naive_utc(forecast_interval[1]), freq=freq, closed='left'
+            )
+            x_future = numpy.empty((future_index.shape[0], 0))
+        else:
+            future_index = test.index
+            x_future = test[regressors].to_numpy(dtype=float)
+
+        y = training[target_label].to_numpy(dtype=float)
+        x_train = training[regressors].to_numpy(dtype=float)
+
+        return training.index.asi8, y, x_train, future_index.asi8, x_future
+
+    def to_frame(self, future_timestamps, values, target_label):
+        index = pandas.DatetimeIndex(future_timestamps).tz_localize('UTC')
+        forecast = pandas.DataFrame({target_label: values}, index=index)
+        forecast.index.rename(self.raw_index_label, inplace=True)
+        return forecast
+
+    def forecast(self, forecast_interval, input_data, target_label, timestep):
+        train_t, y, x_train, future_t, x_future = self.split_input(
+            forecast_interval, input_data, target_label, timestep
+        )
+        if y.shape[0] == 0:
+            raise ValueError(f'No training data available for {target_label}.')
+
+        values = self.fit_predict(train_t, y, x_train, future_t, x_future, timestep_to_seconds(timestep) * NS)
+
+        return self.to_frame(future_t, values, target_label)
+
+    def fit_predict(self, train_t, y, x_train, future_t, x_future, step_ns):
+        raise NotImplementedError
+
+    def forecast_scenarios(self, forecast_interval, input_data, target_label, timestep, n_scenarios=20, seed=None):
+        """Point forecast plus an array (n_scenarios, periods) of sampled scenarios: the point forecast plus a block
+        bootstrap of the in-sample residuals of the fit.
+        """
+
+        forecast = self.forecast(forecast_interval, input_data, target_label, timestep)
+        noise = residual_scenarios(self.residuals, forecast.shape[0], n_scenarios, seed=seed)
+
+        return forecast, forecast[target_label].values + noise
+
+    def forecast_quantiles(
+            self, forecast_interval, input_data, target_label, timestep, quantiles=(0.1, 0.5, 0.9), n_scenarios=200,
+            seed=None
+    ):
+        """Point forecast plus an array (len(quantiles), periods) with the quantiles of the sampled scenarios."""
+
+        forecast, scenarios = self.forecast_scenarios(
+            forecast_interval, input_data, target_label, timestep, n_scenarios=n_scenarios, seed=seed
+        )
+
+        return forecast, numpy.quantile(scenarios, quantiles, axis=0)
+
+
+class SeasonalNaiveForecaster(NumpyForecaster):
+    """Every future sample takes the value observed one (or more) seasons before. Regressors are ignored."""
+
+    def __init__(self, season='1d'):
+        super().__init__()
+        self.season_ns = period_to_ns(season)
+
+    def fit_predict(self, train_t, y, x_train, future_t, x_future, step_ns):
+        seasons_back = -(-(future_t - train_t[-1]) // self.season_ns)  # Ceil division
+        source_t = future_t - seasons_back * self.season_ns
+        position = numpy.clip(numpy.searchsorted(train_t, source_t), 0, train_t.shape[0] - 1)
+
+        lagged = numpy.searchsorted(train_t, train_t - self.season_ns)
+        valid = lagged < train_t.shape[0]
+        valid[valid] = train_t[lagged[valid]] == train_t[valid] - self.season_ns
+        self.residuals = y[valid] - y[lagged[valid]]
+
+        return y[position]
+
+
+class HoltWintersForecaster(NumpyForecaster):
+    """Additive Holt-Winters with damped trend. The smoothing parameters are chosen by one-step-ahead squared error over
+    a small grid; the recursion runs once for all the candidates at the same time. Regressors are ignored.
+    """
+
+    def __init__(self, season='1d', alphas=(0.05, 0.2, 0.5), betas=(0.0, 0.05), gammas=(0.05, 0.2, 0.5), phi=0.98):
+        super().__init__()
+        self.season = season
+        grid = numpy.array(numpy.meshgrid(alphas, betas, gammas, indexing='ij')).reshape(3, -1)
+        self.alphas, self.betas, self.gammas = grid
+        self.phi = phi
+        self.params = None
+
+    def fit_predict(self, train_t, y, x_train, future_t, x_future, step_ns):
+        m = max(int(period_to_ns(self.season) // step_ns), 1)
+        if y.shape[0] < 2 * m:
+            raise ValueError('Holt-Winters requires at least two seasons of training data.')
+
+        alpha, beta, gamma, phi = self.alphas, self.betas, self.gammas, self.phi
+        candidates = alpha.shape[0]
+
+        level = numpy.full(candidates, y[:m].mean())
+        trend = numpy.full(candidates, (y[m:2 * m].mean() - y[:m].mean()) / m)
+        seasonal = numpy.tile(y[:m] - y[:m].mean(), (candidates, 1))
+        errors = numpy.empty((y.shape[0], candidates))
+
+        for t in range(y.shape[0]):
+            s = seasonal[:, t % m]
+            errors[t] = y[t] - (level + phi * trend + s)
+            new_level = alpha * (y[t] - s) + (1 - alpha) * (level + phi * trend)
+            trend = beta * (new_level - level) + (1 - beta) * phi * trend
+            seasonal[:, t % m] = gamma * (y[t] - new_level) + (1 - gamma) * s
+            level = new_level
+
+        best = int(numpy.argmin((errors ** 2).sum(axis=0)))
+        self.params = {'alpha': alpha[best], 'beta': beta[best], 'gamma': gamma[best], 'phi': phi}
+        self.residuals = errors[m:, best]  # One-step errors after the first season
+
+        steps = numpy.maximum(numpy.rint((future_t - train_t[-1]) / step_ns).astype(int), 1)
+        damped = numpy.cumsum(phi ** numpy.arange(1, steps.max() + 1))[steps - 1]
+        return level[best] + damped * trend[best] + seasonal[best, (y.shape[0] + steps - 1) % m]
+
+
+class RidgeForecaster(NumpyForecaster):
+    """Ridge regression on Fourier terms of the daily and weekly cycles, a weekend flag and the standardized
+    regressors. Solved in closed form with the normal equations.
+    """
+
+    def __init__(self, daily_harmonics=4, weekly_harmonics=3, weekend=True, alpha=1.0):
+        super().__init__()
+        self.daily_harmonics = daily_harmonics
+        self.weekly_harmonics = weekly_harmonics
+        self.weekend = weekend
+        self.alpha = alpha
+        self.coefficients = None
+
+    def design_matrix(self, timestamps, regressors, mean, std):
+        calendar = calendar_features(timestamps, self.daily_harmonics, self.weekly_harmonics, self.weekend)
+        return numpy.column_stack([numpy.ones(timestamps.shape[0]), calendar, (regressors - mean) / std])
+
+    def fit_predict(self, train_t, y, x_train, future_t, x_future, step_ns):
+        mean, std = x_train.mean(axis=0), x_train.std(axis=0)
+        std[std == 0] = 1
+
+        x = self.design_matrix(train_t, x_train, mean, std)
+        penalty = self.alpha * numpy.eye(x.shape[1])
+        penalty[0, 0] = 0  # The intercept is not penalized
+        self.coefficients = numpy.linalg.solve(x.T @ x + penalty, x.T @ y)
+        self.residuals = y - x @ self.coefficients
+
+        return self.design_matrix(future_t, x_future, mean, std) @ self.coefficients
+
+
+class RecursiveLeastSquaresForecaster(RidgeForecaster):
+    """Online counterpart of RidgeForecaster. The coefficients are updated by recursive least squares with a forgetting
+    factor and the state is kept between calls (per target label), so a rolling step only processes the samples newer
+    than the last one seen: O(1) in the length of the history. The first call, or a call that goes back in time or
+    changes the regressors, fits the whole training window in closed form.
+
+    The regressors are standardized with the statistics of that first fit, which are then kept frozen.
+    """
+
+    stateful = True
+
+    def __init__(self, daily_harmonics=4, weekly_harmonics=3, weekend=True, alpha=1.0, forgetting=0.999):
+        super().__init__(daily_harmonics=daily_harmonics, weekly_harmonics=weekly_harmonics, weekend=weekend,
+                         alpha=alpha)
+        self.forgetting = forgetting
+        # target_label -> {'coefficients', 'P', 'mean', 'std', 'regressors', 'last_timestamp', 'residuals'}
+        self.states = {}
+        self.updates = 0
+
+    @property
+    def cache_identity(self):
+        """Configuration plus the state of every label, the forecasts depend on the history seen."""
+        return configuration_identity(self) + (hash_inputs(self.states),)
+
+    def forecast(self, forecast_interval, input_data, target_label, timestep):
+        state = self.states.get(target_label)  # Only replaced once the new state is computed
+        regressors = [column for column in input_data.columns if column != target_label]
+
+        if state is not None and state['regressors'] == regressors:
+            try:
+                index = input_data.index.tz_convert(None)
+            except TypeError:
+                index = input_data.index
+            last_timestamp = pandas.Timestamp(state['last_timestamp'])
+            forecast_start = naive_utc(check_time_interval(forecast_interval)[0])
+            if index.shape[0] > 0 and index[0] <= last_timestamp < forecast_start:
+                input_data = input_data[index > last_timestamp]  # Only the new samples and the future
+            else:
+                state = None  # The window does not follow the state, start again
+        else:
+            state = None
+
+        train_t, y, x_train, future_t, x_future = self.split_input(
+            forecast_interval, input_data, target_label, timestep
+        )
+
+        if state is None:
+            if y.shape[0] == 0:
+                raise ValueError(f'No training data available for {target_label}.')
+            state = self.initial_fit(train_t, y, x_train, regressors)
+        elif y.shape[0] > 0:
+            state = self.update(state, train_t, y, x_train)
+
+        self.states[target_label] = state
+        self.coefficients, self.residuals = state['coefficients'], state['residuals']
+        values = self.design_matrix(future_t, x_future, state['mean'], state['std']) @ self.coefficients
+
+        return self.to_frame(future_t, values, target_label)
+
+    def initial_fit(self, train_t, y, x_train, regressors):
+        mean, std = x_train.mean(axis=0), x_train.std(axis=0)
+        std[std == 0] = 1
+
+        x = self.design_matrix(train_t, x_train, mean, std)
+        weights = self.forgetting ** numpy.arange(y.shape[0] - 1, -1, -1)
+        information = (x.T * weights) @ x + self.alpha * numpy.eye(x.shape[1])
+        p = numpy.linalg.inv(information)
+        coefficients = p @ ((x.T * weights) @ y)
+
+        return {
+            'coefficients': coefficients, 'P': p, 'mean': mean, 'std': std,
+            'regressors': regressors, 'last_timestamp': train_t[-1], 'residuals': y - x @ coefficients
+        }
+
+    def update(self, state, train_t, y, x_train):
+        """Recursive least squares update with each new sample. The a priori errors replace the oldest residuals.
+        Returns a new state, the given one is not modified.
+        """
+
+        x = self.design_matrix(train_t, x_train, state['mean'], state['std'])
+        w, p, forgetting = state['coefficients'], state['P'], self.forgetting
+        errors = numpy.empty(y.shape[0])
+
+        for i, (row, target) in enumerate(zip(x, y)):
+            p_row = p @ row
+            gain = p_row / (forgetting + row @ p_row)
+            errors[i] = target - row @ w
+            w = w + gain * errors[i]
+            p = (p - numpy.outer(gain, p_row)) / forgetting
+
+        window = state['residuals'].shape[0]
+        residuals = numpy.concatenate([state['residuals'], errors])[-window:]
+        self.updates += y.shape[0]
+
+        return dict(state, coefficients=w, P=p, last_timestamp=train_t[-1], residuals=residuals)
+
+
+class GlobalRidgeForecaster(RidgeForecaster):
+    """RidgeForecaster for many series at once. The series with the same training and future timestamps and number of
+    regressors share the calendar part of the design matrix and are solved together: one solve with a right-hand side
+    per series when there are no regressors, or one batched solve of the stacked normal equations otherwise. Each
+    series gets the same coefficients as with RidgeForecaster.
+
+    A System routes every component sharing an instance of this model to forecast_many in a single call.
+    """
+
+    def __init__(self, daily_harmonics=4, weekly_harmonics=3, weekend=True, alpha=1.0):
+        super().__init__(daily_harmonics=daily_harmonics, weekly_harmonics=weekly_harmonics, weekend=weekend,
+                         alpha=alpha)
+        self.batches = 0
+
+    def forecast(self, forecast_interval, input_data, target_label, timestep):
+        forecast = self.forecast_many(forecast_interval, [input_data], [target_label], timestep)[0]
+        self.residuals = self.residuals[0]
+        return forecast
+
+    def forecast_many(self, forecast_interval, inputs, target_labels, timestep):
+        """Forecasts every (input_data, target_label) pair. Returns the list of forecasts in the same order."""
+
+        splits = [
+            self.split_input(forecast_interval, input_data, target_label, timestep)
+            for input_data, target_label in zip(inputs, target_labels)
+        ]
+
+        groups = {}
+        for position, (train_t, y, x_train, future_t, _) in enumerate(splits):
+            if y.shape[0] == 0:
+                raise ValueError(f'No training data available for {target_labels[position]}.')
+            key = (train_t.tobytes(), future_t.tobytes(), x_train.shape[1])
+            groups.setdefault(key, []).append(position)
+
+        forecasts = [None] * len(splits)
+        for positions in groups.values():
+            values = self.fit_predict_many([splits[position] for position in positions])
+            for position, series_values in zip(positions, values):
+                forecasts[position] = self.to_frame(splits[position][3], series_values, target_labels[position])
+        self.batches = len(groups)
+
+        return forecasts
+
+    def fit_predict_many(self, splits):
+        """Solves a group of series sharing timestamps. Returns an array with a row of forecast values per series."""
+
+        train_t, future_t = splits[0][0], splits[0][3]
+        y = numpy.stack([split[1] for split in splits])
+        x_train = numpy.stack([split[2] for split in splits])
+        x_future = numpy.stack([split[4] for split in splits])
+
+        shared_train = self.design_matrix(train_t, numpy.empty((train_t.shape[0], 0)), 0, 1)
+        shared_future = self.design_matrix(future_t, numpy.empty((future_t.shape[0], 0)), 0, 1)
+
+        penalty = self.alpha * numpy.eye(shared_train.shape[1] + x_train.shape[2])
+        penalty[0, 0] = 0  # The intercept is not penalized
+
+        if x_train.shape[2] == 0:
+            coefficients = numpy.linalg.solve(shared_train.T @ shared_train + penalty, shared_train.T @ y.T).T
+            self.coefficients = coefficients
+            self.residuals = y - coefficients @ shared_train.T
+            return coefficients @ shared_future.T
+
+        mean, std = x_train.mean(axis=1, keepdims=True), x_train.std(axis=1, keepdims=True)
+        std[std == 0] = 1
+
+        series = y.shape[0]
+        x = numpy.concatenate(
+            [numpy.broadcast_to(shared_train, (series,) + shared_train.shape), (x_train - mean) / std], axis=2
+        )
+        x_hat = numpy.concatenate(
+            [numpy.broadcast_to(shared_future, (series,) + shared_future.shape), (x_future - mean) / std], axis=2
+        )
+        gram = numpy.einsum('snk,snj->skj', x, x) + penalty
+        coefficients = numpy.linalg.solve(gram, numpy.einsum('snk,sn->sk', x, y)[..., None])[..., 0]
+        self.coefficients = coefficients
+        self.residuals = y - numpy.einsum('snk,sk->sn', x, coefficients)
+
+        return numpy.einsum('snk,sk->sn', x_hat, coefficients)
@@ -0,0 +1,244 @@
+"""Process pool to run the forecasts of many system components in parallel.
+
+The forecast models are CPU bound (e.g. a Prophet fit per component), so they are dispatched to worker processes. The
+input data travels as NumPy arrays instead of pickled DataFrames, and only the forecast arrays travel back.
+
+The models stay resident in the workers: a model is pickled to a worker only the first time, and later tasks just name
+it. Its state (e.g. the fitted models of a ProphetOracle or the recursive state of a RecursiveLeastSquaresForecaster)
+therefore lives and evolves in the worker. The tasks of a model are routed by target label, always to the same worker,
+so the state kept per label is never split nor lost, even when many components with different labels share one model.
+The resident copies can be inspected with fetch_model.
+"""
+
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy
+import pandas
+
+from pyems.config import Parameter
+
+_resident_models = {}  # Worker side: model token -> model
+
+
+def frame_to_arrays(frame):
+    """Splits a time indexed DataFrame into (int64 utc nanoseconds, time zone, float values, column labels)."""
+
+    index = frame.index
+    tz = None if index.tz is None else str(index.tz)
+    return index.asi8.copy(), tz, frame.to_numpy(dtype=float), list(frame.columns)
+
+
+def arrays_to_frame(timestamps, tz, values, columns):
+    """Inverse of frame_to_arrays."""
+
+    index = pandas.DatetimeIndex(timestamps)
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return pandas.DataFrame(values, index=index, columns=columns)
+
+
+def run_forecast_task(token, model, forecast_interval, input_arrays, target_label, timestep, scenarios=None):
+    """Worker side of ForecastPool: keeps the model resident (it is only sent the first time), rebuilds the input data
+    and runs the forecast. Returns ('forecast', forecast arrays) or, with scenarios (n_scenarios, seed), ('scenarios',
+    forecast arrays, scenarios) with the result of forecast_scenarios.
+    """
+
+    if model is not None:
+        _resident_models[token] = model
+    elif token not in _resident_models:
+        raise LookupError(f'The model {token} is not resident in this worker.')
+
+    model, input_data = _resident_models[token], arrays_to_frame(*input_arrays)
+    if scenarios is not None:
+        n_scenarios, seed = scenarios
+        forecast, scenarios = model.forecast_scenarios(
+            forecast_interval, input_data, target_label, timestep, n_scenarios=n_scenarios, seed=seed
+        )
+        return 'scenarios', frame_to_arrays(forecast), scenarios
+
+    return 'forecast', frame_to_arrays(model.forecast(forecast_interval, input_data, target_label, timestep=timestep))
+
+
+def fetch_resident_model(token):
+    return _resident_models.get(token)
+
+
+def forget_resident_model(token):
+    _resident_models.pop(token, None)
+
+
+class ForecastPool:
+    """Pool of worker processes living across the simulation steps. The workers are created on first use.
+
+    Each task is a tuple (model, forecast_interval, input_data, target_label, timestep) with the same arguments as the
+    forecast method of the models, plus optionally scenarios, a tuple (n_scenarios, seed) to run forecast_scenarios
+    instead. A model is sent to a worker once and then kept there (see the module docstring): the changes made to the
+    model in the parent process afterwards are not seen by the workers, unless it is forgotten (see forget) and sent
+    again.
+
+    If a worker dies (e.g. killed for lack of memory) it is replaced and its tasks are sent once more, with their
+    models. The state the models had in that worker is lost.
+    """
+
+    def __init__(self, max_workers=None, mp_context=None):
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count() or 1
+        self.mp_context = mp_context
+        self._executors = None
+        self._tokens = {}  # id(model) -> (model, token)
+        self._routes = {}  # (token, target_label) -> worker
+        self._resident = set()  # (token, worker)
+        self._token_counter = itertools.count()
+        self._worker_counter = itertools.count()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.ForecastPool')
+
+    @property
+    def executors(self):
+        """One single process executor per worker, so the tasks can be routed to the worker holding their model."""
+        if self._executors is None:
+            self._executors = [
+                ProcessPoolExecutor(max_workers=1, mp_context=self.mp_context) for _ in range(self.max_workers)
+            ]
+        return self._executors
+
+    def model_token(self, model):
+        entry = self._tokens.get(id(model))
+        if entry is None:
+            entry = self._tokens[id(model)] = (model, next(self._token_counter))
+        return entry[1]
+
+    def route(self, model, target_label):
+        """Token of the model and worker of its target label, assigned in turns the first time."""
+
+        with self._lock:
+            token = self.model_token(model)
+            if (token, target_label) not in self._routes:
+                self._routes[token, target_label] = next(self._worker_counter) % self.max_workers
+            return token, self._routes[token, target_label]
+
+    def submit(self, model, forecast_interval, input_data, target_label, timestep, scenarios=None):
+        return self._submit(model, forecast_interval, input_data, target_label, timestep, scenarios)[0]
+
+    def _submit(self, model, forecast_interval, input_data, target_label, timestep, scenarios=None):
+        """submit, also returning the worker of the task and its executor. Replaces the executor if it is broken."""
+
+        token, worker = self.route(model, target_label)
+        arguments = (forecast_interval, frame_to_arrays(input_data), target_label, timestep, scenarios)
+        future, executor, send = self._queue(token, worker, model, arguments)
+        if future is None:  # The worker died after its last task
+            self.restart_worker(worker, executor)
+            future, executor, send = self._queue(token, worker, model, arguments)
+            if future is None:
+                raise BrokenProcessPool(f'The forecast worker {worker} could not be restarted.')
+
+        if send:
+            def check_sent(done):
+                if done.cancelled() or done.exception() is not None:  # E.g. the model could not be pickled
+                    with self._lock:
+                        if self._executors is not None and self._executors[worker] is executor:
+                            self._resident.discard((token, worker))
+
+            future.add_done_callback(check_sent)
+
+        return future, worker, executor
+
+    def _queue(self, token, worker, model, arguments):
+        """Queues the task in the executor of the worker. Returns the future (None if the executor is broken), the
+        executor and whether the model is sent.
+        """
+
+        with self._lock:  # The task sending the model is queued first, also with tasks submitted from many threads
+            executor = self.executors[worker]
+            send = (token, worker) not in self._resident
+            try:
+                future = executor.submit(run_forecast_task, token, model if send else None, *arguments)
+            except BrokenProcessPool:
+                return None, executor, send
+            self._resident.add((token, worker))
+
+        return future, executor, send
+
+    def restart_worker(self, worker, broken):
+        """Replaces the broken executor of a worker, unless it was already replaced. The models resident in it are
+        lost, so the next tasks send them again.
+        """
+
+        with self._lock:
+            if self._executors is None or self._executors[worker] is not broken:
+                return
+            self.logger.warning(f'Forecast worker {worker} died, starting a new one.')
+            self._executors[worker] = ProcessPoolExecutor(max_workers=1, mp_context=self.mp_context)
+            self._resident = {(token, resident) for token, resident in self._resident if resident != worker}
+
+        broken.shutdown(wait=False)
+
+    @staticmethod
+    def result(future):
+        """The forecast DataFrame of a submitted task, or the (forecast, scenarios) pair of a task with scenarios."""
+
+        kind, *result = future.result()
+        if kind == 'scenarios':
+            return arrays_to_frame(*result[0]), result[1]
+        return arrays_to_frame(*result[0])
+
+    def forecast(self, tasks):
+        """Runs all the tasks concurrently. Returns a list with their results (see result) in the same order. The tasks
+        of a worker that died are sent once more to its replacement.
+        """
+
+        self.logger.info(f'Dispatching {len(tasks)} forecasts to the process pool.')
+        submitted = [self._submit(*task) for task in tasks]
+
+        results, retries = [None] * len(tasks), []
+        for position, (future, worker, executor) in enumerate(submitted):
+            try:
+                results[position] = self.result(future)
+            except BrokenProcessPool:
+                self.restart_worker(worker, executor)
+                retries.append(position)
+
+        futures = {position: self.submit(*tasks[position]) for position in retries}
+        for position, future in futures.items():
+            results[position] = self.result(future)
+
+        return results
+
+    def fetch_model(self, model, target_label):
+        """Copy of the model resident in the worker of target_label (with its state), or None if it was never used."""
+
+        with self._lock:
+            token = self._tokens[id(model)][1] if id(model) in self._tokens else None
+            worker = self._routes.get((token, target_label))
+        if worker is None or (token, worker) not in self._resident:
+            return None
+
+        return self.executors[worker].submit(fetch_resident_model, token).result()
+
+    def forget(self, model):
+        """Drops the copies of the model in the workers. The next task sends the model again."""
+
+        with self._lock:
+            entry = self._tokens.pop(id(model), None)
+            if entry is None:
+                return
+            token = entry[1]
+            workers = {worker for resident_token, worker in self._resident if resident_token == token}
+            self._resident = {(t, w) for t, w in self._resident if t != token}
+            self._routes = {key: worker for key, worker in self._routes.items() if key[0] != token}
+
+        for worker in workers:
+            self.executors[worker].submit(forget_resident_model, token).result()
+
+    def close(self):
+        if self._executors is not None:
+            for executor in self._executors:
+                executor.shutdown()
+            self._executors = None
+        self._tokens.clear()
+        self._routes.clear()
+        self._resident.clear()
@@ -1,11 +1,17 @@
 
 
 import pandas as pd
+import numpy as np
 import logging
+import hashlib
+import json
 import os
 
 from fbprophet import Prophet
-from pyems.core.utils.time import check_time_interval, timestep_conversion
+from fbprophet.serialize import model_to_json, model_from_json
+from pyems.core.utils.time import check_time_interval, timestep_conversion, timestep_to_seconds
+from pyems.core.forecasting.cache import configuration_identity
+from pyems.core.utils.hashing import hash_inputs
 from pyems.config import Parameter
 
 
@@ -38,70 +44,272 @@ class suppress_stdout_stderr(object):
 
 
 class ProphetOracle:
+    """Forecaster based on FB Prophet.
 
-    def __init__(self):
+    The fitted models are cached by target label and set of regressors. A cached model is refitted only when the
+    training data has advanced refit_every (e.g. '1d') since its last fit, or when drift is detected: the RMSE of the
+    observations arrived since the last fit exceeds drift_threshold times the model noise scale (sigma_obs). Otherwise
+    only predict is run on the new interval. With refit_every=None every call refits, as without the cache.
+
+    If model_path is given, the fitted models are persisted there as json and reloaded after a restart.
+
+    With warm_start=True every refit starts the Stan optimization from the parameters (k, m, delta, beta, sigma_obs)
+    of the previous fit of the same model instead of from scratch.
+    """
+
+    def __init__(self, refit_every=None, drift_threshold=None, model_path=None, warm_start=False):
         self.y_hat = 'yhat'
         self.ph_index = 'ds'
         self.raw_index_label = 'index'
         self.raw_target_label = 'y'
-        self.datetime_format = '%Y-%m-%d %H:%M:%S'
         self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.ProphetOracle')
 
-    def forecast(self, forecast_interval, input_data, target_label, timestep):
+        if refit_every is not None:
+            refit_every = pd.Timedelta(
+                seconds=timestep_to_seconds(refit_every, check_length=False, check_hour_subdivision=False)
+            )
+        self.refit_every = refit_every
+        self.drift_threshold = drift_threshold
+        self.model_path = model_path
+        self.models = {}  # (target_label, regressors) -> {'model': Prophet, 'fitted_until': pandas.Timestamp}
+        self.warm_start = warm_start
+        self.warm_start_params = {}  # (target_label, regressors) -> Stan initialization
+        self.fits, self.reuses = 0, 0
 
-        forecast_interval = check_time_interval(forecast_interval)
+        if model_path is not None:
+            os.makedirs(model_path, exist_ok=True)
 
-        try:
-            input_data.index = input_data.index.tz_convert(None)
-        except TypeError:
-            pass
+    @property
+    def stateful(self):
+        """The forecasts depend on the earlier fits only with the model cache (refit_every) or the warm start."""
+        return self.refit_every is not None or self.warm_start
 
-        columns = list(input_data.columns)
-        columns.remove(target_label)
+    @property
+    def cache_identity(self):
+        """Configuration plus the fitted models the forecasts may reuse (in memory and in model_path) and the warm start
+        parameters. Without refit_every every call refits, so only the warm start parameters matter.
+        """
 
-        if len(columns) > 0:
-            self.logger.info(f'Using regressors: {columns}, in FB Prophet model.')
+        state = {'warm_start': self.warm_start_params if self.warm_start else None}
+        if self.refit_every is not None:
+            state['models'] = {
+                key: (entry['fitted_until'], entry['model'].params) for key, entry in self.models.items()
+            }
+            if self.model_path is not None:
+                state['files'] = sorted(
+                    (entry.name, entry.stat().st_mtime_ns) for entry in os.scandir(self.model_path)
+                    if entry.name.endswith('.json')
+                )
 
-        input_data.interpolate(inplace=True)
+        return configuration_identity(self) + (hash_inputs(state),)
+
+    @staticmethod
+    def model_key(target_label, regressors):
+        return target_label, tuple(sorted(regressors))
+
+    def _model_file(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.model_path, f'prophet_{digest}.json')
+
+    def load_model(self, key):
+        """Returns the cached entry of a model, reading it from model_path if it is not in memory."""
 
-        training_data = input_data[input_data.index < forecast_interval[0]].copy()
-        test_data = input_data[input_data.index >= forecast_interval[0]].copy()
+        if key in self.models:
+            return self.models[key]
+        if self.model_path is None or not os.path.isfile(self._model_file(key)):
+            return None
 
-        training_data[self.raw_index_label] = training_data.index.strftime(self.datetime_format)
-        training_data.reset_index(inplace=True, drop=True)
-        rename_columns = {self.raw_index_label: self.ph_index, target_label: self.raw_target_label}
-        training_data.rename(index=str, columns=rename_columns, inplace=True)
+        with open(self._model_file(key), 'r') as f:
+            stored = json.load(f)
+        entry = {'model': model_from_json(stored['model']), 'fitted_until': pd.Timestamp(stored['fitted_until'])}
+        self.models[key] = entry
 
+        return entry
+
+    def store_model(self, key, model, fitted_until):
+        self.models[key] = {'model': model, 'fitted_until': fitted_until}
+
+        if self.model_path is not None:
+            stored = {'key': list(key), 'fitted_until': fitted_until.isoformat(), 'model': model_to_json(model)}
+            with open(self._model_file(key), 'w') as f:
+                json.dump(stored, f)
+
+    def drift_detected(self, model, new_data):
+        """Compares the observations arrived since the last fit with the model prediction."""
+
+        if self.drift_threshold is None or new_data.empty:
+            return False
+
+        observed = new_data[self.raw_target_label].values
+        predicted = model.predict(new_data.drop(columns=[self.raw_target_label]))[self.y_hat].values
+        rmse = np.sqrt(np.nanmean((observed - predicted) ** 2))
+        noise = float(np.mean(model.params['sigma_obs'])) * model.y_scale
+
+        return rmse > self.drift_threshold * noise
+
+    def needs_refit(self, entry, training_data):
+        if entry is None or self.refit_every is None:
+            return True
+
+        last_observation = pd.Timestamp(training_data[self.ph_index].iloc[-1])
+        if last_observation - entry['fitted_until'] >= self.refit_every:
+            self.logger.info('Scheduled refit of FB Prophet model.')
+            return True
+
+        new_data = training_data[training_data[self.ph_index] > entry['fitted_until']]
+        if self.drift_detected(entry['model'], new_data):
+            self.logger.info('Drift detected, refitting FB Prophet model.')
+            return True
+
+        return False
+
+    @staticmethod
+    def stan_init(model):
+        """Parameters of a fitted model in the format expected by the Stan initialization."""
+
+        return {
+            'k': model.params['k'][0][0],
+            'm': model.params['m'][0][0],
+            'sigma_obs': model.params['sigma_obs'][0][0],
+            'delta': model.params['delta'][0],
+            'beta': model.params['beta'][0],
+        }
+
+    @staticmethod
+    def new_model(regressors):
         model = Prophet()
-        for column in columns:
+        for column in regressors:
             model.add_regressor(column)
+        return model
+
+    def fit(self, training_data, regressors, init=None):
+        model = self.new_model(regressors)
 
         self.logger.info('Training FB Prophet model.')
 
         with suppress_stdout_stderr():
-            model.fit(training_data)
+            if init is None:
+                model.fit(training_data)
+            else:
+                try:
+                    model.fit(training_data, init=init)
+                except (RuntimeError, ValueError):
+                    # The number of changepoints or seasonal features changed since the previous fit
+                    self.logger.info('Warm start not compatible with the new data, fitting from scratch.')
+                    model = self.new_model(regressors)
+                    model.fit(training_data)
+        self.fits += 1
+
+        return model
+
+    def prophet_frame(self, data, target_label=None, regressors=()):
+        """Builds the frame expected by Prophet (ds, y and regressor columns) straight from the datetime64 index and
+        the column arrays, in one construction.
+        """
+
+        frame = {self.ph_index: data.index.values}
+        if target_label is not None:
+            frame[self.raw_target_label] = data[target_label].values
+        for column in regressors:
+            frame[column] = data[column].values
+
+        return pd.DataFrame(frame)
+
+    def split_input(self, forecast_interval, input_data, target_label, timestep):
+        """Returns the Prophet frames of the training data and of the forecast interval."""
+
+        try:
+            input_data.index = input_data.index.tz_convert(None)
+        except TypeError:
+            pass
+
+        columns = list(input_data.columns)
+        columns.remove(target_label)
+
+        input_data.interpolate(inplace=True)
+
+        if input_data.index.is_monotonic_increasing:
+            split = input_data.index.searchsorted(forecast_interval[0])
+            training_data, test_data = input_data.iloc[:split], input_data.iloc[split:]
+        else:
+            in_training = input_data.index < forecast_interval[0]
+            training_data, test_data = input_data[in_training], input_data[~in_training]
+
+        training_data = self.prophet_frame(training_data, target_label, columns)
 
         if test_data.empty:
             timestep = timestep_conversion(timestep, pd_units=True)
-            future = pd.date_range(start=forecast_interval[0], end=forecast_interval[1], freq=timestep).values
-            test_data = pd.DataFrame({self.ph_index: future})
+            future = pd.date_range(start=forecast_interval[0], end=forecast_interval[1], freq=timestep)
+            test_data = pd.DataFrame({self.ph_index: future.values})
         else:
-            test_data[self.raw_index_label] = test_data.index.strftime(self.datetime_format)
-            test_data.reset_index(inplace=True, drop=True)
-            rename_columns = {self.raw_index_label: self.ph_index, target_label: self.raw_target_label}
-            test_data.rename(index=str, columns=rename_columns, inplace=True)
-            test_data.drop(columns=[self.raw_target_label], inplace=True)
+            test_data = self.prophet_frame(test_data, regressors=columns)
+
+        return training_data, test_data, columns
+
+    def forecast_table_to_frame(self, forecast_table, target_label):
+        index = pd.DatetimeIndex(forecast_table[self.ph_index].values, name=self.raw_index_label).tz_localize('UTC')
+        return pd.DataFrame({target_label: forecast_table[self.y_hat].values}, index=index)
+
+    def fitted_model(self, forecast_interval, input_data, target_label, timestep):
+        """Returns the model (cached or refitted) for the target and the Prophet frame of the forecast interval."""
+
+        forecast_interval = check_time_interval(forecast_interval)
+        training_data, test_data, columns = self.split_input(forecast_interval, input_data, target_label, timestep)
+
+        if len(columns) > 0:
+            self.logger.info(f'Using regressors: {columns}, in FB Prophet model.')
+
+        key = self.model_key(target_label, columns)
+        entry = self.load_model(key)
+
+        if self.needs_refit(entry, training_data):
+            init = self.warm_start_params.get(key) if self.warm_start else None
+            if init is None and self.warm_start and entry is not None:
+                init = self.stan_init(entry['model'])
+            model = self.fit(training_data, columns, init=init)
+            self.store_model(key, model, pd.Timestamp(training_data[self.ph_index].iloc[-1]))
+            if self.warm_start:
+                self.warm_start_params[key] = self.stan_init(model)
+        else:
+            model = entry['model']
+            self.reuses += 1
+
+        return model, test_data
+
+    def forecast(self, forecast_interval, input_data, target_label, timestep):
+
+        model, test_data = self.fitted_model(forecast_interval, input_data, target_label, timestep)
 
         self.logger.info('Producing FB Prophet forecast.')
 
         forecast_table = model.predict(test_data)
-        forecast_table.set_index(self.ph_index, drop=True, inplace=True)
-        forecast_table.index = pd.to_datetime(forecast_table.index, format=self.datetime_format, utc=True)
 
-        forecast = forecast_table.loc[:, [self.y_hat]]
-        forecast.rename(columns={self.y_hat: target_label}, inplace=True)
-        forecast.index.rename(self.raw_index_label, inplace=True)
+        return self.forecast_table_to_frame(forecast_table, target_label)
+
+    def forecast_scenarios(self, forecast_interval, input_data, target_label, timestep, n_scenarios=20, seed=None):
+        """Point forecast plus an array (n_scenarios, periods) drawn from the Prophet predictive samples (trend and
+        observation noise), the same samples behind its uncertainty intervals.
+        """
+
+        model, test_data = self.fitted_model(forecast_interval, input_data, target_label, timestep)
+
+        self.logger.info('Producing FB Prophet forecast scenarios.')
+
+        forecast_table = model.predict(test_data)
+        samples = model.predictive_samples(test_data)[self.y_hat]  # Array (periods, uncertainty_samples)
+        replace = n_scenarios > samples.shape[1]
+        chosen = np.random.default_rng(seed).choice(samples.shape[1], n_scenarios, replace=replace)
+
+        return self.forecast_table_to_frame(forecast_table, target_label), np.ascontiguousarray(samples[:, chosen].T)
 
-        return forecast
+    def forecast_quantiles(
+            self, forecast_interval, input_data, target_label, timestep, quantiles=(0.1, 0.5, 0.9), n_scenarios=200,
+            seed=None
+    ):
+        """Point forecast plus an array (len(quantiles), periods) with the quantiles of the predictive samples."""
 
+        forecast, scenarios = self.forecast_scenarios(
+            forecast_interval, input_data, target_label, timestep, n_scenarios=n_scenarios, seed=seed
+        )
 
+        return forecast, np.quantile(scenarios, quantiles, axis=0)
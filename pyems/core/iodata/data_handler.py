@@ -1,9 +1,72 @@
+import threading
+from collections import OrderedDict
+
 import pandas
 from pyems.core.entity.entity import Entity
 
 
+class SharedSeriesCache:
+    """Cache of data series shared by several data handlers, for the labels whose data is the same for all of them
+    (e.g. the electricity prices, common to every site of a fleet). Only the given labels are cached. Concurrent
+    requests of the same series wait for a single load.
+    """
+
+    def __init__(self, labels, max_size=256):
+        self.labels = set(labels)
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._loading = {}  # key -> lock held while the series is loaded
+        self._lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def make_key(label, prediction_interval, historical_interval, timestep, kwargs):
+        intervals = tuple(
+            None if interval is None else tuple(pandas.Timestamp(t).isoformat() for t in interval)
+            for interval in [prediction_interval, historical_interval]
+        )
+        return (label,) + intervals + (timestep, tuple(sorted(kwargs.items())))
+
+    def get_or_load(self, key, load):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key].copy()
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            try:
+                with self._lock:
+                    if key in self._entries:  # Loaded by another thread meanwhile
+                        self.hits += 1
+                        return self._entries[key].copy()
+                    self.misses += 1
+                series = load()
+                with self._lock:
+                    self._entries[key] = series.copy()
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+            finally:  # Also when the load fails, the next request loads again
+                with self._lock:
+                    self._loading.pop(key, None)
+
+        return series
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class BaseDataHandler(Entity):
-    def __init__(self, name='data_handler', timestep=None):
+    """A system may prepare its inputs from many threads (see System.preparation_graph), so the requests to the
+    dispatchers can run concurrently. A handler whose data source client is not thread-safe sets serialize_requests to
+    True: its requests then run one at a time.
+    """
+
+    serialize_requests = False
+
+    def __init__(self, name='data_handler', timestep=None, shared_cache=None):
         super().__init__(name=name, entity_type='data_handler')
         if timestep is not None:
             self.timestep = timestep
@@ -12,6 +75,30 @@ class BaseDataHandler(Entity):
 
         self._series_dispatcher = None
         self._point_dispatcher = None
+        self.shared_cache = shared_cache
+        self._request_lock = threading.RLock()
+
+    def _dispatch(self, function, **kwargs):
+        if not self.serialize_requests:
+            return function(**kwargs)
+        with self._request_lock:
+            return function(**kwargs)
+
+    def _get_series(self, label, prediction_interval, historical_interval, timestep, **kwargs):
+        if label not in self._series_dispatcher.keys():
+            raise KeyError(f'Unable to find the handler of the label: {label}.')
+
+        def load():
+            return self._dispatch(
+                self._series_dispatcher[label], prediction_interval=prediction_interval,
+                historical_interval=historical_interval, **kwargs
+            )
+
+        if self.shared_cache is not None and label in self.shared_cache.labels:
+            key = self.shared_cache.make_key(label, prediction_interval, historical_interval, timestep, kwargs)
+            return self.shared_cache.get_or_load(key, load)
+
+        return load()
 
     def get_data_series(self, labels, prediction_interval=None, historical_interval=None, timestep=None, **kwargs):
         """Obtain data series from DataHandler.
@@ -32,12 +119,7 @@ class BaseDataHandler(Entity):
 
         if isinstance(labels, str):  # In case of a unique label
             label = labels
-            if label not in self._series_dispatcher.keys():
-                raise KeyError(f'Unable to find the handler of the label: {label}.')
-
-            series = self._series_dispatcher[label](
-                prediction_interval=prediction_interval, historical_interval=historical_interval, **kwargs
-            )
+            series = self._get_series(label, prediction_interval, historical_interval, timestep, **kwargs)
 
             if isinstance(series, pandas.DataFrame):
                 return series
@@ -51,13 +133,7 @@ class BaseDataHandler(Entity):
             labels[:0]  # Duck test for list-like
             container = []
             for label in labels:
-                if label not in self._series_dispatcher.keys():
-                    raise KeyError(f'Unable to find the handler of the label: {label}.')
-
-                series = self._series_dispatcher[label](
-                    prediction_interval=prediction_interval, historical_interval=historical_interval, **kwargs
-                )
-
+                series = self._get_series(label, prediction_interval, historical_interval, timestep, **kwargs)
                 container.append(series)
 
             return pandas.concat(container, axis=1)
@@ -69,9 +145,7 @@ class BaseDataHandler(Entity):
             if label not in self._point_dispatcher.keys():
                 raise KeyError(f'Unable to find the handler of the label: {label}.')
 
-            point = self._point_dispatcher[label](
-                prediction_interval=prediction_interval, **kwargs
-            )
+            point = self._dispatch(self._point_dispatcher[label], prediction_interval=prediction_interval, **kwargs)
 
             return point
 
@@ -82,9 +156,7 @@ class BaseDataHandler(Entity):
                 if label not in self._point_dispatcher.keys():
                     raise KeyError(f'Unable to find the handler of the label: {label}.')
 
-                point = self._point_dispatcher[label](
-                    prediction_interval=prediction_interval, **kwargs
-                )
+                point = self._dispatch(self._point_dispatcher[label], prediction_interval=prediction_interval, **kwargs)
 
                 container.append(point)
 
@@ -1,19 +1,30 @@
 
 import datetime
+import logging
+import os
+import threading
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
 import pytz
+import numpy
 import pandas
-from requests import get
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from pyems.config import Parameter, Constant
-from pyems.core.utils.time import check_time_interval, timestep_conversion, series_upsampling
+from pyems.core.utils.time import check_time_interval, timestep_conversion, series_upsampling_repeat
+
+logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.ioapis')
 
 
 # REE
 
 
 def get_spanish_electricity_prices(
-        time_interval, timestep, tariff='tariff_2.0A', token=None, utc_interval=True, last_included=False
+        time_interval, timestep, tariff='tariff_2.0A', token=None, utc_interval=True, last_included=False, cache=None,
+        client=None
 ):
 
     time_interval = check_time_interval(time_interval, str_format=Parameter.UTC_DATETIME_FORMAT)
@@ -33,10 +44,10 @@ def get_spanish_electricity_prices(
 
         prices = get_hourly_spanish_electricity_prices(
             time_interval=hourly_interval, utc_interval=utc_interval, token=token, tariff=tariff,
-            last_included=last_included
+            last_included=last_included, cache=cache, client=client
         )
         prices = prices.to_frame('prices')  # Convert pandas.Series to pandas.DataFrame
-        prices = series_upsampling(
+        prices = series_upsampling_repeat(
             prices, new_time_interval=time_interval, new_timestep=timestep, old_timestep=hour_step,
             upsample_values=False
         )
@@ -44,37 +55,29 @@ def get_spanish_electricity_prices(
     else:
         prices = get_hourly_spanish_electricity_prices(
             time_interval=time_interval, utc_interval=utc_interval, token=token, tariff=tariff,
-            last_included=last_included
+            last_included=last_included, cache=cache, client=client
         )
 
     return prices
 
 
 def get_hourly_spanish_electricity_prices(
-        time_interval, tariff='tariff_2.0A', token=None, utc_interval=True, last_included=False
+        time_interval, tariff='tariff_2.0A', token=None, utc_interval=True, last_included=False, cache=None,
+        client=None
 ):
     """Get prices from REE (spanish TSO) for the household electricity prices.
 
+    If a SpanishElectricityPriceCache is given, the days already stored are served from disk and only the missing
+    days are requested to the ESIOS API. Long intervals are requested day by day, concurrently, through the ApiClient
+    (the module api_client by default).
+
+    The series always covers the whole interval, the hours the API did not return (e.g. not published yet) are NaN.
+
     Some reading regading localize and pytz
         - https://stackoverflow.com/questions/1379740/pytz-localize-vs-datetime-replace
         - http://pytz.sourceforge.net/
     """
 
-    time_zone = 'Europe/Madrid'
-    tariff_indicators = {  # See https://www.esios.ree.es/en/pvpc
-        'tariff_2.0A': '1013',
-        'tariff_2.0DHA': '1014',
-        'tariff_2.0DHS': '1015'
-    }
-    request_headers = {
-        "Accept": "application/json; application/vnd.esios-api-v1+json",
-        "Content-Type": "application/json",
-        "Host": "api.esios.ree.es",
-        "Authorization": f"Token token=\"{token}\"",
-        "Cookie": ""
-    }
-    url = f'https://api.esios.ree.es/indicators/{tariff_indicators[tariff]}'
-
     try:
         time_interval[0]
     except TypeError:
@@ -89,7 +92,7 @@ def get_hourly_spanish_electricity_prices(
     if not utc_interval:
 
         utc_tz = pytz.utc
-        spain_tz = pytz.timezone(time_zone)
+        spain_tz = pytz.timezone(REE_TIME_ZONE)
         start_datetime_sp = spain_tz.localize(start_datetime)
         end_datetime_sp = spain_tz.localize(end_datetime)
 
@@ -99,11 +102,92 @@ def get_hourly_spanish_electricity_prices(
         start_datetime_utc = start_datetime
         end_datetime_utc = end_datetime
 
+    def fetch(start, end):
+        return request_ree_prices_by_day(start, end, tariff=tariff, token=token, client=client)
+
+    if cache is None:
+        price_series = fetch(start_datetime_utc.replace(tzinfo=None), end_datetime_utc.replace(tzinfo=None))
+    else:
+        price_series = cache.get_prices(
+            start_datetime_utc.replace(tzinfo=None), end_datetime_utc.replace(tzinfo=None), tariff=tariff, fetch=fetch
+        )
+
+    # The series is labeled with the same kind of time (utc or local) than the interval.
+    hour_seconds = 3600
+    vector_length = int((end_datetime_utc - start_datetime_utc).total_seconds() / hour_seconds) + 1
+    values = numpy.full(vector_length, numpy.nan)
+    available = price_series.values.astype(float)[:vector_length]
+    values[:available.shape[0]] = available
+    missing = int(numpy.isnan(values).sum())
+    if missing:
+        logger.warning(f'REE did not return {missing} of the {vector_length} hourly prices requested from '
+                       f'{start_datetime_utc}, they are NaN.')
+    price_series = pandas.Series(data=values, index=hourly_datetime_index(start_datetime, vector_length))
+
+    return price_series
+
+
+REE_TIME_ZONE = 'Europe/Madrid'
+ESIOS_API_URL = 'https://api.esios.ree.es'
+FORECAST_SOLAR_API_URL = 'https://api.forecast.solar'
+REE_TARIFF_INDICATORS = {  # See https://www.esios.ree.es/en/pvpc
+    'tariff_2.0A': '1013',
+    'tariff_2.0DHA': '1014',
+    'tariff_2.0DHS': '1015'
+}
+
+
+def request_ree_prices_by_day(
+        start_datetime_utc, end_datetime_utc, tariff='tariff_2.0A', token=None, client=None, days_per_request=1
+):
+    """Splits the interval in requests of days_per_request days that are fetched concurrently (up to the
+    max_workers of the client) and joins the results.
+    """
+
+    client = api_client if client is None else client
+
+    request_hours = days_per_request * Constant.DAY_HOURS
+    total_hours = int((end_datetime_utc - start_datetime_utc).total_seconds() / Constant.HOUR_SECONDS) + 1
+    intervals = [
+        (
+            start_datetime_utc + datetime.timedelta(hours=h),
+            start_datetime_utc + datetime.timedelta(hours=min(h + request_hours, total_hours) - 1)
+        )
+        for h in range(0, total_hours, request_hours)
+    ]
+
+    if len(intervals) == 1:
+        return request_ree_prices(start_datetime_utc, end_datetime_utc, tariff=tariff, token=token, client=client)
+
+    parts = client.map(
+        lambda interval: request_ree_prices(interval[0], interval[1], tariff=tariff, token=token, client=client),
+        intervals
+    )
+
+    return pandas.concat(parts)
+
+
+def request_ree_prices(start_datetime_utc, end_datetime_utc, tariff='tariff_2.0A', token=None, client=None):
+    """Requests the hourly prices between two o'clock utc datetimes (both included) to the ESIOS API. Returns a series
+    indexed by the utc start of each hour, with NaN in the hours missing in the answer.
+    """
+
+    client = api_client if client is None else client
+
+    request_headers = {
+        "Accept": "application/json; application/vnd.esios-api-v1+json",
+        "Content-Type": "application/json",
+        "Host": "api.esios.ree.es",
+        "Authorization": f"Token token=\"{token}\"",
+        "Cookie": ""
+    }
+    url = f'{ESIOS_API_URL}/indicators/{REE_TARIFF_INDICATORS[tariff]}'
+
     start_datetime_str = start_datetime_utc.strftime(Parameter.O_CLOCK_FORMAT)
     end_datetime_str = end_datetime_utc.strftime(Parameter.O_CLOCK_FORMAT)
 
     payload = {'start_date': start_datetime_str, 'end_date': end_datetime_str}
-    response = get(url, headers=request_headers, params=payload)
+    response = client.get(url, headers=request_headers, params=payload)
 
     ok_code = 200
     if response.status_code == ok_code:
@@ -114,18 +198,128 @@ def get_hourly_spanish_electricity_prices(
     response_json = response.json()
     hour_seconds = 3600
     vector_length = int((end_datetime_utc - start_datetime_utc).total_seconds() / hour_seconds) + 1
+    prices = ree_values_to_series(response_json['indicator']['values'], start_datetime_utc, vector_length)
+    if prices.shape[0] < vector_length:
+        # E.g. the prices of the next day are not published yet
+        logger.warning(f'REE returned {prices.shape[0]} of the {vector_length} hourly prices requested from '
+                       f'{start_datetime_str}, the missing hours are NaN.')
+        prices = prices.reindex(hourly_datetime_index(start_datetime_utc, vector_length))
 
-    price_vector = [response_json['indicator']['values'][h]['value'] / Constant.KILO for h in range(vector_length)]
-    time_index = [start_datetime + datetime.timedelta(hours=h) for h in range(vector_length)]
+    return prices
 
-    price_series = pandas.Series(data=price_vector, index=time_index)
 
-    return price_series
+def hourly_datetime_index(start_datetime, periods):
+    """Naive DatetimeIndex of consecutive hours built with numpy.arange on datetime64."""
+    start = numpy.datetime64(start_datetime.replace(tzinfo=None), 'h')
+    return pandas.DatetimeIndex(numpy.arange(start, start + periods, dtype='datetime64[h]').astype('datetime64[ns]'))
+
+
+def ree_values_to_series(values, start_datetime_utc, vector_length=None):
+    """Decodes the 'values' list of an ESIOS indicator response (EUR/MWh) into an hourly series in EUR/kWh indexed by
+    the utc start of each hour.
+    """
+
+    vector_length = len(values) if vector_length is None else min(vector_length, len(values))
+    price_vector = numpy.fromiter(map(itemgetter('value'), values), dtype=float, count=vector_length) / Constant.KILO
+
+    return pandas.Series(data=price_vector, index=hourly_datetime_index(start_datetime_utc, vector_length))
+
+
+class SpanishElectricityPriceCache:
+    """Persistent cache of the hourly PVPC prices, one file per tariff and local (Spanish) day.
+
+    Each day is stored as a NumPy .npy float64 array with the 23, 24 or 25 hourly prices of the day, the utc times are
+    derived from the date and the time zone. The prices of a day are immutable once published (the day before at
+    publication_time), so a stored day is never requested again. Days that are not yet published, or that the API
+    returned incomplete, are not stored and will be requested again in the following calls.
+
+    Example of use:
+        cache = SpanishElectricityPriceCache('price_cache')
+        prices = get_spanish_electricity_prices(interval, '15m', token=token, cache=cache)
+    """
+
+    def __init__(self, path, publication_time='20:15', time_zone=REE_TIME_ZONE):
+        self.path = path
+        self.publication_time = datetime.time.fromisoformat(publication_time)
+        self.local_tz = pytz.timezone(time_zone)
+        self.hits = 0
+        self.misses = 0
+
+    def day_utc_hours(self, day):
+        """Utc (tz naive) start of every hour of a local day."""
+        start = self.local_tz.localize(datetime.datetime.combine(day, datetime.time(0))).astimezone(pytz.utc)
+        end = self.local_tz.localize(
+            datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(0))
+        ).astimezone(pytz.utc)
+        return pandas.date_range(
+            start=start.replace(tzinfo=None), end=end.replace(tzinfo=None), freq='1H', closed='left'
+        )
+
+    def local_days(self, start_utc, end_utc):
+        """Local days touched by the utc interval [start_utc, end_utc]."""
+        first = pytz.utc.localize(start_utc).astimezone(self.local_tz).date()
+        last = pytz.utc.localize(end_utc).astimezone(self.local_tz).date()
+        return [first + datetime.timedelta(days=d) for d in range((last - first).days + 1)]
+
+    def is_published(self, day, now_utc=None):
+        if now_utc is None:
+            now_utc = datetime.datetime.utcnow()
+        publication = self.local_tz.localize(
+            datetime.datetime.combine(day - datetime.timedelta(days=1), self.publication_time)
+        ).astimezone(pytz.utc).replace(tzinfo=None)
+        return now_utc >= publication
+
+    def _day_file(self, tariff, day):
+        return os.path.join(self.path, tariff, f'{day.isoformat()}.npy')
+
+    def load_day(self, tariff, day):
+        try:
+            return numpy.load(self._day_file(tariff, day))
+        except FileNotFoundError:
+            return None
+
+    def store_day(self, tariff, day, values):
+        file_name = self._day_file(tariff, day)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        temporary_file_name = f'{file_name}.{os.getpid()}.tmp'
+        with open(temporary_file_name, 'wb') as f:
+            numpy.save(f, numpy.asarray(values, dtype=numpy.float64))
+        os.replace(temporary_file_name, file_name)  # Atomic, concurrent readers never see a partial file
+
+    def get_prices(self, start_utc, end_utc, tariff, fetch, now_utc=None):
+        """Hourly prices between two utc o'clock datetimes (both included). fetch(start_utc, end_utc) is called once
+        with the smallest interval covering the missing days and must return a series indexed by utc hour.
+        """
+
+        days = self.local_days(start_utc, end_utc)
+        day_values = {day: self.load_day(tariff, day) for day in days}
+        missing = [day for day, values in day_values.items() if values is None]
+        self.hits += len(days) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            fetch_start = self.day_utc_hours(missing[0])[0]
+            fetch_end = self.day_utc_hours(missing[-1])[-1]
+            fetched = fetch(fetch_start, fetch_end)
+
+            for day in missing:
+                hours = self.day_utc_hours(day)
+                values = fetched.reindex(hours).values.astype(float)
+                # An incomplete day (missing hours are NaN) is never stored
+                if values.shape[0] == hours.shape[0] and not numpy.isnan(values).any() \
+                        and self.is_published(day, now_utc=now_utc):
+                    self.store_day(tariff, day, values)
+                day_values[day] = values
+
+        index = pandas.DatetimeIndex(numpy.concatenate([self.day_utc_hours(day).values for day in days]))
+        prices = pandas.Series(numpy.concatenate([day_values[day] for day in days]), index=index)
+
+        return prices[(prices.index >= start_utc) & (prices.index <= end_utc)]
 
 
 # Solar website
 
-def get_forecast_solar_website(time_interval, lat, long, declination, azimuth, pv_power):
+def get_forecast_solar_website(time_interval, lat, long, declination, azimuth, pv_power, client=None):
     """Get data from the website forecast.solar.
     This website is still work in progress. The output have some errors.
 
@@ -141,8 +335,10 @@ def get_forecast_solar_website(time_interval, lat, long, declination, azimuth, p
 
     time_interval = check_time_interval(time_interval, last_step_included=True)
 
-    query = f"https://api.forecast.solar/estimate/{lat}/{long}/{declination}/{azimuth}/{pv_power}"
-    response = get(query).json()
+    client = api_client if client is None else client
+
+    query = f"{FORECAST_SOLAR_API_URL}/estimate/{lat}/{long}/{declination}/{azimuth}/{pv_power}"
+    response = client.get(query).json()
 
     index = list(response['result']['watt_hours'].keys())
     values = list(response['result']['watt_hours'].values())
@@ -152,3 +348,67 @@ def get_forecast_solar_website(time_interval, lat, long, declination, azimuth, p
     results = forecast[(forecast.index > time_interval[0]) & (forecast.index < time_interval[1])]
 
     return results
+
+
+# HTTP CLIENT
+
+
+class ApiClient:
+    """HTTP client shared by the external API functions.
+
+    It holds a pooled requests.Session (keep-alive connections), applies a default timeout to every request, retries
+    the idempotent requests that fail with connection errors or 429/5xx status using exponential backoff and runs
+    concurrent requests in a thread pool capped at max_workers.
+
+    The url_overrides map replaces base urls, e.g. to send the requests to a local stand-in server:
+        client = ApiClient(url_overrides={ESIOS_API_URL: 'http://127.0.0.1:8000'})
+    """
+
+    def __init__(
+            self, pool_size=10, max_workers=4, timeout=(5, 30), retries=3, backoff_factor=0.5,
+            retry_status=(429, 500, 502, 503, 504), url_overrides=None
+    ):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.url_overrides = url_overrides if url_overrides is not None else {}
+
+        retry = Retry(
+            total=retries, connect=retries, read=retries, backoff_factor=backoff_factor,
+            status_forcelist=retry_status, raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _resolve(self, url):
+        for base_url, replacement in self.url_overrides.items():
+            if url.startswith(base_url):
+                return replacement + url[len(base_url):]
+        return url
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(self._resolve(url), **kwargs)
+
+    def map(self, function, items):
+        """Applies function to every item concurrently and returns the results in order."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pyems-api')
+            executor = self._executor
+        return list(executor.map(function, items))
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.session.close()
+
+
+api_client = ApiClient()
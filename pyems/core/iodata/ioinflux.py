@@ -11,26 +11,45 @@ Examples of queries:
 
 """
 
+import atexit
+import collections
 import datetime
+import logging
+import re
+import threading
+from time import sleep
 
 import pandas
 import numpy
 from influxdb import InfluxDBClient
 
 from pyems.config import Parameter
-from pyems.core.utils.time import check_time_interval, timestep_conversion, series_upsampling
+from pyems.core.utils.time import check_time_interval, timestep_conversion, series_upsampling, timestep_to_seconds
 
 
 # INPUT
 
 
-def get_hourly_stored_series(time_interval, timestep, upsample_values=False, **kwargs):
+def get_hourly_stored_series(time_interval, timestep, upsample_values=False, source_timestep='1h', **kwargs):
+    """Get a series stored in InfluxDB at the requested timestep.
+
+    When the resolution of the stored data (source_timestep) is at least as fine as the requested timestep, the
+    timestep and the aggregation are pushed down to InfluxDB (GROUP BY time(<timestep>) fill(linear)), so only the
+    needed rows are transferred. Otherwise, the series is fetched hourly and upsampled in pandas.
+    """
 
     time_interval = check_time_interval(time_interval, str_format=Parameter.UTC_DATETIME_FORMAT)
 
     old_timestep = '1h'
+    function = kwargs.get('function', 'INTEGRAL')
+
+    if timestep != old_timestep and can_push_down_timestep(timestep, source_timestep, function, upsample_values):
+        series = get_df_from_influxdb(
+            time_interval=time_interval, timestep=timestep_conversion(timestep, std_units=True), fill='linear',
+            check_before_utc_now=False, **kwargs
+        )
 
-    if timestep != old_timestep:
+    elif timestep != old_timestep:
 
         hourly_interval = time_interval.copy()
 
@@ -56,13 +75,43 @@ def get_hourly_stored_series(time_interval, timestep, upsample_values=False, **k
     return series
 
 
+EXTENSIVE_INFLUX_FUNCTIONS = {'INTEGRAL', 'SUM', 'COUNT'}
+
+
+def can_push_down_timestep(timestep, source_timestep, function, upsample_values):
+    """Checks whether InfluxDB can aggregate directly at the requested timestep with the same meaning as the client
+    upsampling. The stored data must be at least as fine as the timestep. Extensive aggregations (e.g. INTEGRAL) match
+    an upsampling that splits the values (upsample_values=True) and intensive ones (e.g. MEAN) match a plain repetition.
+    """
+
+    if source_timestep is None or function is None:
+        return False
+
+    if timestep_to_seconds(source_timestep, check_length=False) > timestep_to_seconds(timestep):
+        return False
+
+    return (function.upper() in EXTENSIVE_INFLUX_FUNCTIONS) == bool(upsample_values)
+
+
 def get_df_from_influxdb(
         entities, function='INTEGRAL', time_interval=None, timestep='1h', query_extra_conditions=None,
         db_credentials=None, db_network_route=None, ssl=False, utc_labeled=False,
-        series_names=None, check_before_utc_now=True, check_timestep_length=True, check_timestep_hour_subdivision=True
+        series_names=None, check_before_utc_now=True, check_timestep_length=True, check_timestep_hour_subdivision=True,
+        batch_entities=False, chunk_periods=None, fill=None, client=None
 ):
     """Query SGIL DB for an specific data series and function and return the result in df form. The database store data
     in utc time and then the interval must be also in utc time.
+
+    With batch_entities=True all the entities of a measurement are fetched in a single query grouped by entity_id
+    instead of one query per entity. Entities with extra conditions are still queried one by one.
+
+    With chunk_periods the interval is read in consecutive queries of chunk_periods timesteps each. Every chunk is
+    decoded into NumPy arrays and copied into a preallocated array over the complete index, so the peak memory is
+    proportional to the chunk size instead of the whole training span.
+
+    The fill argument is passed to the GROUP BY clause, i.e. fill='linear' produces fill(linear).
+
+    A client object (e.g. the fake client of pyems.tools.influxdb_standin) can be injected instead of connecting.
     """
 
     if function is not None and timestep is None:
@@ -82,42 +131,69 @@ def get_df_from_influxdb(
         start=time_interval[0], end=time_interval[1], freq=pandas_timestep, closed='left'
     )
 
-    client = connect_to_influxdb(db_credentials=db_credentials, db_network_route=db_network_route, ssl=ssl)
+    if client is None:
+        client = connect_to_influxdb(db_credentials=db_credentials, db_network_route=db_network_route, ssl=ssl)
+
+    value_label = Parameter.INFLUX_VALUE_LABEL if function is None else function
 
     series_list = []
     for key in entities.keys():
-        for entity in entities[key]:
-            query_elements = ['SELECT']
-            if function is not None:
-                query_elements.append(f'{function}(\"{Parameter.INFLUX_VALUE_LABEL}\")')
-            else:
-                query_elements.append(f'\"{Parameter.INFLUX_VALUE_LABEL}\"')
-            query_elements.append(f'FROM \"{key}\"')
-
-            conditions = []
-            if entity is not None:
-                conditions.append(f'\"entity_id\"=\'{entity}\'')
-            if time_interval is not None:
-                conditions.append(f'(time >= \'{time_interval[0]}\' AND time < \'{time_interval[1]}\')')
-            if query_extra_conditions is not None:
-                try:
-                    conditions += query_extra_conditions[entity]
-                except KeyError:
-                    pass
-            if conditions:
-                query_elements.append('WHERE')
-                condition_statement = ' AND '.join(conditions)
-                query_elements.append(condition_statement)
 
-            if function is not None and timestep is not None:
-                query_elements.append(f'GROUP BY time({timestep})')
+        fetched_series = {}
+        batched = []
+        if batch_entities:
+            batched = [
+                entity for entity in entities[key]
+                if entity is not None and (query_extra_conditions is None or entity not in query_extra_conditions)
+            ]
+
+        if chunk_periods is not None:
+            if len(batched) > 1:
+                fetched_series.update(read_chunked_influxdb_series(
+                    client, key, batched, complete_index, chunk_periods, function=function, timestep=timestep,
+                    fill=fill
+                ))
+            for entity in entities[key]:
+                if entity in fetched_series:
+                    continue
+                extra_conditions = None
+                if query_extra_conditions is not None:
+                    extra_conditions = query_extra_conditions.get(entity)
+                fetched_series.update(read_chunked_influxdb_series(
+                    client, key, entity, complete_index, chunk_periods, function=function, timestep=timestep,
+                    extra_conditions=extra_conditions, fill=fill
+                ))
+
+        elif batch_entities:
+            if len(batched) > 1:
+                query = build_influxdb_query(
+                    key, function=function, entities=batched, time_interval=time_interval, timestep=timestep,
+                    group_by_entity=True, fill=fill
+                )
+                response = client.query(query, epoch=Parameter.INFLUX_EPOCH_PRECISION)
+                fetched_series = influxdb_grouped_response_to_series(
+                    response, value_label, epoch=Parameter.INFLUX_EPOCH_PRECISION
+                )
+                for entity in batched:
+                    fetched_series.setdefault(entity, pandas.Series(dtype=float))
 
-            query = ' '.join(query_elements)
-
-            response = client.query(query)
-            if function is None:
-                function = Parameter.INFLUX_VALUE_LABEL
-            series = influxdb_response_to_series(response, function)
+        for entity in entities[key]:
+            if entity in fetched_series:
+                series = fetched_series[entity]
+            else:
+                extra_conditions = None
+                if query_extra_conditions is not None:
+                    extra_conditions = query_extra_conditions.get(entity)
+
+                query = build_influxdb_query(
+                    key, function=function, entities=entity, time_interval=time_interval, timestep=timestep,
+                    extra_conditions=extra_conditions, fill=fill
+                )
+                response = client.query(query, epoch=Parameter.INFLUX_EPOCH_PRECISION)
+                times, values = influxdb_response_to_arrays(
+                    response, value_label, epoch=Parameter.INFLUX_EPOCH_PRECISION
+                )
+                series = pandas.Series(values, index=times)
 
             series_name = entity
             if series_names is not None:
@@ -125,16 +201,8 @@ def get_df_from_influxdb(
                     series_name = series_names[(key, entity)]
                 except KeyError:
                     pass
-            series = series.rename(series_name)
-
-            series.index = pandas.to_datetime(series.index)
-            if not utc_labeled:
-                series.index = series.index.tz_convert(None)  # Delete the utc localize attribute
-            if series.shape[0] < complete_index.shape[0]:
-                series = series.reindex(complete_index)  # Fills the index gaps
 
-            series.interpolate(inplace=True)
-            series.fillna(method='bfill', inplace=True)  # In case the first sample is nan (not filled by interpolate)
+            series = complete_influxdb_series(series, series_name, complete_index, utc_labeled=utc_labeled)
             series_list.append(series)
 
     results = pandas.concat(series_list, axis=1)
@@ -142,6 +210,161 @@ def get_df_from_influxdb(
     return results
 
 
+def build_influxdb_query(
+        measurement, function=None, entities=None, time_interval=None, timestep=None, extra_conditions=None,
+        group_by_entity=False, fill=None
+):
+    """Builds the InfluxQL SELECT statement used to fetch the series of one or several entities of a measurement.
+    A list of entities is matched with a regular expression on the entity_id tag.
+    """
+
+    query_elements = ['SELECT']
+    if function is not None:
+        query_elements.append(f'{function}(\"{Parameter.INFLUX_VALUE_LABEL}\")')
+    else:
+        query_elements.append(f'\"{Parameter.INFLUX_VALUE_LABEL}\"')
+    query_elements.append(f'FROM \"{measurement}\"')
+
+    conditions = []
+    if isinstance(entities, str):
+        conditions.append(f'\"entity_id\"=\'{entities}\'')
+    elif entities is not None:
+        conditions.append(f'\"entity_id\" =~ /{entity_id_regex(entities)}/')
+    if time_interval is not None:
+        conditions.append(f'(time >= \'{time_interval[0]}\' AND time < \'{time_interval[1]}\')')
+    if extra_conditions is not None:
+        conditions += extra_conditions
+    if conditions:
+        query_elements.append('WHERE')
+        condition_statement = ' AND '.join(conditions)
+        query_elements.append(condition_statement)
+
+    group_by = []
+    if function is not None and timestep is not None:
+        group_by.append(f'time({timestep})')
+    if group_by_entity:
+        group_by.append('\"entity_id\"')
+    if group_by:
+        query_elements.append('GROUP BY ' + ', '.join(group_by))
+        if fill is not None and function is not None:
+            query_elements.append(f'fill({fill})')
+
+    query = ' '.join(query_elements)
+
+    return query
+
+
+def entity_id_regex(entities):
+    """Anchored regular expression matching exactly the given entity ids."""
+    alternatives = '|'.join(re.escape(entity).replace('/', '\\/') for entity in entities)
+    return f'^({alternatives})$'
+
+
+def complete_influxdb_series(series, series_name, complete_index, utc_labeled=False):
+    """Names the series, aligns it with the complete index of the query interval and fills the gaps."""
+
+    series = series.rename(series_name)
+
+    series.index = pandas.to_datetime(series.index, utc=True)
+    if not utc_labeled:
+        series.index = series.index.tz_convert(None)  # Delete the utc localize attribute
+    if series.shape[0] < complete_index.shape[0]:
+        series = series.reindex(complete_index)  # Fills the index gaps
+
+    series.interpolate(inplace=True)
+    series.fillna(method='bfill', inplace=True)  # In case the first sample is nan (not filled by interpolate)
+
+    return series
+
+
+def read_chunked_influxdb_series(
+        client, measurement, entities, complete_index, chunk_periods, function=None, timestep=None,
+        extra_conditions=None, fill=None
+):
+    """Reads the series of one entity (str) or several entities (list, grouped query) chunk by chunk. Each chunk is
+    placed by position into a preallocated float array aligned with complete_index. Missing samples are left as NaN.
+    """
+
+    entity_list = [entities] if isinstance(entities, str) or entities is None else list(entities)
+    periods = complete_index.shape[0]
+    arrays = {entity: numpy.full(periods, numpy.nan) for entity in entity_list}
+
+    if periods == 0:
+        return {entity: pandas.Series(array, index=complete_index) for entity, array in arrays.items()}
+
+    start = complete_index[0].to_datetime64().astype('datetime64[ns]')
+    step = numpy.timedelta64(pandas.Timedelta(complete_index.freq).value, 'ns')
+    end = complete_index[-1] + complete_index.freq
+
+    for first in range(0, periods, chunk_periods):
+        last = first + chunk_periods
+        chunk_interval = [complete_index[first], complete_index[last] if last < periods else end]
+
+        query = build_influxdb_query(
+            measurement, function=function, entities=entities, time_interval=chunk_interval, timestep=timestep,
+            extra_conditions=extra_conditions, group_by_entity=len(entity_list) > 1, fill=fill
+        )
+        response = client.query(query, epoch=Parameter.INFLUX_EPOCH_PRECISION)
+
+        for raw_series in response.raw.get('series', []):
+            entity = raw_series['tags']['entity_id'] if len(entity_list) > 1 else entity_list[0]
+            if entity not in arrays:
+                continue
+
+            times, values = influxdb_raw_series_to_arrays(
+                raw_series, function, epoch=Parameter.INFLUX_EPOCH_PRECISION
+            )
+            positions = (times - start) // step
+            in_range = (positions >= 0) & (positions < periods)
+            arrays[entity][positions[in_range]] = values[in_range]
+
+    return {entity: pandas.Series(array, index=complete_index) for entity, array in arrays.items()}
+
+
+def influxdb_raw_series_to_arrays(raw_series, function, epoch=None):
+    """Converts one raw series of an InfluxDB response into a datetime64[ns] array of utc times (tz naive) and a
+    float64 array of values.
+
+    The values table is converted by NumPy in one call, with no per-point dicts. When the query was issued with an
+    epoch precision (client.query(query, epoch='s')) the time column is already numeric and no string is parsed. Use
+    second or millisecond precision, nanosecond epochs do not fit exactly in a float64.
+    """
+
+    function = Parameter.INFLUX_VALUE_LABEL if function is None else function.lower()
+
+    columns = raw_series['columns']
+    time_column, value_column = columns.index('time'), columns.index(function)
+    rows = raw_series.get('values', [])
+
+    if not rows:
+        return numpy.array([], dtype='datetime64[ns]'), numpy.array([], dtype=float)
+
+    if epoch is None:
+        times = pandas.to_datetime([row[time_column] for row in rows], utc=True).tz_convert(None).values
+        values = numpy.array([row[value_column] for row in rows], dtype=float)
+    else:
+        table = numpy.array(rows, dtype=float)  # None values become NaN
+        epoch_unit = 'us' if epoch == 'u' else epoch
+        times = table[:, time_column].astype(numpy.int64).astype(f'datetime64[{epoch_unit}]').astype('datetime64[ns]')
+        values = table[:, value_column]
+
+    return times, values
+
+
+def influxdb_response_to_arrays(response, function, epoch=None):
+    """Fast counterpart of influxdb_response_to_series returning NumPy arrays. See influxdb_raw_series_to_arrays."""
+
+    raw_series = response.raw.get('series', [])
+
+    if not raw_series:
+        return influxdb_raw_series_to_arrays({'columns': ['time', 'value'], 'values': []}, None)
+    elif len(raw_series) == 1:
+        return influxdb_raw_series_to_arrays(raw_series[0], function, epoch=epoch)
+    else:
+        arrays = [influxdb_raw_series_to_arrays(series, function, epoch=epoch) for series in raw_series]
+        return numpy.concatenate([a[0] for a in arrays]), numpy.concatenate([a[1] for a in arrays])
+
+
 def influxdb_response_to_series(response, function):
     """Converts influx response Points into pandas Series
     """
@@ -158,6 +381,19 @@ def influxdb_response_to_series(response, function):
     return series
 
 
+def influxdb_grouped_response_to_series(response, function, tag='entity_id', epoch=None):
+    """Splits a response grouped by a tag (GROUP BY "entity_id") into one pandas Series per tag value. The raw series
+    of the response are walked once, so the demultiplexing costs a single pass over the returned rows.
+    """
+
+    series_dict = {}
+    for raw_series in response.raw.get('series', []):
+        times, values = influxdb_raw_series_to_arrays(raw_series, function, epoch=epoch)
+        series_dict[raw_series['tags'][tag]] = pandas.Series(values, index=times)
+
+    return series_dict
+
+
 # OUTPUT
 
 
@@ -176,23 +412,36 @@ def write_point_to_influxdb(measurement, entity_id, value, db_connection_paramet
         'fields': {'value': value}
     }
 
-    client = InfluxDBClient(**db_connection_parameters)
+    client = influxdb_client_manager.get_client(**db_connection_parameters)
     client.write_points([point], time_precision='s', protocol='json')
 
 
 def write_series_to_influxdb(
         series=None, timestamps=None, values=None, measurement=None, entity_id=None,
-        db_credentials=None, db_network_route=None
+        db_credentials=None, db_network_route=None, client=None
 ):
 
     if measurement is None:
         raise ValueError('A measurement should be specified.')
 
+    times, values, entity_id = _prepare_series_to_write(
+        series=series, timestamps=timestamps, values=values, entity_id=entity_id
+    )
+    lines = series_to_line_protocol(measurement, entity_id, times, values, time_precision='s')
+
+    if client is None:
+        client = connect_to_influxdb(db_credentials=db_credentials, db_network_route=db_network_route)
+    client.write_points(lines, time_precision='s', protocol='line')
+
+
+def _prepare_series_to_write(series=None, timestamps=None, values=None, entity_id=None):
+    """Returns the datetime64 utc times, the values and the entity id of the data to be written."""
+
     if timestamps is None and values is None and series is not None:
         if isinstance(series, pandas.DataFrame):
             is_series = False
             if series.shape[1] == 1:
-                values = numpy.squeeze(series.values)
+                values = numpy.squeeze(series.values, axis=1)
             else:
                 raise ValueError('The DataFrame has more than one column.')
 
@@ -208,44 +457,303 @@ def write_series_to_influxdb(
             else:
                 entity_id = series.columns[0]
 
-        timestamps = list(series.index.strftime(Parameter.UTC_DATETIME_FORMAT))
+        index = series.index
+        if index.tz is not None:
+            index = index.tz_convert(None)
+        times = index.values
+
+    elif timestamps is not None and values is not None and series is None:
+        times = pandas.to_datetime(list(timestamps), utc=True).tz_convert(None).values
 
-    if timestamps is not None and values is not None and series is None:
-        pass
     else:
-        ValueError('Only one of series or timestamps and values should be not None.')
+        raise ValueError('Only one of series or timestamps and values should be not None.')
 
-    points = []
+    return times, values, entity_id
 
-    for value, time in zip(values, timestamps):
-        points.append(
-            {
-                'measurement': measurement,
-                'tags': {'entity_id': entity_id},
-                'time': time,
-                'fields': {'value': value}
-            }
 
-        )
+def _escape_line_protocol(text, characters):
+    text = str(text)
+    for character in characters:
+        text = text.replace(character, '\\' + character)
+    return text
+
+
+def series_to_line_protocol(measurement, entity_id, times, values, time_precision='s'):
+    """Encodes a series as InfluxDB line protocol. The timestamps and values are formatted as whole NumPy string
+    arrays instead of one Python dict per point. Non finite values can not be represented and are skipped.
+
+    :param measurement: measurement name.
+    :param entity_id: value of the entity_id tag, no tag is written if it is None.
+    :param times: datetime64 array (utc) or integer epoch array in time_precision units.
+    :param values: numeric array.
+    :param time_precision: one of 's', 'ms', 'u' or 'ns', the same given to the client write.
+    :return: list of lines.
+    """
+
+    times = numpy.asarray(times)
+    values = numpy.asarray(values, dtype=float)
+
+    if numpy.issubdtype(times.dtype, numpy.datetime64):
+        numpy_unit = 'us' if time_precision == 'u' else time_precision
+        times = times.astype(f'datetime64[{numpy_unit}]').astype(numpy.int64)
+
+    valid = numpy.isfinite(values)
+    if not valid.all():
+        times, values = times[valid], values[valid]
+
+    prefix = _escape_line_protocol(measurement, ', ')
+    if entity_id is not None:
+        prefix += ',entity_id=' + _escape_line_protocol(entity_id, ',= ')
+    prefix += f' {Parameter.INFLUX_VALUE_LABEL}='
+
+    lines = numpy.char.add(prefix, values.astype(str))
+    lines = numpy.char.add(lines, ' ')
+    lines = numpy.char.add(lines, times.astype(numpy.int64).astype(str))
+
+    return lines.tolist()
+
 
-    client = connect_to_influxdb(db_credentials=db_credentials, db_network_route=db_network_route)
-    client.write_points(points, time_precision='s', protocol='json')
+class InfluxDBBufferedWriter:
+    """Background writer that decouples the writes to InfluxDB from the control loop.
+
+    The write_* methods only encode the data to line protocol and append it to a bounded in-memory buffer, they never
+    wait for the database. A worker thread sends the buffer in batches when batch_size lines are pending or every
+    flush_interval seconds. Failed batches are retried with exponential backoff. When the buffer is full the oldest
+    lines are dropped. Closing the writer flushes the pending lines. The worker thread is a daemon, so a writer still
+    open when the interpreter exits is closed by an atexit hook, waiting at most exit_timeout seconds for the flush.
+
+    Example of use:
+        writer = InfluxDBBufferedWriter(db_credentials=credentials, db_network_route=route)
+        writer.write_series(results['battery_soc'], measurement='%')
+        writer.close()
+    """
+
+    def __init__(
+            self, db_credentials=None, db_network_route=None, ssl=False, client=None, batch_size=5000,
+            flush_interval=1.0, max_buffer_lines=100000, max_retries=5, retry_backoff=0.5, time_precision='s',
+            exit_timeout=10.0
+    ):
+        if client is None:
+            client = connect_to_influxdb(db_credentials=db_credentials, db_network_route=db_network_route, ssl=ssl)
+
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer_lines = max_buffer_lines
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.time_precision = time_precision
+        self.exit_timeout = exit_timeout
+        self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.InfluxDBBufferedWriter')
+
+        self.written_lines = 0
+        self.dropped_lines = 0
+        self.failed_batches = 0
+
+        self._buffer = collections.deque()
+        self._buffered_lines = 0
+        self._sending = False
+        self._flush_requested = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='pyems-influxdb-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self._close_at_exit)
+
+    def write_lines(self, lines):
+        lines = list(lines)
+        if not lines:
+            return
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The writer is closed.')
+
+            if len(lines) > self.max_buffer_lines:
+                self._drop(len(lines) - self.max_buffer_lines)
+                lines = lines[-self.max_buffer_lines:]
+
+            overflow = self._buffered_lines + len(lines) - self.max_buffer_lines
+            while overflow > 0:
+                oldest = self._buffer.popleft()
+                removed = min(overflow, len(oldest))
+                if removed < len(oldest):
+                    self._buffer.appendleft(oldest[removed:])
+                self._buffered_lines -= removed
+                overflow -= removed
+                self._drop(removed)
+
+            self._buffer.append(lines)
+            self._buffered_lines += len(lines)
+            if self._buffered_lines >= self.batch_size:
+                self._condition.notify_all()
+
+    def write_series(self, series=None, timestamps=None, values=None, measurement=None, entity_id=None):
+        if measurement is None:
+            raise ValueError('A measurement should be specified.')
+
+        times, values, entity_id = _prepare_series_to_write(
+            series=series, timestamps=timestamps, values=values, entity_id=entity_id
+        )
+        self.write_lines(series_to_line_protocol(
+            measurement, entity_id, times, values, time_precision=self.time_precision
+        ))
+
+    def write_point(self, measurement, entity_id, value, time=None):
+        if time is None:
+            time = datetime.datetime.utcnow()
+        self.write_lines(series_to_line_protocol(
+            measurement, entity_id, numpy.array([time], dtype='datetime64[ns]'), [value],
+            time_precision=self.time_precision
+        ))
+
+    def flush(self, timeout=None):
+        """Blocks until every buffered line was sent (or dropped after the last retry). Returns False on timeout."""
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._buffer and not self._sending, timeout=timeout)
+
+    def close(self, timeout=None):
+        atexit.unregister(self._close_at_exit)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _close_at_exit(self):
+        self.close(timeout=self.exit_timeout)
+        if self._thread.is_alive():
+            self.logger.warning(f'InfluxDB writer closed at exit with {self._buffered_lines} lines not sent.')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _drop(self, lines):
+        self.dropped_lines += lines
+        self.logger.warning(f'InfluxDB write buffer full, {lines} lines dropped.')
+
+    def _take_batch(self):
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            lines = self._buffer.popleft()
+            room = self.batch_size - len(batch)
+            if len(lines) > room:
+                self._buffer.appendleft(lines[room:])
+                lines = lines[:room]
+            batch += lines
+        self._buffered_lines -= len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or self._flush_requested or self._buffered_lines >= self.batch_size,
+                    timeout=self.flush_interval
+                )
+                if self._closed and not self._buffer:
+                    self._condition.notify_all()
+                    return
+                batch = self._take_batch()
+                if not self._buffer:
+                    self._flush_requested = False
+                self._sending = bool(batch)
+
+            if batch:
+                self._send(batch)
+
+            with self._condition:
+                self._sending = False
+                self._condition.notify_all()
+
+    def _send(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.client.write_points(batch, time_precision=self.time_precision, protocol='line')
+                self.written_lines += len(batch)
+                return
+            except Exception as error:
+                if attempt == self.max_retries:
+                    self.failed_batches += 1
+                    self.dropped_lines += len(batch)
+                    self.logger.error(f'Unable to write {len(batch)} lines to InfluxDB: {error}')
+                    return
+                delay = self.retry_backoff * 2 ** attempt
+                self.logger.warning(f'InfluxDB write failed ({error}), retrying in {delay:.1f} s.')
+                sleep(delay)
 
 
 # OTHER FUNCTIONS
 
-def connect_to_influxdb(db_credentials, db_network_route, ssl=False):
+def connect_to_influxdb(db_credentials, db_network_route, ssl=False, reuse=True):
     """Creates a client to connect to InfluxDB.
 
+    By default the client is taken from the module client manager, so consecutive calls with the same credentials and
+    network route share the HTTP session (keep-alive and connection pool). Use reuse=False to get a private client.
+
     Then the query can be created as: response = client.query(query)
     """
 
     connection_options = {'ssl': True, 'verify_ssl': True} if ssl else {}
-    client = InfluxDBClient(**db_credentials, **db_network_route, **connection_options)
+    if reuse:
+        client = influxdb_client_manager.get_client(**db_credentials, **db_network_route, **connection_options)
+    else:
+        client = InfluxDBClient(**db_credentials, **db_network_route, **connection_options)
 
     return client
 
 
+def close_influxdb_clients():
+    """Closes the HTTP sessions of every pooled InfluxDB client."""
+    influxdb_client_manager.close()
+
+
+class InfluxDBClientManager:
+    """Thread-safe registry of InfluxDBClient objects keyed by the connection parameters (credentials, network route
+    and ssl options). Each client holds a requests.Session, so reusing it avoids the session setup, the TCP/TLS
+    handshake and the teardown on every query or write.
+    """
+
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(client_parameters):
+        return tuple(sorted((key, repr(value)) for key, value in client_parameters.items()))
+
+    def get_client(self, **client_parameters):
+        client_parameters.setdefault('pool_size', self.pool_size)
+        key = self._key(client_parameters)
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = InfluxDBClient(**client_parameters)
+                self._clients[key] = client
+
+        return client
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+
+        for client in clients:
+            client.close()
+
+    def __len__(self):
+        return len(self._clients)
+
+
+influxdb_client_manager = InfluxDBClientManager()
+
+
 def get_measurement_list_from_influxdb(
         file_name='measurement_list', break_dot=True, db_credentials=None, db_network_route=None, ssl=False
 ):
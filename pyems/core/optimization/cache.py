@@ -0,0 +1,146 @@
+"""Cache of optimization solutions keyed by the exact inputs of the model.
+
+Parameter sweeps, retries and replays often solve the same model again: same prices, load and generation forecasts,
+initial and final SOC and battery parameters. The Optimizer with a SolutionCache hashes those inputs (see
+Optimizer.model_inputs) and, if they were solved before, restores the stored solution without building or solving the
+model. The memory tier is per process; the optional disk tier (a directory) can be shared by many processes.
+
+Example of use:
+    cache = SolutionCache(max_size=256, path='solutions', max_disk_size=10000)
+    optimizer = Optimizer(solver='glpk', solution_cache=cache)
+    results = optimizer.solve(system=system, config=config)
+    print(cache.stats)
+"""
+
+import os
+import copy
+import pickle
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from pyems.config import Parameter
+
+
+class SolutionCache:
+    """Thread-safe LRU cache of solutions, with an optional disk tier in the directory path bounded to max_disk_size
+    files (the least recently used are removed). The entries are dicts of optimizer attributes, stored and returned as
+    copies.
+    """
+
+    def __init__(self, max_size=128, path=None, max_disk_size=1024):
+        if max_size < 1:
+            raise ValueError('The cache must hold at least one solution.')
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits, self.disk_hits, self.misses, self.evictions = 0, 0, 0, 0
+        self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.SolutionCache')
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        requests = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / requests if requests else 0.0, 'evictions': self.evictions,
+            'size': len(self._entries),
+        }
+
+    def file_name(self, key):
+        return os.path.join(self.path, f'{key}.pkl')
+
+    def get(self, key):
+        """Returns a copy of the cached solution, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry)
+
+        entry = self.read(key) if self.path is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, entry)
+            return copy.deepcopy(entry)
+
+    def put(self, key, entry):
+        entry = copy.deepcopy(entry)
+        with self._lock:
+            self._store(key, entry)
+        if self.path is not None:
+            self.write(key, entry)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def read(self, key):
+        try:
+            with open(self.file_name(key), 'rb') as file:
+                entry = pickle.load(file)
+            os.utime(self.file_name(key))  # Recently used
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self.logger.warning(f'Unreadable solution file {self.file_name(key)}, ignored.')
+            return None
+        return entry
+
+    def write(self, key, entry):
+        """Writes the entry to a temporary file moved into place, so other processes never read partial files."""
+
+        descriptor, temporary = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.file_name(key))
+        except OSError:
+            self.logger.warning(f'Solution file {self.file_name(key)} could not be written.')
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+
+        self.evict_files()
+
+    def evict_files(self):
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pkl'):
+                try:
+                    files.append((os.path.getmtime(os.path.join(self.path, name)), name))
+                except FileNotFoundError:  # Removed by another process
+                    pass
+
+        for _, name in sorted(files)[:max(len(files) - self.max_disk_size, 0)]:
+            try:
+                os.remove(os.path.join(self.path, name))
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+
+    def clear(self, disk=False):
+        """Empties the memory tier and, with disk=True, the disk tier."""
+
+        with self._lock:
+            self._entries.clear()
+        if disk and self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.path, name))
@@ -0,0 +1,316 @@
+"""Coordinated optimization of many buildings behind a shared grid connection.
+
+The buildings are coupled only by the capacity of the connection: in every period the sum of their net imports (buy
+minus sell) must stay below import_capacity and above -export_capacity. The coupling is relaxed by dual decomposition:
+a price per period is added to the grid prices of every building (the shadow price of the connection), each building
+is solved on its own as the standard battery and grid model, in parallel in a pool of worker processes, and the prices
+are updated by a projected subgradient step on the capacity violation.
+
+The subproblems are MILPs, so the iterates of the buildings can oscillate around the optimum without ever respecting
+the capacity (e.g. similar buildings react alike to the same prices). A repair round then splits the capacity among the
+buildings, starting from their last plans, and solves each one with its share as a local limit: any combination of
+local plans respects the connection. The plan kept is the cheapest one (at the original prices) respecting the
+capacity, among the iterates and the repaired one.
+
+Example of use:
+    coordinator = CoordinatedOptimizer(import_capacity=20, solver='glpk', workers=8)
+    for name, system in systems.items():
+        system.prepare_to_optimize(config)
+        coordinator.add_building(name, system)
+    results = coordinator.solve(config)  # Dict with the Results of every building
+    print(coordinator.diagnostics[-1])
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy
+import pyomo.kernel as pk
+
+from pyems.core.entity.entity import Entity
+from pyems.core.optimization.stochastic import (
+    StochasticOptimizer, add_linear_rows, battery_parameters, build_scenario_model, model_values, solve_model
+)
+from pyems.core.results.results import Results
+
+
+def solve_building_subproblem(task):
+    """Builds and solves the model of one building with the given grid prices and, optionally, local limits of its
+    net import (import_limit and export_limit arrays). Returns the values of the variables, or None if the building
+    cannot keep to its limits.
+    """
+
+    m = build_scenario_model(
+        task['load'][None, :], task['generation'][None, :], numpy.ones(1), task['prices'], battery=task['battery']
+    )
+
+    if task.get('import_limit') is not None:
+        m.cl_import_limit = pk.constraint_list()
+        m.cl_export_limit = pk.constraint_list()
+        for constraint_list, limit, sign in [
+            (m.cl_import_limit, task['import_limit'], 1), (m.cl_export_limit, task['export_limit'], -1)
+        ]:
+            finite = numpy.isfinite(limit)
+            index = m.index[0][finite]
+            ones = numpy.ones(index.shape[0])
+            add_linear_rows(constraint_list, [(m.E['buy'], index, -sign * ones), (m.E['sell'], index, sign * ones)],
+                            lb=-limit[finite])
+
+    try:
+        solve_model(m, task['solver'], task['solve_options'])
+    except ValueError:
+        if task.get('import_limit') is None:
+            raise
+        return None  # The building cannot keep to its local limits
+
+    return model_values(m)
+
+
+def split_capacity(net_imports, import_capacity, export_capacity):
+    """Splits the connection capacity into local limits (buildings, periods) that add up to it. Every building keeps
+    its net import plus a part of the spare capacity; when it is negative (violation) the cut is shared in proportion
+    to the imports (exports) of the buildings, otherwise the spare capacity is shared equally.
+    """
+
+    limits = []
+    for net, capacity in [(net_imports, import_capacity), (-net_imports, export_capacity)]:
+        spare = capacity - net.sum(axis=0)
+        positive = numpy.clip(net, 0, None)
+        total = positive.sum(axis=0)
+        weights = numpy.where(
+            (spare < 0) & (total > 0), positive / numpy.where(total > 0, total, 1), 1 / net.shape[0]
+        )
+        limits.append(numpy.where(numpy.isfinite(capacity), net + weights * numpy.nan_to_num(spare), numpy.inf))
+
+    return limits
+
+
+def building_model_data(system, periods):
+    """Point forecasts (as arrays (1, periods)), prices and battery parameters (or None) of a prepared system."""
+
+    if not system.has_external_grid:
+        raise NotImplementedError('The buildings of a coordinated optimization must be connected to the grid.')
+    if system.has_interruptable_loads or system.has_schedulable_loads:
+        raise NotImplementedError('Flexible loads not implemented yet.')
+
+    supply = system.get_external_grid_object()
+    data = {
+        'load': numpy.zeros(periods) if system.fix_electrical_load is None
+        else numpy.asarray(system.fix_electrical_load, dtype=float)[:periods],
+        'generation': numpy.zeros(periods) if system.stochastic_electrical_gen is None
+        else numpy.asarray(system.stochastic_electrical_gen, dtype=float)[:periods],
+        'prices': {
+            'buy': numpy.array(supply.electricity_purchase_prices, dtype=float)[:periods],
+            'sell': numpy.array(supply.electricity_selling_prices, dtype=float)[:periods],
+        },
+        'battery': battery_parameters(system.get_battery_object()) if system.has_battery else None,
+    }
+
+    return data
+
+
+class CoordinatedOptimizer(Entity):
+    """Joint plan of many buildings sharing a grid connection, solved by dual decomposition. The capacities are in
+    energy per period (scalars or arrays with a value per period); None means unlimited.
+
+    step_size scales the subgradient steps (step_size / sqrt(iteration + 1)); by default the mean buy price divided by
+    the mean capacity. The iterations stop when the capacity is respected within tolerance and the connection prices
+    no longer change (within tolerance), or after max_iterations. The diagnostics of every iteration (residuals, cost
+    and wall time) are kept in self.diagnostics and the final connection prices in self.connection_prices.
+
+    With workers=None the buildings are solved one after another, otherwise in a pool of worker processes that lives
+    across steps (see close).
+    """
+
+    def __init__(self, name='CoordinatedOptimizer', import_capacity=None, export_capacity=None, solver='glpk',
+                 solve_options=None, step_size=None, max_iterations=50, tolerance=1e-2, workers=None):
+        super().__init__(name, entity_type='optimizer')
+
+        if import_capacity is None and export_capacity is None:
+            raise ValueError('At least one of the import and export capacities of the connection is required.')
+
+        self.import_capacity = import_capacity
+        self.export_capacity = export_capacity
+        self.solver_name = solver
+        self.solve_options = solve_options if solve_options is not None else {}
+        self.step_size = step_size
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.workers = workers
+        self._executor = None
+
+        self.buildings = {}
+        self.diagnostics = []
+        self.converged = False
+        self.connection_prices = None
+        self.net_import = None
+        self.results = None
+        self.logger = logging.getLogger("pyems.CoordinatedOptimizer")
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def add_building(self, name, system):
+        if name in self.buildings:
+            raise ValueError(f'There is already a building named {name}.')
+        self.buildings[name] = system
+
+    def solve_buildings(self, data, adder, import_limits=None, export_limits=None):
+        """Solves every building with adder added to its buy and sell prices, and with its local limits (arrays
+        (buildings, periods)), if given. Returns the list of solutions.
+        """
+
+        tasks = [{
+            'load': building['load'], 'generation': building['generation'], 'battery': building['battery'],
+            'prices': {'buy': building['prices']['buy'] + adder, 'sell': building['prices']['sell'] + adder},
+            'import_limit': None if import_limits is None else import_limits[b],
+            'export_limit': None if export_limits is None else export_limits[b],
+            'solver': self.solver_name, 'solve_options': self.solve_options,
+        } for b, building in enumerate(data)]
+
+        if self.workers is None:
+            return [solve_building_subproblem(task) for task in tasks]
+        return list(self.executor.map(solve_building_subproblem, tasks))
+
+    def solve(self, config):
+        """Plans all the buildings (already prepared to optimize for config). Returns a dict with their Results."""
+
+        if not self.buildings:
+            raise ValueError('No buildings to coordinate.')
+
+        self.logger.info(f'Coordinating {len(self.buildings)} buildings by dual decomposition.')
+
+        periods = config['periods']
+        data = [building_model_data(system, periods) for system in self.buildings.values()]
+        import_capacity = numpy.broadcast_to(
+            numpy.inf if self.import_capacity is None else numpy.asarray(self.import_capacity, dtype=float), periods
+        )
+        export_capacity = numpy.broadcast_to(
+            numpy.inf if self.export_capacity is None else numpy.asarray(self.export_capacity, dtype=float), periods
+        )
+
+        step_size = self.step_size
+        if step_size is None:
+            price_scale = numpy.mean([numpy.abs(building['prices']['buy']).mean() for building in data])
+            finite = numpy.concatenate([import_capacity, export_capacity])
+            finite = finite[numpy.isfinite(finite)]
+            step_size = price_scale / max(float(finite.mean()), 1e-9)
+
+        import_price, export_price = numpy.zeros(periods), numpy.zeros(periods)
+        best, best_cost = None, numpy.inf
+        self.diagnostics = []
+        self.converged = False
+        start = perf_counter()
+
+        def evaluate(solutions):
+            net_imports = numpy.stack([solution['buy'][0] - solution['sell'][0] for solution in solutions])
+            net_import = net_imports.sum(axis=0)
+            cost = float(sum(
+                solution['buy'][0] @ building['prices']['buy'] - solution['sell'][0] @ building['prices']['sell']
+                for solution, building in zip(solutions, data)
+            ))
+            return net_imports, net_import - import_capacity, -net_import - export_capacity, cost
+
+        for iteration in range(self.max_iterations + 1):
+            solutions = self.solve_buildings(data, import_price - export_price)
+            net_imports, import_violation, export_violation, cost = evaluate(solutions)
+            primal_residual = float(max(import_violation.max(), export_violation.max(), 0))
+
+            if primal_residual <= self.tolerance and cost < best_cost:
+                best, best_cost = (solutions, net_imports.sum(axis=0), import_price - export_price), cost
+
+            step = step_size / numpy.sqrt(iteration + 1)
+            new_import_price = numpy.maximum(0, import_price + step * numpy.nan_to_num(import_violation, neginf=-1e9))
+            new_export_price = numpy.maximum(0, export_price + step * numpy.nan_to_num(export_violation, neginf=-1e9))
+            dual_residual = float(max(numpy.abs(new_import_price - import_price).max(),
+                                      numpy.abs(new_export_price - export_price).max()))
+            import_price, export_price = new_import_price, new_export_price
+
+            self.diagnostics.append({
+                'iteration': iteration, 'primal_residual': primal_residual, 'dual_residual': dual_residual,
+                'cost': cost, 'best_cost': best_cost, 'wall_time': perf_counter() - start,
+            })
+
+            if primal_residual <= self.tolerance and dual_residual <= self.tolerance:
+                self.converged = True
+                break
+
+        if not self.converged:
+            adder = import_price - export_price
+            repaired = self.repair(data, adder, solutions, net_imports, import_capacity, export_capacity)
+            net_imports, import_violation, export_violation, cost = evaluate(repaired)
+            primal_residual = float(max(import_violation.max(), export_violation.max(), 0))
+            if primal_residual <= self.tolerance and cost < best_cost:
+                best, best_cost = (repaired, net_imports.sum(axis=0), adder), cost
+
+            if best is None:
+                self.logger.warning(f'No plan respecting the connection capacity found. Using the repaired one, with '
+                                    f'a violation of {primal_residual:.3g}.')
+                best = (repaired, net_imports.sum(axis=0), adder)
+            else:
+                self.logger.warning(f'Dual decomposition stopped after {len(self.diagnostics) - 1} iterations. Using '
+                                    f'the cheapest plan respecting the connection capacity, with cost {best_cost:.4g}.')
+
+        solutions, self.net_import, self.connection_prices = best
+        self.results = {
+            name: self.building_results(system, solution, building, config)
+            for (name, system), solution, building in zip(self.buildings.items(), solutions, data)
+        }
+
+        return self.results
+
+    def repair(self, data, adder, solutions, net_imports, import_capacity, export_capacity):
+        """Solves every building (in parallel) with its share of the capacity as a local limit. The buildings unable
+        to keep to their share are solved again, one after another, with the capacity left by all the others.
+        """
+
+        self.logger.info('Repairing the last plan with local shares of the connection capacity.')
+
+        repaired = self.solve_buildings(data, adder, *split_capacity(net_imports, import_capacity, export_capacity))
+        repaired = [solution if new is None else new for solution, new in zip(solutions, repaired)]
+
+        for b, new in enumerate(repaired):
+            if new is not solutions[b]:
+                continue
+            others = sum(solution['buy'][0] - solution['sell'][0] for j, solution in enumerate(repaired) if j != b)
+            task = {
+                'load': data[b]['load'], 'generation': data[b]['generation'], 'battery': data[b]['battery'],
+                'prices': {'buy': data[b]['prices']['buy'] + adder, 'sell': data[b]['prices']['sell'] + adder},
+                'import_limit': import_capacity - others, 'export_limit': export_capacity + others,
+                'solver': self.solver_name, 'solve_options': self.solve_options,
+            }
+            solution = solve_building_subproblem(task)
+            if solution is not None:
+                repaired[b] = solution
+
+        return repaired
+
+    @staticmethod
+    def building_results(system, values, data, config):
+        """Results of a building from the values of its subproblem, through the single scenario case of the
+        StochasticOptimizer (which is the deterministic model).
+        """
+
+        helper = StochasticOptimizer(write_solver_info=False)
+        helper.system = system
+        helper.set_results(
+            values, data['load'][None, :], data['generation'][None, :], numpy.ones(1), data['prices'], config
+        )
+        helper.check_solution_physical_validity(config)
+
+        return Results(output_data=helper.results, target_soc=helper.target_soc, timestamp=config['start'])
+
+    def close(self):
+        """Shuts down the pool of workers, if any."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def clear(self):
+        self.results = None
+        self.net_import = None
+        self.connection_prices = None
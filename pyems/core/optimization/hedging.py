@@ -0,0 +1,178 @@
+"""Progressive hedging: scenario decomposition of the two-stage stochastic model.
+
+Instead of one model with every scenario, each scenario is solved as a standard (deterministic) battery and grid model,
+in parallel in a pool of worker processes. The only non-anticipative decision is the first period target SOC: the
+subproblems are pushed towards its probability weighted consensus with a multiplier per scenario and a penalty on the
+distance to it. The penalty is the absolute distance (instead of the usual quadratic one) so the subproblems remain
+MILPs for GLPK or CBC.
+
+Once the scenarios agree (or the iteration cap is reached) the target SOC is fixed to the consensus and every scenario
+is solved a last time, so the first period decisions are shared.
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy
+import pyomo.kernel as pk
+from pyomo.opt.results.solver import SolverStatus as SolSt, TerminationCondition as TermCond
+
+from pyems.core.optimization.stochastic import StochasticOptimizer, build_scenario_model, model_values, solve_model
+
+
+def solve_scenario_subproblem(task):
+    """Builds and solves the model of one scenario. The task is a dict with the arrays of the scenario (load,
+    generation, prices, battery) and the hedging terms: multiplier, consensus and penalty (rho), or fixed_soc to fix
+    the SOC after the first period. Returns the values of the variables, the SOC after the first period and the cost.
+    """
+
+    m = build_scenario_model(
+        task['load'][None, :], task['generation'][None, :], numpy.ones(1), task['prices'], battery=task['battery']
+    )
+    target_soc = m.soc[m.soc_index[0, 1]]
+
+    if task.get('fixed_soc') is not None:
+        target_soc.fix(task['fixed_soc'])
+    elif task['rho'] > 0 or task['multiplier'] != 0:
+        m.distance_pos = pk.variable(lb=0)
+        m.distance_neg = pk.variable(lb=0)
+        m.c_distance = pk.constraint(body=target_soc - m.distance_pos + m.distance_neg, rhs=task['consensus'])
+        m.obj.deactivate()
+        m.hedging_obj = pk.objective(
+            m.obj.expr + task['multiplier'] * target_soc + task['rho'] * (m.distance_pos + m.distance_neg),
+            sense=pk.minimize
+        )
+
+    solve_model(m, task['solver'], task['solve_options'])
+
+    return {'values': model_values(m), 'target_soc': float(target_soc.value), 'cost': float(pk.value(m.obj.expr))}
+
+
+class ProgressiveHedgingOptimizer(StochasticOptimizer):
+    """StochasticOptimizer solved by progressive hedging over the scenarios, in parallel in a pool of workers processes
+    that lives across steps (see close). With workers=None the subproblems are solved one after another.
+
+    rho is the penalty on the distance of each scenario target SOC to the consensus, in cost units per unit of SOC.
+    The iterations stop when the probability weighted deviation from the consensus is below tolerance or after
+    max_iterations. The diagnostics of every iteration are kept in self.diagnostics.
+
+    Requires a system with an external grid and a battery.
+    """
+
+    cached_attributes = StochasticOptimizer.cached_attributes + ('diagnostics', 'converged')
+
+    def __init__(self, name='ProgressiveHedgingOptimizer', rho=1.0, max_iterations=50, tolerance=1e-3, workers=None,
+                 **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.rho = rho
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.workers = workers
+        self._executor = None
+        self.model_data = None
+        self.subproblem_solutions = None
+        self.diagnostics = []
+        self.converged = False
+        self.logger = logging.getLogger("pyems.ProgressiveHedgingOptimizer")
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    @property
+    def cache_identity(self):
+        return super().cache_identity + (self.rho, self.max_iterations, self.tolerance)
+
+    def create_optimization_model(self, config):
+
+        self.logger.info('Preparing the scenario subproblems.')
+
+        self.model_data = self.get_model_data(config)
+        if self.model_data[4] is None:
+            raise NotImplementedError('Progressive hedging coordinates the target SOC, it requires a battery.')
+
+    def solve_subproblems(self, multipliers=None, consensus=0.0, rho=0.0, fixed_soc=None):
+        load, generation, _, prices, battery = self.model_data
+        tasks = [{
+            'load': load[s], 'generation': generation[s], 'prices': prices, 'battery': battery,
+            'multiplier': 0.0 if multipliers is None else float(multipliers[s]), 'consensus': consensus, 'rho': rho,
+            'fixed_soc': fixed_soc, 'solver': self.solver_name, 'solve_options': self.solve_options,
+        } for s in range(load.shape[0])]
+
+        if self.workers is None:
+            return [solve_scenario_subproblem(task) for task in tasks]
+        return list(self.executor.map(solve_scenario_subproblem, tasks))
+
+    def solve_optimization_model(self, config):
+
+        self.logger.info('Solving the scenario subproblems by progressive hedging.')
+
+        probabilities = self.model_data[2]
+        self.diagnostics = []
+        self.converged = False
+        start = perf_counter()
+
+        # Iteration 0: every scenario on its own
+        solutions = self.solve_subproblems()
+        targets = numpy.array([solution['target_soc'] for solution in solutions])
+        consensus = float(probabilities @ targets)
+        multipliers = self.rho * (targets - consensus)
+
+        for iteration in range(self.max_iterations + 1):
+            deviation = float(probabilities @ numpy.abs(targets - consensus))
+            self.diagnostics.append({
+                'iteration': iteration, 'consensus': consensus, 'deviation': deviation,
+                'max_deviation': float(numpy.abs(targets - consensus).max()),
+                'expected_cost': float(probabilities @ [solution['cost'] for solution in solutions]),
+                'wall_time': perf_counter() - start,
+            })
+            if deviation < self.tolerance:
+                self.converged = True
+                break
+            if iteration == self.max_iterations:
+                break
+
+            solutions = self.solve_subproblems(multipliers, consensus, self.rho)
+            targets = numpy.array([solution['target_soc'] for solution in solutions])
+            consensus = float(probabilities @ targets)
+            multipliers = multipliers + self.rho * (targets - consensus)
+
+        if self.converged:
+            self.logger.info(f'Progressive hedging converged in {len(self.diagnostics) - 1} iterations.')
+        else:
+            self.logger.warning(f'Progressive hedging stopped after {self.max_iterations} iterations with a deviation '
+                                f'of {self.diagnostics[-1]["deviation"]:.2e}. Using the consensus target SOC.')
+
+        # Final solve with the shared target SOC
+        self.subproblem_solutions = self.solve_subproblems(fixed_soc=consensus)
+        self.solver_status = {
+            "solver_summary": "optimal", "solver_status": str(SolSt.ok),
+            "solver_termination_condition": str(TermCond.optimal), "iterations": len(self.diagnostics) - 1,
+            "converged": self.converged, "wall_time": perf_counter() - start,
+        }
+
+    def extract_results_from_opt_model(self, config):
+
+        self.logger.info('Extracting results from the scenario subproblems.')
+
+        load, generation, probabilities, prices, _ = self.model_data
+        raw_results = {
+            key: numpy.concatenate([solution['values'][key] for solution in self.subproblem_solutions])
+            for key in self.subproblem_solutions[0]['values']
+        }
+
+        return self.set_results(raw_results, load, generation, probabilities, prices, config)
+
+    def close(self):
+        """Shuts down the pool of workers, if any."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def clear(self):
+        super().clear()
+        self.model_data = None
+        self.subproblem_solutions = None
@@ -12,6 +12,7 @@ Useful links:
 # Standard library imports
 import weakref
 import logging
+import threading
 from os.path import join
 
 # Third party imports
@@ -25,18 +26,34 @@ from pyomo.opt.results.solver import SolverStatus as SolSt, TerminationCondition
 
 # Local application imports
 from pyems.core.entity.entity import Entity
+from pyems.core.utils.hashing import hash_inputs
 from pyems.core.optimization.utils import combine_positive_negative_variables, readable_pyomo_model
 from pyems.core.results.results import Results
 from pyems.core.utils.time import timestep_conversion
 
+# Pyomo keeps the temporary files of the solver calls in a global stack, so the solver calls of the optimizers running
+# in different threads of a process (e.g. the sites of a Fleet) are serialized.
+solver_lock = threading.Lock()
+
+BATTERY_PARAMETERS = [
+    'batt_C', 'soc_0', 'soc_l', 'soc_lb', 'soc_ub', 'batt_chrg_speed', 'batt_dis_speed', 'batt_chrg_per', 'batt_dis_per'
+]
+
 
 class Optimizer(Entity):
     """This class translates a SystemModel class into a Pyomo optimization model and then solved by GLPK solver.
-    The results are extracted and checked to ensure physical validity of the solution."""
+    The results are extracted and checked to ensure physical validity of the solution.
+
+    With a SolutionCache, a model with the same inputs (see model_inputs) as one solved before is not built nor solved:
+    the stored solution is restored instead."""
+
+    # Attributes restored from the solution cache
+    cached_attributes = ('results', 'target_soc', 'solver_status')
 
     def __init__(self, name='Optimizer', solver='glpk', full_solver_info=False, display_solver_info=False,
                  write_solver_info=True, solver_factory_options=None, solve_options=None, info_path='',
-                 solver_info_file_name='solver_info.txt', readable_model_file_name='optimization_model.txt'):
+                 solver_info_file_name='solver_info.txt', readable_model_file_name='optimization_model.txt',
+                 solution_cache=None):
 
         super().__init__(name, entity_type='optimizer')
 
@@ -53,6 +70,7 @@ class Optimizer(Entity):
         self.solve_options = solve_options if solve_options is not None else {}
         self.solver_output = None
         self.solver_status = None
+        self.solution_cache = solution_cache
 
         # Resolution process info
 
@@ -289,7 +307,8 @@ class Optimizer(Entity):
             print(readable_model)
 
         self.solver = SolverFactory(self.solver_name, **self.solver_factory_options)
-        solver_output = self.solver.solve(self.optimization_model, **self.solve_options)
+        with solver_lock:
+            solver_output = self.solver.solve(self.optimization_model, **self.solve_options)
 
         # Optimization model post-resolution. Override the previous file with this new model with more info.
         if self.write_solver_info:
@@ -440,6 +459,49 @@ class Optimizer(Entity):
                 print(battery_balance)
                 raise ValueError('Invalid solution. Energy balance violation in the battery.')
     
+    @property
+    def cache_identity(self):
+        """Settings of the optimizer that change its solutions."""
+        return type(self).__qualname__, self.solver_name, self.solve_options
+
+    def model_inputs(self, config):
+        """Arrays and scalars the optimization model is built from."""
+
+        inputs = {
+            'periods': config['periods'], 'timestep': config['timestep'],
+            'components': (self.system.has_external_grid, self.system.has_battery, self.system.has_fix_loads,
+                           self.system.has_stochastic_generators, self.system.has_interruptable_loads,
+                           self.system.has_schedulable_loads),
+        }
+        for label, values in [
+            ('load', self.system.fix_electrical_load), ('generation', self.system.stochastic_electrical_gen)
+        ]:
+            inputs[label] = None if values is None else numpy.asarray(values, dtype=float)
+
+        if self.system.has_external_grid:
+            supply = self.system.get_external_grid_object()
+            inputs['buy'] = numpy.asarray(supply.electricity_purchase_prices, dtype=float)
+            inputs['sell'] = numpy.asarray(supply.electricity_selling_prices, dtype=float)
+
+        if self.system.has_battery:
+            battery = self.system.get_battery_object()
+            inputs['battery'] = {parameter: getattr(battery, parameter) for parameter in BATTERY_PARAMETERS}
+
+        return inputs
+
+    def solution_key(self, config):
+        return hash_inputs(self.cache_identity, self.model_inputs(config))
+
+    def restore_solution(self, solution, config):
+        """Sets the cached attributes, with the results moved to the start of config (for replays)."""
+
+        for attribute, value in solution.items():
+            setattr(self, attribute, value)
+
+        if isinstance(self.results, pandas.DataFrame):
+            timestep = timestep_conversion(config['timestep'], pd_units=True)
+            self.results.index = pandas.date_range(start=config['start'], periods=config['periods'], freq=timestep)
+
     def solve(self, system=None, config=None):
 
         if self.system is None and system is not None:
@@ -448,11 +510,23 @@ class Optimizer(Entity):
         if self.system is None:
             raise ValueError("No system is assigned to the optimizer.")
 
+        key = None
+        if self.solution_cache is not None:
+            key = self.solution_key(config)
+            solution = self.solution_cache.get(key)
+            if solution is not None:
+                self.logger.info('Solution served from the cache.')
+                self.restore_solution(solution, config)
+                return Results(output_data=self.results, target_soc=self.target_soc, timestamp=config['start'])
+
         self.create_optimization_model(config)
         self.solve_optimization_model(config)
         self.extract_results_from_opt_model(config)
         self.check_solution_physical_validity(config)
 
+        if key is not None:
+            self.solution_cache.put(key, {attribute: getattr(self, attribute) for attribute in self.cached_attributes})
+
         self.logger.info('Creating results object.')
 
         return Results(output_data=self.results, target_soc=self.target_soc, timestamp=config['start'])
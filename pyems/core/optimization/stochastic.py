@@ -0,0 +1,366 @@
+"""Two-stage stochastic counterpart of the Optimizer.
+
+The system provides scenarios of the aggregated fix load and stochastic generation (System with n_scenarios). The
+decisions of the first period (grid flows and battery charge and discharge) are shared by all the scenarios, they are
+the ones applied now, while the later periods branch per scenario (recourse). The objective is the expected cost.
+
+The variables of every kind are kept in one flat list and an index array (n_scenarios, periods) maps each scenario and
+period to its variable, so the coefficients of all the scenarios are assembled at once with NumPy and the constraints
+are emitted from those arrays.
+"""
+
+import logging
+
+import numpy
+import pandas
+import pyomo.kernel as pk
+from pyomo.core.expr.numeric_expr import LinearExpression
+from pyomo.environ import SolverFactory
+from pyomo.opt.results.solver import SolverStatus as SolSt, TerminationCondition as TermCond
+
+from pyems.core.optimization.optimizer import BATTERY_PARAMETERS, Optimizer, solver_lock
+from pyems.core.optimization.utils import combine_positive_negative_variables
+from pyems.core.utils.time import timestep_conversion
+
+
+def scenario_index(n_scenarios, periods, shared):
+    """Array (n_scenarios, periods) with the position of each scenario and period in a flat variable list. The first
+    shared periods map to the same variables in every scenario (non-anticipativity).
+    """
+
+    index = numpy.empty((n_scenarios, periods), dtype=int)
+    index[:, :shared] = numpy.arange(shared)
+    index[:, shared:] = shared + numpy.arange(n_scenarios * (periods - shared)).reshape(n_scenarios, periods - shared)
+    return index
+
+
+def new_variable_list(size, **kwargs):
+    variables = pk.variable_list()
+    for _ in range(size):
+        variables.append(pk.variable(**kwargs))
+    return variables
+
+
+def add_linear_rows(constraint_list, terms, lb=None, rhs=None):
+    """Appends a constraint per row. Each term is a tuple (variable list, index array, coefficient array) with an
+    entry per row, and lb or rhs is an array with the bound of each row. The coefficients and variables of all the rows
+    are gathered at once and each body is built directly as a LinearExpression.
+    """
+
+    bounds = numpy.asarray(rhs if rhs is not None else lb, dtype=float)
+    coefficients = numpy.column_stack([
+        numpy.broadcast_to(numpy.asarray(term_coefficients, dtype=float), bounds.shape)
+        for _, _, term_coefficients in terms
+    ]).tolist()
+    row_variables = zip(*[
+        [variables[position] for position in numpy.asarray(index).tolist()] for variables, index, _ in terms
+    ])
+
+    for row_coefficients, variables, bound in zip(coefficients, row_variables, bounds.tolist()):
+        body = LinearExpression(constant=0, linear_coefs=row_coefficients, linear_vars=list(variables))
+        if rhs is not None:
+            constraint_list.append(pk.constraint(body=body, rhs=bound))
+        else:
+            constraint_list.append(pk.constraint(body=body, lb=bound))
+
+
+def battery_parameters(battery):
+    """Plain dict with the parameters of a battery used by build_scenario_model (it can be sent to other processes)."""
+    return {parameter: getattr(battery, parameter) for parameter in BATTERY_PARAMETERS}
+
+
+def build_scenario_model(load, generation, probabilities, prices, battery=None):
+    """Pyomo model of the expected cost of a grid connected system over the load and generation scenarios, arrays
+    (n_scenarios, periods), with the first period shared. With a single scenario it is the deterministic model of the
+    Optimizer. prices is a dict with the 'buy' and 'sell' arrays and battery a dict as returned by battery_parameters,
+    or None.
+    """
+
+    n_scenarios, periods = load.shape
+
+    m = pk.block()
+
+    # Track the default attributes of the model to be aware of which the user adds.
+    default_attributes = set(m.__dict__.keys())
+    default_attributes.add('default_attributes')
+
+    # SETS
+
+    m.periods = range(periods)
+    m.scenarios = range(n_scenarios)
+    m.probabilities = probabilities
+    m.E_set = ['buy', 'sell']
+    m.index = scenario_index(n_scenarios, periods, shared=1)
+    size = int(m.index.max()) + 1
+
+    # Rows of the period constraints: the first period only once, as it is shared.
+    rows = (numpy.arange(periods) > 0) | (numpy.arange(n_scenarios)[:, None] == 0)
+    row_index = m.index[rows]
+    ones = numpy.ones(row_index.shape[0])
+
+    # VARIABLES
+
+    m.E = pk.variable_dict()
+    m.E['buy'] = new_variable_list(size, domain=pk.NonNegativeReals)
+    m.E['sell'] = new_variable_list(size, domain=pk.NonNegativeReals)
+    m.y_grid = new_variable_list(size, domain_type=pk.IntegerSet, lb=0, ub=1)
+
+    if battery is not None:
+        m.E_set += ['batt_chrg', 'batt_dis']
+        m.E['batt_chrg'] = new_variable_list(size, domain_type=pk.RealSet, lb=0)
+        m.E['batt_dis'] = new_variable_list(size, domain_type=pk.RealSet, lb=0)
+        m.y_bat = new_variable_list(size, domain_type=pk.IntegerSet, lb=0, ub=1)
+
+        # The initial SOC and the one after the first period are shared. The last one should be >= soc_l.
+        m.soc_index = scenario_index(n_scenarios, periods + 1, shared=min(2, periods + 1))
+        m.soc = new_variable_list(int(m.soc_index.max()) + 1, domain_type=pk.RealSet, lb=battery['soc_lb'],
+                                  ub=battery['soc_ub'])
+        for i in numpy.unique(m.soc_index[:, -1]):
+            m.soc[i].lb = battery['soc_l']
+
+    # PARAMETERS
+
+    m.prices = prices
+
+    # OBJECTIVE FUNCTION: expected cost, the coefficients of the shared variables add up the probabilities.
+
+    weights = probabilities[:, None] * numpy.ones(periods)
+    buy_cost, sell_income = numpy.zeros(size), numpy.zeros(size)
+    numpy.add.at(buy_cost, m.index, weights * m.prices['buy'])
+    numpy.add.at(sell_income, m.index, weights * m.prices['sell'])
+
+    m.obj = pk.objective(
+        LinearExpression(constant=0, linear_coefs=buy_cost.tolist() + (-sell_income).tolist(),
+                         linear_vars=list(m.E['buy']) + list(m.E['sell'])),
+        sense=pk.minimize
+    )
+
+    # CONSTRAINTS
+
+    # Big-M as tight as the data allows: no flow can exceed the load or generation plus the battery speeds.
+    grid_m = max(load.max(), 0) + max(generation.max(), 0) + 1
+    if battery is not None:
+        grid_m += battery['batt_chrg_speed'] + battery['batt_dis_speed']
+    m.cl_y_buy = pk.constraint_list()
+    add_linear_rows(m.cl_y_buy, [(m.y_grid, row_index, grid_m * ones), (m.E['buy'], row_index, -ones)], lb=0 * ones)
+
+    m.cl_y_sell = pk.constraint_list()
+    add_linear_rows(m.cl_y_sell, [(m.y_grid, row_index, -grid_m * ones), (m.E['sell'], row_index, -ones)],
+                    lb=-grid_m * ones)
+
+    # Balance constraints: buy - sell + discharge - charge = load - generation
+
+    balance_terms = [(m.E['buy'], row_index, ones), (m.E['sell'], row_index, -ones)]
+    if battery is not None:
+        balance_terms += [(m.E['batt_dis'], row_index, ones), (m.E['batt_chrg'], row_index, -ones)]
+
+    m.cl_balance = pk.constraint_list()
+    add_linear_rows(m.cl_balance, balance_terms, rhs=(load - generation)[rows])
+
+    # Battery constraints and restrictions
+
+    if battery is not None:
+        for i in numpy.unique(m.soc_index[:, 0]):
+            m.soc[i].fix(battery['soc_0'])
+
+        soc_now, soc_next = m.soc_index[:, :-1][rows], m.soc_index[:, 1:][rows]
+        m.cl_soc = pk.constraint_list()
+        add_linear_rows(m.cl_soc, [
+            (m.soc, soc_next, battery['batt_C'] * ones), (m.soc, soc_now, -battery['batt_C'] * ones),
+            (m.E['batt_dis'], row_index, ones / battery['batt_dis_per']),
+            (m.E['batt_chrg'], row_index, -battery['batt_chrg_per'] * ones),
+        ], rhs=0 * ones)
+
+        m.cl_y_char = pk.constraint_list()
+        add_linear_rows(m.cl_y_char, [
+            (m.y_bat, row_index, battery['batt_chrg_speed'] * ones), (m.E['batt_chrg'], row_index, -ones)
+        ], lb=0 * ones)
+
+        m.cl_y_dis = pk.constraint_list()
+        add_linear_rows(m.cl_y_dis, [
+            (m.y_bat, row_index, -battery['batt_dis_speed'] * ones), (m.E['batt_dis'], row_index, -ones)
+        ], lb=-battery['batt_dis_speed'] * ones)
+
+    # FINISHING
+
+    m.load_scenarios = load
+    m.generation_scenarios = generation
+
+    # Determine the user defined attributes (written in this source code) by subtracting the defaults one.
+    all_attributes = set(m.__dict__.keys())
+    m.user_defined_attributes = list(all_attributes - default_attributes)
+
+    return m
+
+
+def solve_model(m, solver, solve_options):
+    """Solves a model and raises a ValueError unless the solution is optimal. Used by the workers of the
+    decomposition methods, which have no Optimizer.
+    """
+
+    with solver_lock:
+        solver_output = SolverFactory(solver).solve(m, **solve_options)
+
+    if not (solver_output.solver.status == SolSt.ok
+            and solver_output.solver.termination_condition == TermCond.optimal):
+        raise ValueError(f'Subproblem not solved to optimality: {solver_output.solver.termination_condition}')
+
+    return solver_output
+
+
+def model_values(m):
+    """Solution of a model built by build_scenario_model as arrays (n_scenarios, periods), (n_scenarios, periods + 1)
+    for the SOC.
+    """
+
+    raw_results = {}
+    for e in m.E_set:
+        raw_results[e] = numpy.array([variable.value for variable in m.E[e]], dtype=float)[m.index]
+    if hasattr(m, 'soc'):
+        raw_results['soc'] = numpy.array([variable.value for variable in m.soc], dtype=float)[m.soc_index]
+
+    for key, values in raw_results.items():
+        if numpy.isnan(values).any():
+            raise ValueError(f'The solver was unable to find a solution for some variables in at least: {key}')
+
+    return raw_results
+
+
+class StochasticOptimizer(Optimizer):
+    """Optimizer of the expected cost over the scenarios of the system, with the first period decisions shared. The
+    Results hold the expected (probability weighted) flows and the per scenario ones are kept in scenario_results.
+
+    Requires a system with an external grid.
+    """
+
+    cached_attributes = Optimizer.cached_attributes + ('scenario_results',)
+
+    def __init__(self, name='StochasticOptimizer', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.scenario_results = None
+        self.logger = logging.getLogger("pyems.StochasticOptimizer")
+
+    def model_inputs(self, config):
+        inputs = super().model_inputs(config)
+        inputs['load_scenarios'], inputs['generation_scenarios'], inputs['probabilities'] = self.get_scenarios(
+            config['periods']
+        )
+        return inputs
+
+    def get_scenarios(self, periods):
+        """Load and generation scenarios (n_scenarios, periods) and their probabilities. The first period is replaced
+        by its expected value, so the shared first period decisions face a single balance.
+        """
+
+        if self.system.fix_electrical_load_scenarios is None:
+            raise ValueError('The system has no scenarios. Create it with n_scenarios to use a StochasticOptimizer.')
+
+        probabilities = numpy.asarray(self.system.scenario_probabilities, dtype=float)
+        load = numpy.array(self.system.fix_electrical_load_scenarios, dtype=float)[:, :periods]
+        generation = numpy.array(self.system.stochastic_electrical_gen_scenarios, dtype=float)[:, :periods]
+        load[:, 0] = probabilities @ load[:, 0]
+        generation[:, 0] = probabilities @ generation[:, 0]
+
+        return load, generation, probabilities
+
+    def create_optimization_model(self, config):
+
+        self.logger.info('Creating stochastic optimization model.')
+
+        load, generation, probabilities, prices, battery = self.get_model_data(config)
+        self.optimization_model = build_scenario_model(load, generation, probabilities, prices, battery=battery)
+
+        return self.optimization_model
+
+    def get_model_data(self, config):
+        """Scenarios, probabilities, prices and battery parameters (or None) of the system."""
+
+        if not self.system.has_external_grid:
+            raise NotImplementedError('The stochastic optimizer requires an external grid.')
+        if self.system.has_interruptable_loads or self.system.has_schedulable_loads:
+            raise NotImplementedError('Flexible loads not implemented yet.')
+
+        supply = self.system.get_external_grid_object()
+        periods = config['periods']
+        load, generation, probabilities = self.get_scenarios(periods)
+        prices = {
+            'buy': numpy.array(supply.electricity_purchase_prices, dtype=float)[:periods],
+            'sell': numpy.array(supply.electricity_selling_prices, dtype=float)[:periods],
+        }
+        battery = battery_parameters(self.system.get_battery_object()) if self.system.has_battery else None
+
+        return load, generation, probabilities, prices, battery
+
+    def extract_results_from_opt_model(self, config):
+
+        self.logger.info('Extracting results from stochastic optimization model.')
+
+        m = self.optimization_model
+        return self.set_results(
+            model_values(m), m.load_scenarios, m.generation_scenarios, m.probabilities, m.prices, config
+        )
+
+    def set_results(self, raw_results, load, generation, probabilities, prices, config):
+        """Stores the per scenario results, the expected ones (as self.results) and the target SOC."""
+
+        shape = load.shape
+        scenario_results = {
+            'building_load': load,
+            'stochastic_generation': generation,
+            'power_supply_flow': combine_positive_negative_variables(
+                raw_results['buy'].ravel(), raw_results['sell'].ravel(),
+                'Invalid solution. The system buys and sells electricity at the same time'
+            ).reshape(shape),
+        }
+        if 'soc' in raw_results:
+            scenario_results['battery_energy_flow'] = combine_positive_negative_variables(
+                raw_results['batt_dis'].ravel(), raw_results['batt_chrg'].ravel(),
+                'Invalid solution. The system is charging and discharging the battery at the same time'
+            ).reshape(shape)
+            scenario_results['battery_soc'] = raw_results['soc']  # Includes the SOC at the end of the last period
+
+        # Expected values
+        results = {key: probabilities @ values[:, :shape[1]] for key, values in scenario_results.items()}
+        if not self.system.has_stochastic_generators:
+            results.pop('stochastic_generation')
+        results['prices_buy'] = prices['buy']
+        results['prices_sell'] = prices['sell']
+
+        timestep = timestep_conversion(config['timestep'], pd_units=True)
+        results_index = pandas.date_range(start=config['start'], periods=config['periods'], freq=timestep)
+
+        self.scenario_results = scenario_results
+        self.results = pandas.DataFrame(results, index=results_index)
+
+        # The SOC after the first period is shared by all the scenarios: the target SOC for the next period.
+        if 'soc' in raw_results:
+            self.target_soc = float(raw_results['soc'][0, 1])
+
+        return results
+
+    def check_solution_physical_validity(self, config, tolerance=1e-2):
+
+        self.logger.info('Checking physical validity of the results of every scenario.')
+
+        scenario_results = self.scenario_results
+        energy_balance = scenario_results['power_supply_flow'] + scenario_results['stochastic_generation'] \
+            - scenario_results['building_load']
+        if self.system.has_battery:
+            energy_balance = energy_balance + scenario_results['battery_energy_flow']
+
+        if (numpy.abs(energy_balance) > tolerance).any():
+            raise ValueError('Invalid solution. Energy balance violation in the system.')
+
+        if self.system.has_battery:
+            battery = self.system.get_battery_object()
+            flow, soc = scenario_results['battery_energy_flow'], scenario_results['battery_soc']
+            battery_balance = battery.batt_C * (soc[:, 1:] - soc[:, :-1]) \
+                + 1 / battery.batt_dis_per * numpy.clip(flow, 0, None) \
+                + battery.batt_chrg_per * numpy.clip(flow, None, 0)
+
+            if (numpy.abs(battery_balance) > tolerance).any():
+                raise ValueError('Invalid solution. Energy balance violation in the battery.')
+
+    def clear(self):
+        super().clear()
+        self.scenario_results = None
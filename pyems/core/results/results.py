@@ -28,13 +28,22 @@ class Results(Entity):
         display_results.index = display_results.index.tz_localize(pytz.utc).tz_convert(self.local_tz)
         display_results.to_csv(os.path.join(file_path, file_name), sep=',')
 
-    def write_target_soc_to_influxdb(self, soc_entity_id=None, db_connection_parameters=None, measurement='%'):
+    def write_target_soc_to_influxdb(
+            self, soc_entity_id=None, db_connection_parameters=None, measurement='%', writer=None
+    ):
+        """Writes the target SOC. If an InfluxDBBufferedWriter is given the point is queued and sent in background, the
+        writer must be closed (or it is closed at exit) to make sure the point is sent.
+        """
 
         self.logger.info('Writing target SOC to InfluxDB.')
 
         if soc_entity_id is None:
             raise ValueError('An entity id must be specified for the SOC.')
 
+        if writer is not None:
+            writer.write_point(measurement=measurement, entity_id=soc_entity_id, value=self.target_soc * 100)
+            return
+
         write_point_to_influxdb(
             measurement=measurement, entity_id=soc_entity_id, value=self.target_soc * 100,
             db_connection_parameters=db_connection_parameters
@@ -0,0 +1,142 @@
+"""Runner of the EMS of many sites (buildings) in a single process.
+
+Every site is a System, an Optimizer and a data handler with its own Simulation. Each control period the steps of all
+the sites are scheduled in a pool of worker threads: the steps mostly wait on data requests and on the solver
+processes, and the threads share the imported libraries and the data caches. The solver calls themselves are serialized
+(see optimizer.solver_lock). The data handlers created with the same SharedSeriesCache (see Fleet.shared_cache) load
+the common series, like the electricity prices, once for all the sites.
+
+Example of use:
+    fleet = Fleet(timestep='15m', workers=8, shared_labels=['purchase_price', 'sell_price'])
+    data_handler = MyDataHandler(timestep='15m', shared_cache=fleet.shared_cache)
+    fleet.add_site('building_1', system, optimizer, data_handler)
+    results = fleet.run_step(current_time)
+    print(fleet.latency_report())
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy
+
+from pyems.config import Parameter
+from pyems.core.iodata.data_handler import SharedSeriesCache
+from pyems.core.simulation.simulation import Simulation
+
+
+class FleetSite:
+    """The objects of a site. The fleet keeps the strong references, the Simulation only weak ones."""
+
+    def __init__(self, name, system, optimizer, data_handler, simulation):
+        self.name = name
+        self.system = system
+        self.optimizer = optimizer
+        self.data_handler = data_handler
+        self.simulation = simulation
+        self.latencies = []
+        self.errors = 0
+        self.last_error = None
+
+
+class Fleet:
+    """Schedules the steps of many sites each control period in a pool of worker threads (one after another with
+    workers=None). A failing site is logged and does not stop the others. The time of every step is kept per site.
+    """
+
+    def __init__(self, timestep, workers=None, shared_labels=(), shared_cache=None):
+        self.timestep = timestep
+        self.workers = workers
+        self.shared_cache = SharedSeriesCache(shared_labels) if shared_cache is None else shared_cache
+        self.sites = {}
+        self._executor = None
+        self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.Fleet')
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fleet')
+        return self._executor
+
+    def add_site(self, name, system, optimizer, data_handler, trigger=None):
+        """Adds a site. With a ReoptimizationTrigger its steps reuse the last plan while the inputs do not change."""
+
+        if name in self.sites:
+            raise ValueError(f'There is already a site named {name} in the fleet.')
+        if optimizer.write_solver_info and any(
+                site.optimizer.write_solver_info and site.optimizer.info_path == optimizer.info_path
+                for site in self.sites.values()
+        ):
+            raise ValueError(f'The optimizer of site {name} would write its solver info files over the ones of '
+                             f'another site. Give it its own info_path or set write_solver_info=False.')
+
+        simulation = Simulation(timestep=self.timestep, trigger=trigger)
+        simulation.system = system
+        simulation.optimizer = optimizer
+        self.sites[name] = FleetSite(name, system, optimizer, data_handler, simulation)
+
+        return self.sites[name]
+
+    def run_site_step(self, site, current_time, **step_kwargs):
+        """Runs the step of one site and clears its state. Returns its Results, or None if it failed."""
+
+        start = perf_counter()
+        try:
+            results = site.simulation.run_single_step(current_time=current_time, **step_kwargs)
+        except Exception as error:
+            site.errors += 1
+            site.last_error = error
+            self.logger.exception(f'Step of site {site.name} failed.')
+            results = None
+        finally:
+            site.system.clear()
+            site.optimizer.clear()
+            site.simulation.clear()
+            site.latencies.append(perf_counter() - start)
+
+        return results
+
+    def run_step(self, current_time=None, **step_kwargs):
+        """Runs the step of every site. Accepts the arguments of Simulation.run_single_step. Returns a dict with the
+        Results of each site (None for the failed ones).
+        """
+
+        self.logger.info(f'Running the step of {len(self.sites)} sites.')
+
+        if self.workers is None:
+            return {
+                name: self.run_site_step(site, current_time, **step_kwargs) for name, site in self.sites.items()
+            }
+
+        futures = {
+            name: self.executor.submit(self.run_site_step, site, current_time, **step_kwargs)
+            for name, site in self.sites.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    def run_rolling_window(self, time_range, **step_kwargs):
+        """Runs a step of every site at each time of time_range. Returns a list with the results of every step."""
+        return [self.run_step(current_time=step, **step_kwargs) for step in time_range]
+
+    def latency_report(self):
+        """Per site statistics of the step time in seconds and number of failed steps."""
+
+        report = {}
+        for name, site in self.sites.items():
+            latencies = numpy.array(site.latencies)
+            report[name] = {
+                'steps': latencies.shape[0], 'errors': site.errors,
+                'last': float(latencies[-1]) if latencies.shape[0] else None,
+                'mean': float(latencies.mean()) if latencies.shape[0] else None,
+                'max': float(latencies.max()) if latencies.shape[0] else None,
+            }
+        return report
+
+    def close(self):
+        """Shuts down the worker threads and the forecast pools of the systems."""
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for site in self.sites.values():
+            site.system.close()
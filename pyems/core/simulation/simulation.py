@@ -3,6 +3,7 @@ import pytz
 import weakref
 import pandas
 import datetime
+from time import perf_counter
 
 # Local application imports
 from pyems.config import Constant, Parameter
@@ -13,18 +14,25 @@ from pyems.core.utils.time import (
     timestep_conversion, split_timestep, local_to_utc, utc_to_local, get_current_time, find_next_step_start,
     get_following_midnight_utc_timestamp, get_fix_simulation_length_end_timestamp, timestep_to_seconds
 )
-from pyems.core.utils.singleton import Singleton
 
 
-class Simulation(Entity, metaclass=Singleton):
+class Simulation(Entity):
+    """Runs the optimization steps of one system. Several simulations can live in the same process (see Fleet).
 
-    def __init__(self, timestep, current_time=None):
+    With a ReoptimizationTrigger, a step only solves the optimization model when its inputs differ from the ones of the
+    previous plan; otherwise the previous plan is reused from the new start (see ReoptimizationTrigger). A plan is
+    only reused with a fixed end, i.e. simulation_end='prices_availability' or 'midnight_ahead'.
+    """
+
+    def __init__(self, timestep, current_time=None, trigger=None):
         super().__init__(name='Simulation', entity_type='simulation')
 
         self._system, self._optimizer = None, None
         self.start, self.end, self.periods, self.interval = None, None, None, None
         self.results = None
         self.simulation_mode = None
+        self.trigger = trigger
+        self._moving_end_warned = False
 
         self.timestep = timestep
         self.max_timestep_seconds = 1 * Constant.HOUR_SECONDS  # 1 hour is the max step
@@ -144,6 +152,10 @@ class Simulation(Entity, metaclass=Singleton):
 
         if simulation_end == 'fix':
             self.end = get_fix_simulation_length_end_timestamp(self.start, simulation_length=simulation_length)
+            if self.trigger is not None and not self._moving_end_warned:
+                self.logger.warning('With a fix simulation length the end moves every step, so the trigger never '
+                                    'reuses a plan. Use prices_availability or midnight_ahead as simulation_end.')
+                self._moving_end_warned = True
         elif simulation_end == 'prices_availability':
             if self.system.has_external_grid:
 
@@ -177,7 +189,15 @@ class Simulation(Entity, metaclass=Singleton):
 
         time_config = self.get_time_configuration()
         self.system.prepare_to_optimize(config=time_config)
+
+        if self.trigger is not None and self.trigger.decide(self.system, time_config):
+            self.results = self.trigger.shifted_plan(self.system, time_config)
+            return self.results
+
+        solve_start = perf_counter()
         self.results = self.optimizer.solve(system=self.system, config=time_config)
+        if self.trigger is not None:
+            self.trigger.record(self.system, self.results, time_config, perf_counter() - solve_start)
 
         return self.results
 
@@ -0,0 +1,153 @@
+"""Event driven re-optimization.
+
+In operation mode the inputs of a step (forecasts, prices, measured SOC) are often nearly the ones the previous plan
+assumed. The ReoptimizationTrigger compares the fresh inputs of the step with the assumptions of the last plan and, if
+they are within tolerance, the Simulation reuses that plan shifted to the new start instead of solving again.
+
+Example of use:
+    trigger = ReoptimizationTrigger(soc_tolerance=0.02, forecast_tolerance=0.05, max_reuses=8)
+    simulation = Simulation(timestep='15m', trigger=trigger)
+    simulation.run_rolling_window(...)
+    print(trigger.summary())
+"""
+
+import logging
+from collections import Counter
+
+import numpy
+
+from pyems.config import Parameter
+from pyems.core.results.results import Results
+
+
+class ReoptimizationTrigger:
+    """Decides whether a step must be solved again or the previous plan can be reused.
+
+    The plan is solved again when there is no previous plan, it does not cover the new horizon (e.g. the prices of
+    the next day were published) or it was reused max_reuses times in a row, and when any of the inputs differ from
+    the plan assumptions:
+        - SOC: the measured initial SOC differs from the planned SOC at the start by more than soc_tolerance, or the
+        final SOC changed.
+        - Forecasts: the fresh load or generation forecast differs from the planned one by more than
+        forecast_tolerance, as relative error over the horizon (sum of absolute differences over sum of the plan).
+        - Prices: any price differs by more than price_tolerance.
+
+    The plan is only reused while the end of the horizon stays the same, so the Simulation must run with a fixed end
+    (simulation_end='prices_availability' or 'midnight_ahead'). With simulation_end='fix' the end moves every step and
+    every step is solved again.
+
+    Every decision is kept in self.decisions with its reason, and the solve time saved by the reuses (estimated with
+    the mean time of the solves) in self.saved_time, in seconds.
+    """
+
+    def __init__(self, soc_tolerance=0.02, forecast_tolerance=0.05, price_tolerance=1e-6, max_reuses=None):
+        self.soc_tolerance = soc_tolerance
+        self.forecast_tolerance = forecast_tolerance
+        self.price_tolerance = price_tolerance
+        self.max_reuses = max_reuses
+
+        self.plan = None
+        self.plan_end = None
+        self.plan_soc_l = None
+        self.reuses = 0
+        self.solve_times = []
+        self.saved_time = 0.0
+        self.decisions = []
+        self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.ReoptimizationTrigger')
+
+    @staticmethod
+    def relative_error(new, planned):
+        return float(numpy.abs(new - planned).sum() / max(numpy.abs(planned).sum(), 1e-9))
+
+    def check(self, system, config):
+        """Compares the inputs of the prepared system with the plan assumptions. Returns whether the plan can be reused,
+        the reason and the value that exceeded its tolerance (or None).
+        """
+
+        plan = self.plan
+        if plan is None:
+            return False, 'no previous plan', None
+        if config['end'] != self.plan_end or config['start'] not in plan.index:
+            return False, 'horizon changed', None
+
+        remaining = plan.loc[config['start']:]
+        if remaining.shape[0] != config['periods'] or remaining.shape[0] < 2:
+            return False, 'plan does not cover the horizon', None
+        if self.max_reuses is not None and self.reuses >= self.max_reuses:
+            return False, 'max reuses reached', self.reuses
+
+        if system.has_battery:
+            battery = system.get_battery_object()
+            deviation = abs(battery.soc_0 - float(remaining['battery_soc'].iloc[0]))
+            if deviation > self.soc_tolerance:
+                return False, 'SOC deviation', deviation
+            if battery.soc_l != self.plan_soc_l:
+                return False, 'final SOC changed', None
+
+        for label, forecast in [
+            ('building_load', system.fix_electrical_load), ('stochastic_generation', system.stochastic_electrical_gen)
+        ]:
+            if forecast is not None and label in remaining:
+                error = self.relative_error(numpy.asarray(forecast, dtype=float), remaining[label].values)
+                if error > self.forecast_tolerance:
+                    return False, f'{label} forecast error', error
+
+        if system.has_external_grid:
+            grid = system.get_external_grid_object()
+            for label, prices in [
+                ('prices_buy', grid.electricity_purchase_prices), ('prices_sell', grid.electricity_selling_prices)
+            ]:
+                change = float(numpy.abs(numpy.asarray(prices, dtype=float) - remaining[label].values).max())
+                if change > self.price_tolerance:
+                    return False, f'{label} changed', change
+
+        return True, 'inputs within tolerance', None
+
+    def decide(self, system, config):
+        """check() with the decision logged and recorded."""
+
+        reuse, reason, value = self.check(system, config)
+        self.decisions.append({'time': config['start'], 'reuse': reuse, 'reason': reason, 'value': value})
+        reason = reason if value is None else f'{reason} ({value:.3g})'
+        if reuse:
+            self.reuses += 1
+            self.saved_time += float(numpy.mean(self.solve_times)) if self.solve_times else 0.0
+            self.logger.info(f'Reusing the previous plan at {config["start"]}: {reason}.')
+        else:
+            self.logger.info(f'Re-optimizing at {config["start"]}: {reason}.')
+
+        return reuse
+
+    def shifted_plan(self, system, config):
+        """Results of the previous plan from the new start."""
+
+        remaining = self.plan.loc[config['start']:].copy()
+        soc_0 = system.get_battery_object().soc_0 if system.has_battery else None
+        target_soc = float(remaining['battery_soc'].iloc[1]) if 'battery_soc' in remaining else None
+
+        return Results(output_data=remaining, target_soc=target_soc, initial_soc=soc_0, timestamp=config['start'])
+
+    def record(self, system, results, config, solve_time):
+        """Keeps the new plan and its assumptions."""
+
+        self.plan = results.raw_results
+        self.plan_end = config['end']
+        self.plan_soc_l = system.get_battery_object().soc_l if system.has_battery else None
+        self.reuses = 0
+        self.solve_times.append(solve_time)
+
+    def summary(self):
+        """Number of solves and reuses, the estimated solve time saved in seconds and the count of every reason."""
+
+        reuses = sum(decision['reuse'] for decision in self.decisions)
+        return {
+            'solves': len(self.decisions) - reuses, 'reuses': reuses, 'saved_time': self.saved_time,
+            'reasons': Counter(decision['reason'] for decision in self.decisions),
+        }
+
+    def reset(self):
+        """Forgets the plan, e.g. after a manual intervention on the system."""
+        self.plan = None
+        self.plan_end = None
+        self.plan_soc_l = None
+        self.reuses = 0
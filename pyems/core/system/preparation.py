@@ -0,0 +1,122 @@
+"""Task graph of the preparation of a system for the optimization.
+
+The preparation reads and computes independent inputs: the forecast of every load and generator (summed by a task
+depending on them), the initial and final SOC of the battery and the grid prices. As a graph of tasks (a task starts
+once the tasks it depends on are done) they run concurrently in a pool of threads, so the preparation takes about as
+long as its slowest chain of tasks. The tasks mostly wait on data requests; the CPU bound forecasts run in the
+forecast pool of the system (worker processes), if any. A data handler with serialize_requests runs its requests one
+at a time (see BaseDataHandler).
+
+A failing task does not stop the others, only the tasks depending on it are skipped. Once all of them finish the error
+of the first failed task is raised. The status and time of every task are kept for inspection.
+"""
+
+import logging
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+from time import perf_counter
+
+from pyems.config import Parameter
+
+
+class PreparationTask:
+
+    def __init__(self, name, function, depends=()):
+        self.name = name
+        self.function = function
+        self.depends = tuple(depends)
+        self.status = 'pending'  # pending, running, done, failed or skipped
+        self.start = None  # Seconds from the start of the graph
+        self.duration = None
+        self.error = None
+
+    def run(self, graph_start):
+        self.start = perf_counter() - graph_start
+        try:
+            self.function()
+        except Exception as error:
+            self.status, self.error = 'failed', error
+        else:
+            self.status = 'done'
+        self.duration = perf_counter() - graph_start - self.start
+        return self
+
+
+class TaskGraph:
+    """Tasks added in dependency order (a task can only depend on tasks added before it, so there are no cycles)."""
+
+    def __init__(self, name='preparation'):
+        self.name = name
+        self.tasks = OrderedDict()
+        self.logger = logging.getLogger(f'{Parameter.PACKAGE_NAME}.TaskGraph')
+
+    def add(self, name, function, depends=()):
+        if name in self.tasks:
+            raise ValueError(f'There is already a task named {name}.')
+        unknown = [dependency for dependency in depends if dependency not in self.tasks]
+        if unknown:
+            raise ValueError(f'Task {name} depends on unknown tasks: {unknown}.')
+        self.tasks[name] = PreparationTask(name, function, depends)
+        return self.tasks[name]
+
+    def ready(self, task):
+        """True if the task can start, False if it must wait. Skips it if a dependency did not succeed."""
+
+        statuses = [self.tasks[dependency].status for dependency in task.depends]
+        if any(status in ('failed', 'skipped') for status in statuses):
+            task.status = 'skipped'
+            return False
+        return all(status == 'done' for status in statuses)
+
+    def run(self, executor=None):
+        """Runs the tasks in the executor (a thread pool) or, without one, one after another. Returns the timings."""
+
+        graph_start = perf_counter()
+        pending = list(self.tasks.values())
+
+        if executor is None:
+            for task in pending:
+                if self.ready(task):
+                    task.run(graph_start)
+        else:
+            running = set()
+            while pending or running:
+                for task in list(pending):
+                    if self.ready(task):
+                        task.status = 'running'
+                        running.add(executor.submit(task.run, graph_start))
+                    if task.status != 'pending':
+                        pending.remove(task)
+                if running:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()  # PreparationTask.run does not raise
+                elif pending:  # Unreachable with tasks added in dependency order
+                    raise ValueError(f'Tasks {[task.name for task in pending]} can never start.')
+
+        for task in self.tasks.values():
+            if task.status == 'failed':
+                self.logger.error(f'Task {task.name} of the {self.name} failed.', exc_info=task.error)
+            elif task.status == 'skipped':
+                self.logger.warning(f'Task {task.name} of the {self.name} skipped, a dependency failed.')
+
+        timings = self.timings()
+        slowest = max(self.tasks.values(), key=lambda task: task.duration or 0, default=None)
+        if slowest is not None:
+            self.logger.info(f'The {self.name} took {perf_counter() - graph_start:.3f} s, the slowest task was '
+                             f'{slowest.name} ({slowest.duration or 0:.3f} s).')
+
+        return timings
+
+    def timings(self):
+        return {
+            name: {'status': task.status, 'start': task.start, 'duration': task.duration, 'error': task.error}
+            for name, task in self.tasks.items()
+        }
+
+    def raise_failure(self):
+        """Raises the error of the first failed task, if any."""
+
+        for task in self.tasks.values():
+            if task.status == 'failed':
+                raise task.error
@@ -1,5 +1,6 @@
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
 import numpy
@@ -7,14 +8,29 @@ import numpy
 from pyems.config import ElectricalType, ElectricalLoadSubType, ElectricalGeneratorSubType
 from pyems.core.entity.entity import Entity
 from pyems.core.components.base import BaseSystemComponent
+from pyems.core.forecasting.cache import CachedForecaster
+from pyems.core.forecasting.pool import ForecastPool
+from pyems.core.system.preparation import TaskGraph
 
 
 class System(Entity):
     """This class is thought to contain other physical entities and represents a real physical system. It also provides
     the methods to evaluate global properties of the system, like the total load and demand or the final SOC.
+
+    If forecast_workers is given, the forecasts of the fix loads and stochastic generators are run in parallel in a
+    pool of worker processes that lives across steps (see close). The components sharing a batched forecast model
+    (e.g. GlobalRidgeForecaster) are forecast in a single call.
+
+    If n_scenarios is given, the forecasts also produce n_scenarios equiprobable scenarios of the aggregated load and
+    generation (see compute_scenarios), used by the StochasticOptimizer.
+
+    If preparation_workers is given, the independent tasks of prepare_to_optimize (the forecast of every component,
+    initial and final SOC, purchase and sell prices) run concurrently in a pool of threads that lives across steps (see
+    TaskGraph and preparation_graph). The status and time of every task of the last preparation are kept in
+    preparation_timings.
     """
 
-    def __init__(self, name):
+    def __init__(self, name, forecast_workers=None, n_scenarios=None, scenario_seed=None, preparation_workers=None):
         super().__init__(name, entity_type='system')
 
         self.entities = {}
@@ -35,6 +51,15 @@ class System(Entity):
 
         self.stochastic_electrical_gen = None
         self.fix_electrical_load = None
+        self.n_scenarios = n_scenarios
+        self.scenario_seed = scenario_seed
+        self.stochastic_electrical_gen_scenarios = None  # Arrays (n_scenarios, periods)
+        self.fix_electrical_load_scenarios = None
+        self.scenario_probabilities = None
+        self.forecast_pool = None if forecast_workers is None else ForecastPool(max_workers=forecast_workers)
+        self.preparation_workers = preparation_workers
+        self._preparation_executor = None
+        self.preparation_timings = None
         self.logger = logging.getLogger("pyems.System")
         self.logger.info('Creating System definition.')
 
@@ -147,6 +172,207 @@ class System(Entity):
         self.stochastic_electrical_gen = stochastic_electrical_gen
         return stochastic_electrical_gen
 
+    def get_forecasting_components(self):
+        loads = [self.entities[load] for load in self.electrical_loads[ElectricalLoadSubType.FIX]]
+        generators = [self.entities[gen] for gen in self.electrical_generators[ElectricalGeneratorSubType.STOCHASTIC]]
+        return loads, generators
+
+    def forecast_batches(self, components, n_scenarios=None):
+        """Positions of the components sharing a batched model (one with forecast_many), grouped by model and timestep,
+        and positions of the rest. With n_scenarios the models with forecast_scenarios are not batched.
+        """
+
+        batches, single = {}, []
+        for position, component in enumerate(components):
+            model = component.forecast_model
+            if hasattr(model, 'forecast_many') and (n_scenarios is None or not hasattr(model, 'forecast_scenarios')):
+                batches.setdefault((id(model), component.timestep), []).append(position)
+            else:
+                single.append(position)
+
+        return list(batches.values()), single
+
+    def forecast_components(self, components, inputs, positions, n_scenarios=None, batched=False):
+        """Forecasts the components at positions from their inputs (interval, data), in a single call of their shared
+        model if batched. Returns the results in the same order. With n_scenarios, the result of a component whose model
+        has forecast_scenarios is the pair (forecast, scenarios) it returns, sampled with the seed scenario_seed plus
+        the position.
+
+        The results behind a CachedForecaster are looked up first, only the misses are computed: in the forecast pool,
+        if any, or one after another. The state of a stateful model lives in the pool workers, not in the copy here, so
+        with a pool those skip the cache.
+        """
+
+        if batched:
+            model = components[positions[0]].forecast_model
+            return model.forecast_many(
+                inputs[positions[0]][0], [inputs[position][1] for position in positions],
+                [components[position].historical_label for position in positions], components[positions[0]].timestep
+            )
+
+        results = {}
+        tasks, task_positions, cache_keys = [], [], {}
+        for position in positions:
+            component = components[position]
+            model, (interval, data) = component.forecast_model, inputs[position]
+            cached = model if isinstance(model, CachedForecaster) else None
+            if cached is not None:
+                model = cached.model
+
+            scenarios = None
+            if n_scenarios is not None and hasattr(model, 'forecast_scenarios'):
+                scenarios = n_scenarios, None if self.scenario_seed is None else self.scenario_seed + position
+
+            if cached is not None and (self.forecast_pool is None or not getattr(model, 'stateful', False)):
+                key = cached.cache.make_key(model, interval, data, component.historical_label, component.timestep)
+                key = key if scenarios is None else key + scenarios
+                results[position] = cached.cache.get(key)
+                if results[position] is not None:
+                    continue
+                cache_keys[position] = key
+
+            tasks.append((model, interval, data, component.historical_label, component.timestep, scenarios))
+            task_positions.append(position)
+
+        if self.forecast_pool is not None and tasks:
+            # The models stay in the workers with their state, see ForecastPool.
+            for position, result in zip(task_positions, self.forecast_pool.forecast(tasks)):
+                results[position] = result
+        else:
+            for position, (model, interval, data, target_label, timestep, scenarios) in zip(task_positions, tasks):
+                if scenarios is None:
+                    results[position] = model.forecast(interval, data, target_label, timestep=timestep)
+                else:
+                    results[position] = model.forecast_scenarios(
+                        interval, data, target_label, timestep, n_scenarios=scenarios[0], seed=scenarios[1]
+                    )
+
+        for position, key in cache_keys.items():
+            components[position].forecast_model.cache.put(key, results[position])
+
+        return [results[position] for position in positions]
+
+    def aggregate_forecasts(self, loads, generators, results, simulation_periods, scenarios=False):
+        """Stores the forecast of every component (loads plus generators, in the order of results) and sums them into
+        the aggregates. With scenarios, also sums the scenarios (see compute_scenarios).
+        """
+
+        self.fix_electrical_load = numpy.zeros(simulation_periods)
+        self.stochastic_electrical_gen = numpy.zeros(simulation_periods)
+        if scenarios:
+            load_scenarios = numpy.zeros((self.n_scenarios, simulation_periods))
+            gen_scenarios = numpy.zeros((self.n_scenarios, simulation_periods))
+
+        for component, result in zip(loads + generators, results):
+            forecast, component_scenarios = result if isinstance(result, tuple) else (result, None)
+            if scenarios and component_scenarios is None:
+                component_scenarios = numpy.squeeze(forecast.values)[None, :]
+
+            forecast = numpy.squeeze(component.store_forecast(forecast).values)
+            if component in loads:
+                self.fix_electrical_load = self.fix_electrical_load + forecast
+            else:
+                self.stochastic_electrical_gen = self.stochastic_electrical_gen + forecast
+
+            if scenarios:
+                component_scenarios = numpy.clip(component_scenarios, 0, None)
+                component_scenarios[:, 0] = forecast[0]
+                if component in loads:
+                    load_scenarios = load_scenarios + component_scenarios
+                else:
+                    gen_scenarios = gen_scenarios + component_scenarios
+
+        if not scenarios:
+            return self.fix_electrical_load, self.stochastic_electrical_gen
+
+        self.fix_electrical_load_scenarios = load_scenarios
+        self.stochastic_electrical_gen_scenarios = gen_scenarios
+        self.scenario_probabilities = numpy.full(self.n_scenarios, 1 / self.n_scenarios)
+
+        return load_scenarios, gen_scenarios
+
+    def forecast_groups(self, components, n_scenarios=None, concurrent=False):
+        """Groups of positions forecast together, as (positions, batched) pairs: every batch (see forecast_batches) and
+        the rest of the components in one group or, if concurrent (each group runs in its own thread), every component
+        on its own. Without a forecast pool, the components sharing a model are then kept in one group, so the model is
+        never called from two threads at once.
+        """
+
+        batches, single = self.forecast_batches(components, n_scenarios)
+        groups = [(positions, True) for positions in batches]
+        if not concurrent:
+            return groups + [(single, False)] if single else groups
+        if self.forecast_pool is not None:
+            return groups + [([position], False) for position in single]
+
+        shared = {}
+        for position in single:
+            model = components[position].forecast_model
+            model = model.model if isinstance(model, CachedForecaster) else model
+            shared.setdefault(id(model), []).append(position)
+        return groups + [(positions, False) for positions in shared.values()]
+
+    def forecast_graph(self, prediction_interval, simulation_periods, graph=None):
+        """Adds to the graph (a new TaskGraph by default) a task per forecast group (see forecast_groups), usually a
+        single component, that reads its data and forecasts it, and the forecasts task, which sums them once they are
+        all done (see aggregate_forecasts). The groups run concurrently with preparation_workers. Returns the graph.
+        """
+
+        graph = TaskGraph(name=f'forecasts of {self.name}') if graph is None else graph
+        loads, generators = self.get_forecasting_components()
+        components = loads + generators
+        inputs, results = [None] * len(components), [None] * len(components)
+
+        def forecast_group(positions, batched):
+            for position in positions:
+                inputs[position] = components[position].get_forecast_input(prediction_interval)
+            forecasts = self.forecast_components(components, inputs, positions, self.n_scenarios, batched=batched)
+            for position, result in zip(positions, forecasts):
+                results[position] = result
+
+        forecast_tasks = []
+        concurrent = self.preparation_workers is not None
+        for positions, batched in self.forecast_groups(components, self.n_scenarios, concurrent=concurrent):
+            name = 'forecast_' + '+'.join(components[position].name for position in positions)
+            if name in graph.tasks:  # Components with the same name
+                name = 'forecast_' + '+'.join(str(components[position].id) for position in positions)
+            graph.add(name, lambda positions=positions, batched=batched: forecast_group(positions, batched))
+            forecast_tasks.append(name)
+
+        graph.add('forecasts', lambda: self.aggregate_forecasts(
+            loads, generators, results, simulation_periods, scenarios=self.n_scenarios is not None
+        ), depends=forecast_tasks)
+
+        return graph
+
+    def compute_forecasts(self, prediction_interval, simulation_periods):
+        """Counterpart of compute_total_fix_electrical_load and compute_total_stochastic_electrical_generation that
+        runs the forecast tasks of the preparation (see forecast_graph): the components sharing a batched model (one
+        with forecast_many) are forecast in a single call, and the rest run in the forecast pool, if any, or one after
+        another. Returns the aggregates, or the scenarios with n_scenarios (see compute_scenarios).
+        """
+
+        graph = self.forecast_graph(prediction_interval, simulation_periods)
+        graph.run(self.preparation_executor)
+        graph.raise_failure()
+
+        if self.n_scenarios is not None:
+            return self.fix_electrical_load_scenarios, self.stochastic_electrical_gen_scenarios
+        return self.fix_electrical_load, self.stochastic_electrical_gen
+
+    def compute_scenarios(self, prediction_interval, simulation_periods):
+        """Point forecasts and scenarios of the aggregated fix load and stochastic generation. Each component samples
+        n_scenarios with the forecast_scenarios method of its model (a component whose model has none contributes its
+        point forecast to every scenario) and the scenarios are summed by position. The forecasts take the same path as
+        in compute_forecasts: cache, batches and forecast pool. The scenarios are clipped at zero and not
+        postprocessed. The first period of every scenario is set to the point forecast: it is the period decided here
+        and now, shared by all the scenarios.
+        """
+
+        if self.n_scenarios is None:
+            raise ValueError('The system has no n_scenarios to compute.')
+        return self.compute_forecasts(prediction_interval, simulation_periods)
+
     def clear_total_fix_electrical_load(self):
         for load in self.electrical_loads[ElectricalLoadSubType.FIX]:
             self.entities[load].load_forecast_array = None
@@ -163,30 +389,61 @@ class System(Entity):
         if not self.has_electrical_load:
             raise ValueError('At least one load must be included in the system to run a simulation.')
 
-    def prepare_to_optimize(self, config):
+    @property
+    def preparation_executor(self):
+        if self._preparation_executor is None and self.preparation_workers is not None:
+            self._preparation_executor = ThreadPoolExecutor(
+                max_workers=self.preparation_workers, thread_name_prefix='preparation'
+            )
+        return self._preparation_executor
 
-        prediction_interval = config['prediction_interval']
-        simulation_periods = config['periods']
-        current_time = config['current_time']
+    def preparation_graph(self, config):
+        """TaskGraph of prepare_to_optimize: the forecast tasks (see forecast_graph) and the independent SOC and price
+        tasks.
+        """
 
-        self.check_system_composition()
-        self.compute_total_fix_electrical_load(prediction_interval, simulation_periods)
-        self.compute_total_stochastic_electrical_generation(prediction_interval, simulation_periods)
+        prediction_interval = config['prediction_interval']
+        graph = TaskGraph(name=f'preparation of {self.name}')
+        self.forecast_graph(prediction_interval, config['periods'], graph)
 
         if self.has_battery:
             battery = self.get_battery_object()
-            battery.get_initial_soc(prediction_interval=prediction_interval)
-            battery.get_final_soc(prediction_interval=prediction_interval)
+            graph.add('initial_soc', lambda: battery.get_initial_soc(prediction_interval=prediction_interval))
+            graph.add('final_soc', lambda: battery.get_final_soc(prediction_interval=prediction_interval))
 
         if self.has_external_grid:
-            self.get_external_grid_object().get_prices(prediction_interval)
+            grid = self.get_external_grid_object()
+            if grid.prices_known_in_advance:
+                graph.add('purchase_prices', lambda: grid.get_purchase_prices(prediction_interval))
+                graph.add('sell_prices', lambda: grid.get_sell_prices(prediction_interval))
+            else:
+                graph.add('prices', lambda: grid.get_prices(prediction_interval))
+
+        return graph
+
+    def prepare_to_optimize(self, config):
+
+        self.check_system_composition()
+
+        graph = self.preparation_graph(config)
+        self.preparation_timings = graph.run(self.preparation_executor)
+        graph.raise_failure()
 
     def clear(self):
         self.clear_total_fix_electrical_load()
         self.clear_total_stochastic_electrical_generation()
+        self.fix_electrical_load_scenarios = None
+        self.stochastic_electrical_gen_scenarios = None
+        self.scenario_probabilities = None
         if self.has_battery:
             self.get_battery_object().clear()
         if self.has_external_grid:
             self.get_external_grid_object().clear()
 
-
+    def close(self):
+        """Shuts down the forecast pool and the preparation threads, if any."""
+        if self.forecast_pool is not None:
+            self.forecast_pool.close()
+        if self._preparation_executor is not None:
+            self._preparation_executor.shutdown()
+            self._preparation_executor = None
@@ -0,0 +1,39 @@
+"""Digests of the inputs of a computation (arrays, scalars and containers of them), used as cache keys."""
+
+import hashlib
+
+import numpy
+import pandas
+
+
+def update_digest(digest, value):
+    """Feeds a value (arrays, scalars, strings and nested dicts, lists or tuples of them) to a hashlib digest."""
+
+    if isinstance(value, (pandas.Series, pandas.DataFrame)):
+        value = value.to_numpy()
+    if isinstance(value, numpy.ndarray):
+        value = numpy.ascontiguousarray(value)
+        digest.update(f'array{value.dtype.str}{value.shape}'.encode('utf-8'))
+        digest.update(value.tobytes())
+    elif isinstance(value, dict):
+        digest.update(b'dict')
+        for key in sorted(value, key=repr):
+            update_digest(digest, key)
+            update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'sequence{len(value)}'.encode('utf-8'))
+        for item in value:
+            update_digest(digest, item)
+    else:
+        if isinstance(value, numpy.generic):
+            value = value.item()
+        digest.update(f'{type(value).__name__}:{value!r};'.encode('utf-8'))
+
+
+def hash_inputs(*values):
+    """Hex digest of the values (see update_digest)."""
+
+    digest = hashlib.blake2b(digest_size=20)
+    for value in values:
+        update_digest(digest, value)
+    return digest.hexdigest()
@@ -11,6 +11,7 @@ from math import ceil
 
 import pytz
 import numpy
+import pandas
 
 from pyems.config import (
     Parameter, Constant, PANDAS_TO_STD_CONVERSION_SHORT, STD_TO_PANDAS_CONVERSION_SHORT,
@@ -242,6 +243,50 @@ def series_upsampling(series, new_timestep, new_time_interval=None, old_timestep
     return series
 
 
+def series_upsampling_repeat(
+        series, new_timestep, new_time_interval=None, old_timestep='1h', upsample_values=False
+):
+    """NumPy counterpart of series_upsampling for regular series (one sample per old_timestep). Every old sample is
+    repeated with numpy.repeat and the index is built with numpy.arange on datetime64, so no pandas resampling nor
+    in-place insertion in the input frame is needed. The output is the same as series_upsampling.
+    """
+
+    old_timestep_seconds = timestep_to_seconds(old_timestep)
+    new_timestep_seconds = timestep_to_seconds(new_timestep)
+
+    if new_timestep_seconds > old_timestep_seconds:
+        raise ValueError('Downsampling not supported.')
+    if old_timestep_seconds % new_timestep_seconds != 0:
+        raise ValueError('The new timestep must divide the old timestep in equal parts.')
+
+    if new_time_interval is None:
+        index = series.index.to_pydatetime()
+        time_interval = [index[0], index[-1]]
+    else:
+        time_interval = new_time_interval
+
+    start = numpy.datetime64(series.index[0], 'ns')
+    step = numpy.timedelta64(new_timestep_seconds, 's').astype('timedelta64[ns]')
+    periods = max(-(-(numpy.datetime64(time_interval[1], 'ns') - start) // step), 0)
+
+    values = numpy.repeat(series.values, old_timestep_seconds // new_timestep_seconds, axis=0)[:periods]
+    if values.shape[0] < periods:  # Pad with the last value up to the end of the interval
+        padding = numpy.repeat(values[-1:], periods - values.shape[0], axis=0)
+        values = numpy.concatenate([values, padding])
+    if upsample_values:
+        values = values * (new_timestep_seconds / old_timestep_seconds)
+
+    new_index = pandas.DatetimeIndex(start + numpy.arange(periods) * step)
+    first = new_index.searchsorted(numpy.datetime64(time_interval[0], 'ns'))
+
+    if values.ndim > 1:
+        upsampled = pandas.DataFrame(values[first:], index=new_index[first:], columns=series.columns)
+    else:
+        upsampled = pandas.Series(values[first:], index=new_index[first:], name=series.name)
+
+    return upsampled
+
+
 def utc_to_local(utc_datetime, local_tz, output='dt'):
 
     if output not in ['dt', 'str']:
@@ -1,7 +1,18 @@
 from pyems.config import Setting
 from pyems.core.components import *
-from pyems.core.iodata.data_handler import BaseDataHandler
+from pyems.core.iodata.data_handler import BaseDataHandler, SharedSeriesCache
 from pyems.core.forecasting.prophet import ProphetOracle
+from pyems.core.forecasting.cache import ForecastCache, CachedForecaster
+from pyems.core.forecasting.lightweight import (
+    SeasonalNaiveForecaster, HoltWintersForecaster, RidgeForecaster, RecursiveLeastSquaresForecaster,
+    GlobalRidgeForecaster
+)
 from pyems.core.optimization.optimizer import Optimizer
+from pyems.core.optimization.cache import SolutionCache
+from pyems.core.optimization.stochastic import StochasticOptimizer
+from pyems.core.optimization.hedging import ProgressiveHedgingOptimizer
+from pyems.core.optimization.coordination import CoordinatedOptimizer
 from pyems.core.simulation.simulation import Simulation
+from pyems.core.simulation.fleet import Fleet
+from pyems.core.simulation.trigger import ReoptimizationTrigger
 from pyems.core.system.system import System
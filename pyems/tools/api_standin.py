@@ -0,0 +1,146 @@
+"""Local stand-in of the external APIs used by pyems.ioapis (ESIOS prices and forecast.solar).
+
+The answers are synthetic but follow the layout of the real APIs, so the request, retry and parsing code can be
+tested and benchmarked offline. An artificial latency can be added to every response to mimic a remote server.
+
+Example of use:
+    with ApiStandIn(latency=0.05) as server:
+        client = ApiClient(url_overrides=server.url_overrides)
+        prices = get_hourly_spanish_electricity_prices(interval, token='token', client=client)
+"""
+
+import datetime
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from pyems.config import Parameter
+from pyems.core.iodata.ioapis import ESIOS_API_URL, FORECAST_SOLAR_API_URL
+
+
+def synthetic_price(hour_datetime):
+    """Price in EUR/MWh with a daily shape."""
+    return 100 + 30 * math.sin(2 * math.pi * (hour_datetime.hour - 8) / 24)
+
+
+class ApiStandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # Keep the benchmarks output clean
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        standin = self.server.standin
+        status = standin.count_request(self.client_address)
+        try:
+            if standin.latency:
+                time.sleep(standin.latency)
+            self._answer(standin, status)
+        finally:
+            standin.release_request()
+
+    def _answer(self, standin, status):
+        url = urlparse(self.path)
+        route = url.path.strip('/').split('/')
+        params = parse_qs(url.query)
+
+        if status != 200:
+            self._send(status, {'error': 'Stand-in failure.'})
+        elif route[0] == 'esios' and route[1] == 'indicators':
+            self._send(200, standin.esios_indicator(params['start_date'][0], params['end_date'][0]))
+        elif route[0] == 'forecast_solar' and route[1] == 'estimate':
+            self._send(200, standin.forecast_solar_estimate(*route[2:]))
+        else:
+            self._send(404, {'error': f'Unknown route: {url.path}'})
+
+
+class ApiStandIn:
+    """Threaded HTTP server answering the ESIOS indicator and forecast.solar estimate routes.
+
+    fail_first makes the first requests answer with a 503 status, to exercise the retry policy.
+    """
+
+    def __init__(self, latency=0.0, fail_first=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self._server = ThreadingHTTPServer((host, port), ApiStandInHandler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()
+        self.active, self.max_active = 0, 0
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def url_overrides(self):
+        return {ESIOS_API_URL: f'{self.url}/esios', FORECAST_SOLAR_API_URL: f'{self.url}/forecast_solar'}
+
+    def count_request(self, client_address):
+        with self._lock:
+            self.requests += 1
+            self.connections.add(client_address)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            return 503 if self.requests <= self.fail_first else 200
+
+    def release_request(self):
+        with self._lock:
+            self.active -= 1
+
+    def esios_indicator(self, start_date, end_date):
+        start = datetime.datetime.strptime(start_date, Parameter.O_CLOCK_FORMAT)
+        end = datetime.datetime.strptime(end_date, Parameter.O_CLOCK_FORMAT)
+        hours = int((end - start).total_seconds() // 3600) + 1
+        values = []
+        for h in range(hours):
+            hour = start + datetime.timedelta(hours=h)
+            values.append(
+                {'value': synthetic_price(hour), 'datetime_utc': hour.strftime(Parameter.UTC_DATETIME_FORMAT)}
+            )
+        return {'indicator': {'values': values}}
+
+    def forecast_solar_estimate(self, lat, long, declination, azimuth, pv_power):
+        today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        watt_hours = {}
+        for h in range(48):
+            hour = today + datetime.timedelta(hours=h)
+            sun = max(0.0, math.sin(math.pi * (hour.hour - 6) / 12))
+            watt_hours[hour.strftime(Parameter.LOCAL_DATETIME_FORMAT)] = round(float(pv_power) * 1000 * sun, 1)
+        return {'result': {'watt_hours': watt_hours}}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
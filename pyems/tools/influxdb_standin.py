@@ -0,0 +1,539 @@
+"""Local stand-in of an InfluxDB database.
+
+InMemoryInfluxDB keeps the series in NumPy arrays and answers the InfluxQL subset issued by pyems:
+
+    SELECT "value" | INTEGRAL("value") | MEAN("value") FROM "<measurement>"
+    WHERE "entity_id"='<id>' | "entity_id" =~ /<regex>/ AND time >= '<t0>' AND time < '<t1>'
+    GROUP BY time(<step>)[, "entity_id"] [fill(null|none|linear|previous|<number>)]
+
+It can be used through InfluxDBFakeClient, which is injected in place of an InfluxDBClient, or through InfluxDBStandIn, a
+threaded HTTP server that answers the /ping, /query and /write routes used by the influxdb client. The server speaks
+HTTP/1.1 and therefore keeps the connections alive, like the real database does.
+
+Example of use:
+    database = InMemoryInfluxDB()
+    database.add_series('kW', 'load', times, values)
+    client = InfluxDBFakeClient(database)
+    df = get_df_from_influxdb({'kW': ['load']}, time_interval=interval, timestep='1h', client=client)
+
+    with InfluxDBStandIn(database) as server:
+        client = InfluxDBClient(**server.network_route, database='test')
+        client.query('SELECT "value" FROM "kW"')
+"""
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy
+import pandas
+from influxdb.resultset import ResultSet
+
+from pyems.config import Parameter
+from pyems.core.utils.time import timestep_to_seconds
+
+EPOCH_NANOSECONDS = {'ns': 1, 'n': 1, 'u': 10 ** 3, 'us': 10 ** 3, 'ms': 10 ** 6, 's': 10 ** 9, 'm': 60 * 10 ** 9,
+                     'h': 3600 * 10 ** 9}
+
+_SELECT_PATTERN = re.compile(
+    r'^SELECT\s+(?:(?P<function>\w+)\("(?P<field>\w+)"\)|"(?P<raw_field>\w+)")\s+FROM\s+"(?P<measurement>[^"]+)"'
+    r'(?:\s+WHERE\s+(?P<where>.+?))?(?:\s+GROUP BY\s+(?P<group_by>.+?))?(?:\s+fill\((?P<fill>[^)]+)\))?\s*;?$',
+    flags=re.I | re.S
+)
+_ENTITY_EQUAL_PATTERN = re.compile(r'^"entity_id"\s*=\s*\'(?P<entity>.*)\'$')
+_ENTITY_REGEX_PATTERN = re.compile(r'^"entity_id"\s*=~\s*/(?P<regex>.*)/$')
+_TIME_PATTERN = re.compile(r'^time\s*(?P<operator>>=|<=|>|<)\s*\'(?P<time>[^\']+)\'$')
+_GROUP_TIME_PATTERN = re.compile(r'^time\((?P<step>\w+)\)$')
+
+
+class InfluxQLError(ValueError):
+    pass
+
+
+def _to_nanoseconds(time, precision=None):
+    """Converts a time literal, a datetime or an epoch number (in the given precision) to epoch nanoseconds."""
+    if isinstance(time, (int, numpy.integer)) and not isinstance(time, bool):
+        return int(time) * EPOCH_NANOSECONDS[precision or 'ns']
+    timestamp = pandas.Timestamp(time)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(None)
+    return timestamp.value
+
+
+def _split_unescaped(text, separator):
+    parts, current, escaped = [], [], False
+    for character in text:
+        if escaped:
+            current.append(character)
+            escaped = False
+        elif character == '\\':
+            escaped = True
+        elif character == separator:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(character)
+    parts.append(''.join(current))
+    return parts
+
+
+def _split_line(line):
+    """Splits a line protocol line into key (measurement and tags), fields and timestamp."""
+    parts, current, escaped = [], [], False
+    for character in line:
+        if escaped:
+            current.append('\\' + character)
+            escaped = False
+        elif character == '\\':
+            escaped = True
+        elif character == ' ' and len(parts) < 2:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(character)
+    parts.append(''.join(current))
+    return parts
+
+
+class InMemoryInfluxDB:
+    """Thread-safe in-memory time series store keyed by measurement and entity_id."""
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def add_series(self, measurement, entity_id, times, values):
+        """Adds points. The times are datetime64 (utc) or datetime-like values."""
+        times = pandas.DatetimeIndex(times)
+        if times.tz is not None:
+            times = times.tz_convert(None)
+        self._append(measurement, entity_id, times.asi8, numpy.asarray(values, dtype=float))
+
+    def _append(self, measurement, entity_id, times, values):
+        with self._lock:
+            self._series.setdefault((measurement, entity_id), []).append((times, values))
+
+    def _arrays(self, measurement, entity_id):
+        """Returns the sorted times (epoch ns) and values of a series. The appended chunks are merged on demand."""
+        with self._lock:
+            chunks = self._series[(measurement, entity_id)]
+            if len(chunks) > 1 or numpy.any(numpy.diff(chunks[0][0]) <= 0):
+                times = numpy.concatenate([chunk[0] for chunk in chunks])
+                values = numpy.concatenate([chunk[1] for chunk in chunks])
+                times, unique = numpy.unique(times[::-1], return_index=True)  # The last written point wins
+                values = values[::-1][unique]
+                self._series[(measurement, entity_id)] = [(times, values)]
+            return self._series[(measurement, entity_id)][0]
+
+    def measurements(self):
+        with self._lock:
+            return sorted({measurement for measurement, _ in self._series})
+
+    def entities(self, measurement):
+        with self._lock:
+            return sorted(entity for key, entity in self._series if key == measurement)
+
+    # WRITE
+
+    def write_lines(self, lines, precision=None):
+        parsed = {}
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = _split_line(line)
+            key = _split_unescaped(parts[0], ',')
+            tags = dict(_split_unescaped(tag, '=') for tag in key[1:])
+            fields = dict(_split_unescaped(field, '=') for field in _split_unescaped(parts[1], ','))
+            value = fields[Parameter.INFLUX_VALUE_LABEL].rstrip('i')
+            if len(parts) > 2 and parts[2]:
+                time = _to_nanoseconds(int(parts[2]), precision)
+            else:
+                time = pandas.Timestamp.utcnow().value
+
+            series = parsed.setdefault((key[0], tags.get('entity_id')), ([], []))
+            series[0].append(time)
+            series[1].append(float(value))
+
+        for (measurement, entity_id), (times, values) in parsed.items():
+            self._append(measurement, entity_id, numpy.array(times, dtype=numpy.int64), numpy.array(values))
+
+        return sum(len(times) for times, _ in parsed.values())
+
+    def write_points(self, points, time_precision=None):
+        parsed = {}
+        for point in points:
+            entity_id = point.get('tags', {}).get('entity_id')
+            series = parsed.setdefault((point['measurement'], entity_id), ([], []))
+            series[0].append(_to_nanoseconds(point['time'], time_precision))
+            series[1].append(float(point['fields'][Parameter.INFLUX_VALUE_LABEL]))
+
+        for (measurement, entity_id), (times, values) in parsed.items():
+            self._append(measurement, entity_id, numpy.array(times, dtype=numpy.int64), numpy.array(values))
+
+    # QUERY
+
+    def query(self, query, epoch=None):
+        """Runs a statement and returns its result in the InfluxDB JSON layout ({'statement_id': 0, 'series': [...]}).
+        """
+
+        statement = self._parse(query)
+        measurement = statement['measurement']
+
+        entities = []
+        with self._lock:
+            keys = [key for key in self._series if key[0] == measurement]
+        for _, entity in keys:
+            if statement['entity'] is not None and entity != statement['entity']:
+                continue
+            if statement['regex'] is not None and (entity is None or not statement['regex'].search(entity)):
+                continue
+            entities.append(entity)
+
+        groups = [[entity] for entity in sorted(entities, key=str)] if statement['group_entity'] else [entities]
+
+        series_list = []
+        for group in groups:
+            if not group:
+                continue
+            times, values = self._select(measurement, group, statement['start'], statement['end'])
+            if statement['function'] is None:
+                table_times, table_values = times, values
+            else:
+                table_times, table_values = self._aggregate(times, values, statement)
+            if table_times is None or not table_times.size:
+                continue
+
+            raw_series = {
+                'name': measurement,
+                'columns': ['time', statement['column']],
+                'values': self._format_rows(table_times, table_values, epoch),
+            }
+            if statement['group_entity']:
+                raw_series['tags'] = {'entity_id': group[0]}
+            series_list.append(raw_series)
+
+        result = {'statement_id': 0}
+        if series_list:
+            result['series'] = series_list
+
+        return result
+
+    def _parse(self, query):
+        match = _SELECT_PATTERN.match(query.strip())
+        if match is None:
+            raise InfluxQLError(f'Unsupported query: {query}')
+
+        function = match.group('function')
+        if function is not None:
+            function = function.upper()
+            if function not in ('INTEGRAL', 'MEAN', 'SUM', 'COUNT', 'MAX', 'MIN'):
+                raise InfluxQLError(f'Unsupported function: {function}')
+
+        statement = {
+            'function': function,
+            'column': function.lower() if function is not None else match.group('raw_field'),
+            'measurement': match.group('measurement'),
+            'entity': None, 'regex': None, 'start': None, 'end': None,
+            'step': None, 'group_entity': False, 'fill': 'null',
+        }
+
+        where = match.group('where')
+        if where is not None:
+            for condition in re.split(r'\s+AND\s+', where, flags=re.I):
+                condition = condition.strip().lstrip('(').rstrip(')').strip()
+                entity_match = _ENTITY_EQUAL_PATTERN.match(condition)
+                regex_match = _ENTITY_REGEX_PATTERN.match(condition)
+                time_match = _TIME_PATTERN.match(condition)
+                if entity_match is not None:
+                    statement['entity'] = entity_match.group('entity')
+                elif regex_match is not None:
+                    statement['regex'] = re.compile(regex_match.group('regex').replace('\\/', '/'))
+                elif time_match is not None:
+                    time = _to_nanoseconds(time_match.group('time'))
+                    operator = time_match.group('operator')
+                    if operator in ('>=', '>'):
+                        statement['start'] = time + (1 if operator == '>' else 0)
+                    else:
+                        statement['end'] = time + (1 if operator == '<=' else 0)
+                else:
+                    raise InfluxQLError(f'Unsupported condition: {condition}')
+
+        group_by = match.group('group_by')
+        if group_by is not None:
+            for element in group_by.split(','):
+                element = element.strip()
+                time_match = _GROUP_TIME_PATTERN.match(element)
+                if time_match is not None:
+                    statement['step'] = timestep_to_seconds(
+                        time_match.group('step'), check_length=False, check_hour_subdivision=False
+                    ) * EPOCH_NANOSECONDS['s']
+                elif element.strip('"') == 'entity_id':
+                    statement['group_entity'] = True
+                else:
+                    raise InfluxQLError(f'Unsupported GROUP BY element: {element}')
+
+        if match.group('fill') is not None:
+            statement['fill'] = match.group('fill').strip()
+
+        if function is not None and statement['step'] is None:
+            statement['step'] = 0  # Aggregation over the whole interval
+
+        return statement
+
+    def _select(self, measurement, entities, start, end):
+        arrays = [self._arrays(measurement, entity) for entity in entities]
+        if len(arrays) == 1:
+            times, values = arrays[0]
+        else:
+            times = numpy.concatenate([a[0] for a in arrays])
+            values = numpy.concatenate([a[1] for a in arrays])
+            order = numpy.argsort(times, kind='stable')
+            times, values = times[order], values[order]
+
+        first = 0 if start is None else numpy.searchsorted(times, start, side='left')
+        last = times.size if end is None else numpy.searchsorted(times, end, side='left')
+        return times[first:last], values[first:last]
+
+    def _aggregate(self, times, values, statement):
+        start, end, step = statement['start'], statement['end'], statement['step']
+
+        if start is None or end is None:
+            if not times.size:
+                return None, None
+            start = times[0] if start is None else start
+            end = times[-1] + 1 if end is None else end
+
+        if step:
+            bucket_times = numpy.arange(start - start % step, end, step, dtype=numpy.int64)
+        else:
+            bucket_times = numpy.array([start], dtype=numpy.int64)
+            step = end - start
+        edges = numpy.clip(numpy.append(bucket_times, bucket_times[-1] + step), start, end)
+
+        bounds = numpy.searchsorted(times, edges, side='left')
+        counts = numpy.diff(bounds)
+        function = statement['function']
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            if function == 'INTEGRAL':
+                aggregated = self._bucket_integrals(times, values, bounds)
+            elif function in ('MEAN', 'SUM'):
+                cumulative = numpy.concatenate([[0.0], numpy.cumsum(values)])
+                aggregated = cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+                if function == 'MEAN':
+                    aggregated = aggregated / counts
+            elif function == 'COUNT':
+                aggregated = counts.astype(float)
+            else:
+                aggregated = numpy.full(counts.size, numpy.nan)
+                reducer = numpy.maximum if function == 'MAX' else numpy.minimum
+                if values.size:
+                    aggregated[counts > 0] = reducer.reduceat(values, bounds[:-1][counts > 0])
+
+        if function != 'COUNT':
+            aggregated = numpy.where(counts > 0, aggregated, numpy.nan)
+
+        return self._fill(bucket_times, aggregated, statement['fill'])
+
+    @staticmethod
+    def _bucket_integrals(times, values, bounds):
+        """Trapezoidal integral (value x seconds) between the first and last point of each bucket, like
+        INTEGRAL("value") with its default 1s unit."""
+        if times.size < 2:
+            return numpy.zeros(bounds.size - 1)
+        segments = (values[1:] + values[:-1]) / 2 * (numpy.diff(times) / EPOCH_NANOSECONDS['s'])
+        cumulative = numpy.concatenate([[0.0], numpy.cumsum(segments)])
+        first = numpy.minimum(bounds[:-1], times.size - 1)
+        last = numpy.maximum(bounds[1:] - 1, 0)
+        integrals = cumulative[last] - cumulative[first]
+        return numpy.where(bounds[1:] - bounds[:-1] > 1, integrals, 0.0)
+
+    @staticmethod
+    def _fill(times, values, fill):
+        missing = numpy.isnan(values)
+        if not missing.any() or fill == 'null':
+            return times, values
+        if fill == 'none':
+            return times[~missing], values[~missing]
+        if fill == 'linear':
+            if missing.all():
+                return times, values
+            filled = values.copy()
+            inner = missing & (times > times[~missing][0]) & (times < times[~missing][-1])
+            filled[inner] = numpy.interp(times[inner], times[~missing], values[~missing])
+            return times, filled
+        if fill == 'previous':
+            positions = numpy.where(missing, 0, numpy.arange(values.size))
+            numpy.maximum.accumulate(positions, out=positions)
+            filled = values[positions]
+            return times, filled
+        try:
+            return times, numpy.where(missing, float(fill), values)
+        except ValueError:
+            raise InfluxQLError(f'Unsupported fill option: {fill}')
+
+    @staticmethod
+    def _format_rows(times, values, epoch):
+        if epoch is None:
+            time_column = pandas.DatetimeIndex(times).strftime('%Y-%m-%dT%H:%M:%SZ').tolist()
+        else:
+            time_column = (times // EPOCH_NANOSECONDS[epoch]).tolist()
+        value_column = [None if numpy.isnan(value) else value for value in values.tolist()]
+        return [list(row) for row in zip(time_column, value_column)]
+
+
+class InfluxDBFakeClient:
+    """Drop-in replacement of InfluxDBClient backed by an InMemoryInfluxDB (no network involved)."""
+
+    def __init__(self, database=None):
+        self.database = InMemoryInfluxDB() if database is None else database
+        self.queries = 0
+        self.writes = 0
+        self.last_query = None
+
+    def query(self, query, epoch=None, **kwargs):
+        self.queries += 1
+        self.last_query = query
+        return ResultSet(self.database.query(query, epoch=epoch))
+
+    def write_points(self, points, time_precision=None, protocol='json', **kwargs):
+        self.writes += 1
+        if protocol == 'line':
+            self.database.write_lines(points, precision=time_precision)
+        else:
+            self.database.write_points(points, time_precision=time_precision)
+        return True
+
+    def get_list_measurements(self):
+        return [{'name': measurement} for measurement in self.database.measurements()]
+
+    def close(self):
+        pass
+
+
+class InfluxDBStandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # Keep the benchmarks output clean
+
+    def _send(self, status, payload=None):
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Influxdb-Version', 'stand-in')
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _dispatch(self, params, body):
+        route = urlparse(self.path).path
+
+        if route == '/ping':
+            self._send(204)
+        elif route == '/query':
+            query = params.get('q', [''])[0]
+            epoch = params.get('epoch', [None])[0]
+            try:
+                self._send(200, self.server.answer_query(query, epoch=epoch))
+            except InfluxQLError as error:
+                self._send(400, {'error': str(error)})
+        elif route == '/write':
+            precision = params.get('precision', [None])[0]
+            self.server.store_write(body, precision=precision)
+            self._send(204)
+        else:
+            self._send(404, {'error': f'Unknown route: {route}'})
+
+    def do_GET(self):
+        self.server.count_request(self.client_address)
+        self._dispatch(parse_qs(urlparse(self.path).query), self._read_body())
+
+    def do_POST(self):
+        self.server.count_request(self.client_address)
+        body = self._read_body()
+        params = parse_qs(urlparse(self.path).query)
+        if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update(parse_qs(body.decode('utf-8')))
+        self._dispatch(params, body)
+
+
+class _StandInHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler, standin):
+        super().__init__(server_address, handler)
+        self.standin = standin
+
+    def count_request(self, client_address):
+        self.standin.count_request(client_address)
+
+    def answer_query(self, query, epoch=None):
+        return self.standin.answer_query(query, epoch=epoch)
+
+    def store_write(self, body, precision=None):
+        self.standin.store_write(body, precision=precision)
+
+
+class InfluxDBStandIn:
+    """Threaded HTTP server that mimics the InfluxDB API. Without a database the queries return empty results and the
+    writes are only counted, which is enough to measure the connection overhead."""
+
+    def __init__(self, database=None, host='127.0.0.1', port=0):
+        self.database = database
+        self._server = _StandInHTTPServer((host, port), InfluxDBStandInHandler, self)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()
+        self.written_bytes = 0
+
+    @property
+    def network_route(self):
+        host, port = self._server.server_address[:2]
+        return {'host': host, 'port': port}
+
+    def count_request(self, client_address):
+        with self._lock:
+            self.requests += 1
+            self.connections.add(client_address)
+
+    def answer_query(self, query, epoch=None):
+        if self.database is None:
+            return {'results': [{'statement_id': 0}]}
+        return {'results': [self.database.query(query, epoch=epoch)]}
+
+    def store_write(self, body, precision=None):
+        with self._lock:
+            self.written_bytes += len(body)
+        if self.database is not None:
+            self.database.write_lines(body.decode('utf-8').split('\n'), precision=precision)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
@@ -0,0 +1,648 @@
+import os
+import json
+import unittest
+import datetime
+import pickle
+import tempfile
+from time import sleep
+from unittest import mock
+
+import numpy
+import pandas
+
+from pyems.config import ElectricalType, ElectricalLoadSubType, ElectricalGeneratorSubType
+from pyems.core.components.base import BaseSystemComponent
+from pyems.core.forecasting.cache import ForecastCache, CachedForecaster, model_identity
+from pyems.core.forecasting.prophet import ProphetOracle
+from pyems.core.forecasting.pool import ForecastPool, frame_to_arrays, arrays_to_frame
+from pyems.core.forecasting.lightweight import (
+    SeasonalNaiveForecaster, HoltWintersForecaster, RidgeForecaster, RecursiveLeastSquaresForecaster,
+    GlobalRidgeForecaster
+)
+from pyems.core.system.system import System
+
+START = datetime.datetime(2020, 1, 6)
+
+
+def synthetic_history(days, timestep_minutes=15, seed=0, tz=None):
+    periods = days * 24 * 60 // timestep_minutes
+    index = pandas.date_range(start=START, periods=periods, freq=f'{timestep_minutes}T', tz=tz)
+    hours = index.hour + index.minute / 60
+    random = numpy.random.default_rng(seed)
+    values = 1 + 0.5 * numpy.sin(2 * numpy.pi * (hours - 7) / 24) + 0.05 * random.standard_normal(index.shape[0])
+    return pandas.DataFrame({'load': values, 'temperature': 10 + 5 * numpy.cos(2 * numpy.pi * hours / 24)}, index=index)
+
+
+class LastDayForecaster:
+    """Repeats the last day of the history and counts its calls, to check the state kept in the pool workers."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def forecast(self, forecast_interval, input_data, target_label, timestep):
+        self.calls += 1
+        index = pandas.date_range(start=forecast_interval[0], end=forecast_interval[1], freq='15T', closed='left')
+        history = input_data.loc[input_data.index < forecast_interval[0], target_label].values
+        values = numpy.resize(history[-96:], index.shape[0])
+        return pandas.DataFrame({target_label: values}, index=index)
+
+
+class CrashingForecaster(LastDayForecaster):
+    """Kills its worker process the first time it runs, while the marker file does not exist."""
+
+    def __init__(self, marker):
+        super().__init__()
+        self.marker = marker
+
+    def forecast(self, forecast_interval, input_data, target_label, timestep):
+        if not os.path.exists(self.marker):
+            open(self.marker, 'w').close()
+            os._exit(1)
+        return super().forecast(forecast_interval, input_data, target_label, timestep)
+
+
+class ForecastingComponent(BaseSystemComponent):
+
+    def __init__(self, entity_type, entity_subtype, history, forecast_model):
+        super().__init__(name='component', entity_type=entity_type, entity_subtype=entity_subtype, timestep='15m')
+        self.historical_label = 'load'
+        self.history = history
+        self.forecast_model = forecast_model
+        self.stored_forecast = None
+
+    def get_forecast_input(self, prediction_interval):
+        data = self.history[self.history.index < prediction_interval[1]].copy()
+        data.loc[data.index >= prediction_interval[0], self.historical_label] = numpy.nan
+        return prediction_interval, data
+
+    def store_forecast(self, forecast):
+        self.stored_forecast = forecast
+        return forecast
+
+    def forecast_load(self, prediction_interval):
+        interval, data = self.get_forecast_input(prediction_interval)
+        return self.store_forecast(self.forecast_model.forecast(interval, data, self.historical_label, self.timestep))
+
+    forecast_generation = forecast_load
+
+
+def build_system(forecast_workers=None, shared_model=None):
+    system = System('test', forecast_workers=forecast_workers)
+    for n in range(3):
+        model = LastDayForecaster() if shared_model is None else shared_model
+        setattr(system, f'load_{n}', ForecastingComponent(
+            ElectricalType.LOAD, ElectricalLoadSubType.FIX, synthetic_history(7, seed=n), model
+        ))
+    system.generator = ForecastingComponent(
+        ElectricalType.GENERATOR, ElectricalGeneratorSubType.STOCHASTIC, synthetic_history(7, seed=9),
+        LastDayForecaster() if shared_model is None else shared_model
+    )
+    return system
+
+
+class ParallelForecasts(unittest.TestCase):
+
+    def test_array_round_trip(self):
+        for tz in [None, 'UTC', 'Europe/Madrid']:
+            frame = synthetic_history(2, tz=tz)
+            rebuilt = arrays_to_frame(*frame_to_arrays(frame))
+            self.assertTrue(numpy.array_equal(rebuilt.values, frame.values))
+            self.assertTrue(rebuilt.index.equals(frame.index))
+            self.assertEqual(list(rebuilt.columns), list(frame.columns))
+
+    def test_pool_matches_sequential(self):
+        interval = [START + datetime.timedelta(days=5), START + datetime.timedelta(days=6)]
+
+        sequential = build_system()
+        sequential.compute_total_fix_electrical_load(interval, 96)
+        sequential.compute_total_stochastic_electrical_generation(interval, 96)
+
+        parallel = build_system(forecast_workers=2)
+        try:
+            parallel.compute_forecasts(interval, 96)
+            parallel.compute_forecasts(interval, 96)  # The pool lives across steps
+            resident = parallel.forecast_pool.fetch_model(parallel.load_0.forecast_model, 'load')
+        finally:
+            parallel.close()
+
+        self.assertTrue(numpy.allclose(parallel.fix_electrical_load, sequential.fix_electrical_load))
+        self.assertTrue(numpy.allclose(parallel.stochastic_electrical_gen, sequential.stochastic_electrical_gen))
+        self.assertEqual(resident.calls, 2)
+        self.assertEqual(parallel.load_0.forecast_model.calls, 0)  # The copy in the parent is not used
+        self.assertIsNotNone(parallel.generator.stored_forecast)
+
+    def test_shared_model(self):
+        interval = [START + datetime.timedelta(days=5), START + datetime.timedelta(days=6)]
+        system = build_system(forecast_workers=2, shared_model=LastDayForecaster())
+        try:
+            system.compute_forecasts(interval, 96)
+        finally:
+            system.close()
+
+        models = {id(system.entities[i].forecast_model) for i in system.entities}
+        self.assertEqual(len(models), 1)
+
+    def test_shared_stateful_model(self):
+        """Two labels share a recursive model across two steps: the state of both labels is kept."""
+
+        def build(forecast_workers):
+            system = System('test', forecast_workers=forecast_workers)
+            model = RecursiveLeastSquaresForecaster(forgetting=0.9)
+            system.load = ForecastingComponent(
+                ElectricalType.LOAD, ElectricalLoadSubType.FIX, synthetic_history(8, seed=1), model
+            )
+            system.generator = ForecastingComponent(
+                ElectricalType.GENERATOR, ElectricalGeneratorSubType.STOCHASTIC,
+                synthetic_history(8, seed=2).rename(columns={'load': 'pv'}), model
+            )
+            system.generator.historical_label = 'pv'
+            return system
+
+        sequential, parallel = build(None), build(2)
+        try:
+            for day in [5, 6]:
+                interval = [START + datetime.timedelta(days=day), START + datetime.timedelta(days=day + 1)]
+                sequential.compute_forecasts(interval, 96)
+                parallel.compute_forecasts(interval, 96)
+                self.assertTrue(numpy.allclose(parallel.fix_electrical_load, sequential.fix_electrical_load))
+                self.assertTrue(
+                    numpy.allclose(parallel.stochastic_electrical_gen, sequential.stochastic_electrical_gen)
+                )
+            model = parallel.load.forecast_model
+            residents = [parallel.forecast_pool.fetch_model(model, label) for label in ['load', 'pv']]
+        finally:
+            parallel.close()
+
+        self.assertEqual(sequential.load.forecast_model.updates, 2 * 96)  # Second step, updated with one new day
+        for resident, label in zip(residents, ['load', 'pv']):
+            self.assertIn(label, resident.states)
+            self.assertTrue(numpy.allclose(resident.states[label]['coefficients'],
+                                           sequential.load.forecast_model.states[label]['coefficients']))
+
+    def test_scenarios(self):
+        """compute_scenarios takes the path of compute_forecasts: cache and forecast pool."""
+
+        def build(forecast_workers):
+            system = System('test', forecast_workers=forecast_workers, n_scenarios=4, scenario_seed=0)
+            cache = ForecastCache()
+            for n in range(2):
+                setattr(system, f'load_{n}', ForecastingComponent(
+                    ElectricalType.LOAD, ElectricalLoadSubType.FIX, synthetic_history(7, seed=n),
+                    CachedForecaster(RidgeForecaster(), cache)
+                ))
+            system.generator = ForecastingComponent(
+                ElectricalType.GENERATOR, ElectricalGeneratorSubType.STOCHASTIC, synthetic_history(7, seed=9),
+                LastDayForecaster()
+            )
+            return system, cache
+
+        interval = [START + datetime.timedelta(days=5), START + datetime.timedelta(days=6)]
+        (sequential, _), (parallel, cache) = build(None), build(2)
+        try:
+            sequential.compute_scenarios(interval, 96)
+            parallel.compute_scenarios(interval, 96)
+            load_scenarios = parallel.fix_electrical_load_scenarios
+            parallel.compute_scenarios(interval, 96)
+            resident = parallel.forecast_pool.fetch_model(parallel.generator.forecast_model, 'load')
+        finally:
+            parallel.close()
+
+        self.assertEqual((cache.misses, cache.hits), (2, 2))
+        self.assertEqual(resident.calls, 2)
+        self.assertTrue(numpy.allclose(parallel.fix_electrical_load_scenarios, load_scenarios))
+        self.assertTrue(numpy.allclose(parallel.fix_electrical_load_scenarios,
+                                       sequential.fix_electrical_load_scenarios))
+        self.assertTrue(numpy.allclose(parallel.stochastic_electrical_gen_scenarios,
+                                       sequential.stochastic_electrical_gen_scenarios))
+        self.assertGreater(numpy.ptp(parallel.fix_electrical_load_scenarios[:, 1:], axis=0).max(), 0)
+
+    def test_worker_death(self):
+        pool = ForecastPool(max_workers=1)
+        with tempfile.TemporaryDirectory() as path:
+            model = CrashingForecaster(os.path.join(path, 'crashed'))
+            task = (model, [START + datetime.timedelta(days=1), START + datetime.timedelta(days=2)],
+                    synthetic_history(1), 'load', '15m')
+            try:
+                broken = pool.executors[0]
+                result = pool.forecast([task, task])
+                self.assertIsNot(pool.executors[0], broken)
+                self.assertEqual([forecast.shape for forecast in result], [(96, 1), (96, 1)])
+                self.assertEqual(pool.fetch_model(model, 'load').calls, 2)  # Sent again to the new worker
+            finally:
+                pool.close()
+
+    def test_pool_close(self):
+        pool = ForecastPool(max_workers=1)
+        self.assertIsNone(pool._executors)
+        model = LastDayForecaster()
+        task = (model, [START + datetime.timedelta(days=1), START + datetime.timedelta(days=2)], synthetic_history(1),
+                'load', '15m')
+        result = pool.forecast([task, task])
+        self.assertEqual(result[0].shape, (96, 1))
+        self.assertEqual(pool.fetch_model(model, 'load').calls, 2)
+        pool.forget(model)
+        pool.forecast([task])
+        self.assertEqual(pool.fetch_model(model, 'load').calls, 1)  # Sent again
+        pool.close()
+        self.assertIsNone(pool._executors)
+
+
+class LightweightForecasters(unittest.TestCase):
+
+    def setUp(self):
+        self.history = synthetic_history(14)
+        self.interval = [START + datetime.timedelta(days=13), START + datetime.timedelta(days=14)]
+        self.truth = self.history.loc[self.history.index >= self.interval[0], 'load'].values
+
+    def test_output_contract(self):
+        training = self.history.loc[self.history.index < self.interval[0], ['load']]
+        for model in [SeasonalNaiveForecaster(), HoltWintersForecaster(), RidgeForecaster()]:
+            forecast = model.forecast(self.interval, training.copy(), 'load', '15m')
+            self.assertEqual(list(forecast.columns), ['load'])
+            self.assertEqual(forecast.index.name, 'index')
+            self.assertEqual(str(forecast.index.tz), 'UTC')
+            self.assertEqual(forecast.shape[0], 96)
+            self.assertEqual(forecast.index[0], pandas.Timestamp(self.interval[0], tz='UTC'))
+            self.assertLess(numpy.abs(forecast['load'].values - self.truth).mean(), 0.1)
+
+    def test_seasonal_naive(self):
+        training = self.history.loc[self.history.index < self.interval[0], ['load']]
+        forecast = SeasonalNaiveForecaster(season='1d').forecast(self.interval, training, 'load', '15m')
+        self.assertTrue(numpy.array_equal(forecast['load'].values, training['load'].values[-96:]))
+
+    def test_ridge_regressors(self):
+        data = self.history.copy()
+        data['load'] = 2 + 0.3 * data['temperature']
+        data.loc[data.index >= self.interval[0], 'load'] = numpy.nan
+        forecast = RidgeForecaster(alpha=1e-6).forecast(self.interval, data, 'load', '15m')
+        expected = 2 + 0.3 * self.history.loc[self.history.index >= self.interval[0], 'temperature'].values
+        self.assertTrue(numpy.allclose(forecast['load'].values, expected, atol=1e-4))
+
+        with self.assertRaises(ValueError):
+            RidgeForecaster().forecast(self.interval, data[data.index < self.interval[0]], 'load', '15m')
+
+    def test_recursive_least_squares(self):
+        history = self.history[['load']]
+        step = datetime.timedelta(minutes=15)
+        first_start = self.interval[0] - datetime.timedelta(days=3)
+        online = RecursiveLeastSquaresForecaster(forgetting=1.0)
+
+        for n in range(5):
+            start = first_start + n * step
+            window = history[(history.index >= start - datetime.timedelta(days=7)) & (history.index < start)]
+            forecast = online.forecast([start, start + datetime.timedelta(days=1)], window.copy(), 'load', '15m')
+
+        self.assertEqual(online.updates, 4)  # One new sample per rolling step, the history is not refitted
+        self.assertEqual(forecast.shape[0], 96)
+
+        # With no forgetting, the online coefficients match a batch fit over every sample seen
+        seen = history[(history.index >= first_start - datetime.timedelta(days=7)) & (history.index < start)]
+        batch = RecursiveLeastSquaresForecaster(forgetting=1.0)
+        batch.forecast([start, start + datetime.timedelta(days=1)], seen.copy(), 'load', '15m')
+        self.assertTrue(numpy.allclose(online.coefficients, batch.coefficients, atol=1e-8))
+
+        # Going back in time starts again from scratch
+        window = history[history.index < START + datetime.timedelta(days=3)]
+        online.forecast([START + datetime.timedelta(days=3), START + datetime.timedelta(days=4)], window, 'load', '15m')
+        self.assertEqual(online.updates, 4)
+
+    def test_recursive_least_squares_failure(self):
+        history = self.history[['load']]
+        step = datetime.timedelta(minutes=15)
+        model = RecursiveLeastSquaresForecaster()
+        window = history[history.index < self.interval[0]]
+        model.forecast(self.interval, window.copy(), 'load', '15m')
+        state = model.states['load']
+
+        def failing_update(*args):
+            raise ValueError('Update failure.')
+
+        model.update = failing_update
+        window = history[history.index < self.interval[0] + step]
+        with self.assertRaises(ValueError):
+            model.forecast([self.interval[0] + step, self.interval[1] + step], window.copy(), 'load', '15m')
+        self.assertIs(model.states['load'], state)  # The state survives the failed call
+
+        del model.update
+        model.forecast([self.interval[0] + step, self.interval[1] + step], window.copy(), 'load', '15m')
+        self.assertEqual(model.updates, 1)
+
+    def test_scenarios(self):
+        training = self.history.loc[self.history.index < self.interval[0], ['load']]
+        models = [
+            SeasonalNaiveForecaster(), HoltWintersForecaster(), RidgeForecaster(), RecursiveLeastSquaresForecaster(),
+            GlobalRidgeForecaster()
+        ]
+        for model in models:
+            forecast, scenarios = model.forecast_scenarios(self.interval, training.copy(), 'load', '15m', 30, seed=0)
+            self.assertEqual(scenarios.shape, (30, 96))
+            self.assertLess(numpy.abs(scenarios.mean(axis=0) - forecast['load'].values).mean(), 0.05)
+
+            _, quantiles = model.forecast_quantiles(self.interval, training.copy(), 'load', '15m', (0.1, 0.9), seed=0)
+            self.assertEqual(quantiles.shape, (2, 96))
+            self.assertTrue((quantiles[0] <= quantiles[1]).all())
+            inside = (self.truth >= quantiles[0]) & (self.truth <= quantiles[1])
+            self.assertGreater(inside.mean(), 0.5)
+
+
+class CountingGlobalRidge(GlobalRidgeForecaster):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def forecast_many(self, forecast_interval, inputs, target_labels, timestep):
+        self.calls += 1
+        return super().forecast_many(forecast_interval, inputs, target_labels, timestep)
+
+
+class GlobalForecasting(unittest.TestCase):
+
+    def setUp(self):
+        self.interval = [START + datetime.timedelta(days=6), START + datetime.timedelta(days=7)]
+
+    def test_matches_single_series(self):
+        histories = [synthetic_history(7, seed=seed) for seed in range(4)]
+        histories.append(synthetic_history(7, seed=4).iloc[96:])  # Another training window, solved in its own group
+        for frame in histories:
+            frame.loc[frame.index >= self.interval[0], 'load'] = numpy.nan
+
+        for columns in [['load'], ['load', 'temperature']]:
+            model = GlobalRidgeForecaster()
+            forecasts = model.forecast_many(
+                self.interval, [frame[columns].copy() for frame in histories], ['load'] * len(histories), '15m'
+            )
+            self.assertEqual(model.batches, 2)
+            for frame, forecast in zip(histories, forecasts):
+                expected = RidgeForecaster().forecast(self.interval, frame[columns].copy(), 'load', '15m')
+                self.assertTrue(numpy.allclose(forecast['load'].values, expected['load'].values))
+                self.assertTrue(forecast.index.equals(expected.index))
+
+    def test_system_routing(self):
+        model = CountingGlobalRidge()
+        system = build_system(shared_model=model)
+        system.load_0.forecast_model = LastDayForecaster()
+        system.preparation_workers = 2
+        try:
+            system.prepare_to_optimize({
+                'prediction_interval': [START + datetime.timedelta(days=5), START + datetime.timedelta(days=6)],
+                'periods': 96
+            })
+        finally:
+            system.close()
+
+        # The batch of the shared model is a single task
+        self.assertEqual(sum(name.startswith('forecast_') for name in system.preparation_timings), 2)
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(system.load_0.forecast_model.calls, 1)
+        self.assertEqual(system.fix_electrical_load.shape, (96,))
+        self.assertTrue(numpy.all(system.stochastic_electrical_gen > 0))
+
+
+class ForecastResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.interval = [START + datetime.timedelta(days=5), START + datetime.timedelta(days=6)]
+        self.history = synthetic_history(7)[['load']]
+        self.training = self.history[self.history.index < self.interval[0]]
+
+    def test_hits_and_lru(self):
+        cache = ForecastCache(max_size=2)
+        model = LastDayForecaster()
+
+        first = cache.forecast(model, self.interval, self.training.copy(), 'load', '15m')
+        second = cache.forecast(LastDayForecaster(), self.interval, self.training.copy(), 'load', '15m')
+        self.assertTrue(first.equals(second))
+        self.assertEqual(model.calls, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        other_interval = [self.interval[0] - datetime.timedelta(hours=1), self.interval[1]]
+        cache.forecast(model, other_interval, self.history[self.history.index < other_interval[0]], 'load', '15m')
+        cache.forecast(model, self.interval, self.training.iloc[1:], 'load', '15m')  # Another training window
+        self.assertEqual((len(cache), cache.evictions, model.calls), (2, 1, 3))
+
+        cache.forecast(model, self.interval, self.training.copy(), 'load', '15m')  # The LRU entry was evicted
+        self.assertEqual(model.calls, 4)
+        self.assertEqual(cache.stats['hit_rate'], 0.2)
+
+    def test_ttl(self):
+        cache = ForecastCache(ttl=0.01)
+        model = LastDayForecaster()
+        cache.forecast(model, self.interval, self.training.copy(), 'load', '15m')
+        sleep(0.02)
+        cache.forecast(model, self.interval, self.training.copy(), 'load', '15m')
+        self.assertEqual((model.calls, cache.expirations), (2, 1))
+
+    def test_shared_label(self):
+        cache = ForecastCache()
+        for forecast_workers in [None, 1]:
+            model = LastDayForecaster()
+            system = System('test', forecast_workers=forecast_workers)
+            for n in range(2):
+                setattr(system, f'load_{n}', ForecastingComponent(
+                    ElectricalType.LOAD, ElectricalLoadSubType.FIX, self.history, CachedForecaster(model, cache)
+                ))
+            try:
+                if forecast_workers is None:
+                    system.compute_total_fix_electrical_load(self.interval, 96)
+                else:
+                    system.compute_forecasts(self.interval, 96)
+            finally:
+                system.close()
+            self.assertTrue(numpy.allclose(system.fix_electrical_load, 2 * system.load_0.stored_forecast['load']))
+
+        self.assertEqual(cache.misses, 1)  # Computed once, then served to the other load and the second system
+        self.assertEqual(cache.hits, 3)
+
+    def test_model_identity(self):
+        profile = numpy.zeros(10000)
+        changed = profile.copy()
+        changed[5000] = 1  # Hidden by the ... of the repr
+        self.assertNotEqual(model_identity(RidgeForecaster(alpha=profile)),
+                            model_identity(RidgeForecaster(alpha=changed)))
+        self.assertEqual(model_identity(RidgeForecaster(alpha=profile)), model_identity(RidgeForecaster(alpha=profile)))
+        # Objects with the default repr (it holds their address) are identified by their configuration
+        self.assertEqual(model_identity(CachedForecaster(RidgeForecaster())),
+                         model_identity(CachedForecaster(RidgeForecaster())))
+
+    def test_stateful_model(self):
+        cache = ForecastCache()
+        model = RecursiveLeastSquaresForecaster(forgetting=0.9)
+        first = cache.forecast(model, self.interval, self.training.copy(), 'load', '15m')
+        # Same request, but the state has changed: the fresh model has none and would start again
+        cache.forecast(model, self.interval, self.training.copy(), 'load', '15m')
+        self.assertEqual(cache.misses, 2)
+
+        fresh = cache.forecast(RecursiveLeastSquaresForecaster(forgetting=0.9), self.interval, self.training.copy(),
+                               'load', '15m')
+        self.assertEqual(cache.hits, 1)
+        self.assertTrue(fresh.equals(first))
+
+    def test_pickle(self):
+        cache = ForecastCache()
+        cache.forecast(LastDayForecaster(), self.interval, self.training.copy(), 'load', '15m')
+        restored = pickle.loads(pickle.dumps(CachedForecaster(LastDayForecaster(), cache)))
+        self.assertEqual(len(restored.cache), 1)
+
+
+class FakeProphet:
+    """Stand-in of fbprophet.Prophet: predicts the mean of the training target, with its deviation as noise scale.
+    With reject_init the fits with a Stan initialization fail, like when the changepoints of the new data differ.
+    """
+
+    reject_init = False
+
+    def __init__(self):
+        self.regressors = []
+        self.params = None
+        self.y_scale = 1.0
+        self.init = None
+        self.mean = None
+
+    def add_regressor(self, name):
+        self.regressors.append(name)
+
+    def fit(self, frame, init=None):
+        if init is not None and self.reject_init:
+            raise ValueError('Incompatible initialization.')
+        self.init = init
+        self.mean = float(frame['y'].mean())
+        self.params = {
+            'k': [[0.0]], 'm': [[self.mean]], 'sigma_obs': [[float(frame['y'].std())]], 'delta': [[0.0, 0.0]],
+            'beta': [[0.0] * len(self.regressors)],
+        }
+        return self
+
+    def predict(self, frame):
+        return pandas.DataFrame({'ds': frame['ds'].values, 'yhat': numpy.full(frame.shape[0], self.mean)})
+
+
+def fake_model_to_json(model):
+    return json.dumps({'regressors': model.regressors, 'params': model.params, 'mean': model.mean})
+
+
+def fake_model_from_json(text):
+    stored = json.loads(text)
+    model = FakeProphet()
+    model.regressors, model.params, model.mean = stored['regressors'], stored['params'], stored['mean']
+    return model
+
+
+def patch_prophet():
+    return mock.patch.multiple(
+        'pyems.core.forecasting.prophet', Prophet=FakeProphet, model_to_json=fake_model_to_json,
+        model_from_json=fake_model_from_json
+    )
+
+
+class FakeProphetTestCase(unittest.TestCase):
+    """Runs ProphetOracle on top of FakeProphet."""
+
+    def setUp(self):
+        patcher = patch_prophet()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.history = synthetic_history(9)
+
+    def forecast(self, oracle, start, history=None):
+        """Day ahead forecast from start (a time delta from START), with the history up to start."""
+
+        interval = [START + start, START + start + datetime.timedelta(days=1)]
+        history = self.history if history is None else history
+        data = history[history.index < interval[1]].copy()
+        data.loc[data.index >= interval[0], 'load'] = numpy.nan
+        return oracle.forecast(interval, data, 'load', '15m')
+
+
+class ProphetModelCache(FakeProphetTestCase):
+
+    def test_scheduled_refit(self):
+        oracle = ProphetOracle(refit_every='1d')
+        self.forecast(oracle, datetime.timedelta(days=6))
+        self.forecast(oracle, datetime.timedelta(days=6, hours=6))
+        self.assertEqual((oracle.fits, oracle.reuses), (1, 1))
+
+        self.forecast(oracle, datetime.timedelta(days=7, hours=1))
+        self.assertEqual((oracle.fits, oracle.reuses), (2, 1))
+        self.assertEqual(oracle.models[('load', ('temperature',))]['fitted_until'],
+                         pandas.Timestamp(START + datetime.timedelta(days=7, minutes=45)))
+
+    def test_drift_refit(self):
+        oracle = ProphetOracle(refit_every='1d', drift_threshold=3)
+        self.forecast(oracle, datetime.timedelta(days=6))
+        self.forecast(oracle, datetime.timedelta(days=6, hours=2))
+        self.assertEqual((oracle.fits, oracle.reuses), (1, 1))
+
+        drifted = self.history.copy()
+        drifted.loc[drifted.index >= START + datetime.timedelta(days=6), 'load'] += 5
+        forecast = self.forecast(oracle, datetime.timedelta(days=6, hours=4), history=drifted)
+        self.assertEqual((oracle.fits, oracle.reuses), (2, 1))
+        self.assertGreater(forecast['load'].iloc[0], self.history['load'].mean())
+
+    def test_cache_identity(self):
+        oracle = ProphetOracle(refit_every='1d')
+        identity = model_identity(oracle)
+        self.forecast(oracle, datetime.timedelta(days=6))
+        self.assertNotEqual(model_identity(oracle), identity)  # The next forecasts reuse the fitted model
+        self.assertEqual(model_identity(ProphetOracle(refit_every='1d')), identity)
+
+        oracle = ProphetOracle()
+        identity = model_identity(oracle)
+        self.forecast(oracle, datetime.timedelta(days=6))
+        self.assertEqual(model_identity(oracle), identity)  # Every call refits
+        self.assertFalse(oracle.stateful)
+        self.assertTrue(ProphetOracle(refit_every='1d').stateful)
+        self.assertTrue(ProphetOracle(warm_start=True).stateful)
+
+    def test_without_schedule(self):
+        oracle = ProphetOracle()
+        self.forecast(oracle, datetime.timedelta(days=6))
+        self.forecast(oracle, datetime.timedelta(days=6))
+        self.assertEqual((oracle.fits, oracle.reuses), (2, 0))
+
+    def test_reload_from_disk(self):
+        with tempfile.TemporaryDirectory() as path:
+            oracle = ProphetOracle(refit_every='1d', model_path=path)
+            forecast = self.forecast(oracle, datetime.timedelta(days=6))
+
+            restarted = ProphetOracle(refit_every='1d', model_path=path)
+            reloaded = self.forecast(restarted, datetime.timedelta(days=6, hours=1))
+
+        self.assertEqual((restarted.fits, restarted.reuses), (0, 1))
+        self.assertEqual(restarted.models[('load', ('temperature',))]['fitted_until'],
+                         oracle.models[('load', ('temperature',))]['fitted_until'])
+        self.assertTrue(numpy.allclose(reloaded['load'].values, forecast['load'].values[0]))
+
+
+class ProphetWarmStart(FakeProphetTestCase):
+
+    def test_init_on_refit(self):
+        oracle = ProphetOracle(warm_start=True)
+        self.forecast(oracle, datetime.timedelta(days=6))
+        first = oracle.models[('load', ('temperature',))]['model']
+        self.assertIsNone(first.init)
+
+        self.forecast(oracle, datetime.timedelta(days=7))
+        second = oracle.models[('load', ('temperature',))]['model']
+        self.assertEqual(oracle.fits, 2)
+        self.assertEqual(set(second.init), {'k', 'm', 'sigma_obs', 'delta', 'beta'})
+        self.assertEqual(second.init['m'], first.mean)
+        self.assertEqual(second.init['delta'], first.params['delta'][0])
+
+    def test_cold_fit_fallback(self):
+        oracle = ProphetOracle(warm_start=True)
+        self.forecast(oracle, datetime.timedelta(days=6))
+
+        with mock.patch.object(FakeProphet, 'reject_init', True):
+            forecast = self.forecast(oracle, datetime.timedelta(days=7))
+
+        model = oracle.models[('load', ('temperature',))]['model']
+        self.assertEqual(oracle.fits, 2)
+        self.assertIsNone(model.init)  # Fitted from scratch
+        self.assertEqual(model.regressors, ['temperature'])
+        self.assertFalse(forecast['load'].isna().any())
+        self.assertEqual(oracle.warm_start_params[('load', ('temperature',))]['m'], model.mean)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1 +1,454 @@
+import unittest
+import datetime
+import subprocess
+import sys
+import tempfile
+import textwrap
 
+import numpy
+import pandas
+from influxdb.resultset import ResultSet
+
+from pyems.core.iodata.ioinflux import (
+    InfluxDBClientManager, connect_to_influxdb, build_influxdb_query, influxdb_grouped_response_to_series,
+    read_chunked_influxdb_series, influxdb_response_to_series, influxdb_response_to_arrays,
+    series_to_line_protocol, InfluxDBBufferedWriter, can_push_down_timestep, get_df_from_influxdb,
+    get_hourly_stored_series, write_series_to_influxdb, close_influxdb_clients,
+)
+from pyems.core.iodata.ioapis import (
+    SpanishElectricityPriceCache, ApiClient, get_hourly_spanish_electricity_prices, get_spanish_electricity_prices,
+    ree_values_to_series, request_ree_prices
+)
+from pyems.tools.api_standin import ApiStandIn, synthetic_price
+from pyems.config import Constant
+from pyems.core.utils.time import series_upsampling
+from pyems.tools.influxdb_standin import InfluxDBStandIn, InMemoryInfluxDB, InfluxDBFakeClient
+
+
+class InfluxDBClientReuse(unittest.TestCase):
+
+    def setUp(self):
+        self.server = InfluxDBStandIn().start()
+        self.credentials = {'username': 'root', 'password': 'root', 'database': 'test'}
+
+    def tearDown(self):
+        close_influxdb_clients()  # The pooled clients of the module would otherwise outlive the server
+        self.server.stop()
+
+    def test_client_manager(self):
+        manager = InfluxDBClientManager()
+        client = manager.get_client(**self.credentials, **self.server.network_route)
+        self.assertIs(client, manager.get_client(**self.credentials, **self.server.network_route))
+        self.assertIsNot(client, manager.get_client(**self.credentials, **self.server.network_route, ssl=True))
+        self.assertEqual(len(manager), 2)
+
+        manager.close()
+        self.assertEqual(len(manager), 0)
+
+    def test_connection_reuse(self):
+        for _ in range(5):
+            client = connect_to_influxdb(db_credentials=self.credentials, db_network_route=self.server.network_route)
+            client.query('SELECT "value" FROM "kW"')
+
+        self.assertEqual(self.server.requests, 5)
+        self.assertEqual(len(self.server.connections), 1)
+
+        private_client = connect_to_influxdb(
+            db_credentials=self.credentials, db_network_route=self.server.network_route, reuse=False
+        )
+        self.assertIsNot(private_client, client)
+        private_client.close()
+
+
+class InfluxDBBatchedQuery(unittest.TestCase):
+
+    def test_build_query(self):
+        interval = [datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2)]
+
+        query = build_influxdb_query('kW', function='INTEGRAL', entities='load', time_interval=interval, timestep='1h')
+        self.assertEqual(
+            query,
+            'SELECT INTEGRAL("value") FROM "kW" WHERE "entity_id"=\'load\' AND '
+            '(time >= \'2020-01-01 00:00:00\' AND time < \'2020-01-02 00:00:00\') GROUP BY time(1h)'
+        )
+
+        query = build_influxdb_query(
+            'kW', function='MEAN', entities=['pv.1', 'load'], timestep='15m', group_by_entity=True
+        )
+        self.assertEqual(
+            query,
+            'SELECT MEAN("value") FROM "kW" WHERE "entity_id" =~ /^(pv\\.1|load)$/ GROUP BY time(15m), "entity_id"'
+        )
+
+    def test_aggregation_push_down(self):
+        cases = [
+            ('15m', '1h', 'INTEGRAL', True, False),
+            ('15m', '5m', 'INTEGRAL', True, True),
+            ('15m', '15m', 'INTEGRAL', False, False),
+            ('15m', '1m', 'MEAN', False, True),
+            ('15m', '1m', 'MEAN', True, False),
+            ('15m', None, 'MEAN', False, False),
+        ]
+        for timestep, source_timestep, function, upsample_values, target in cases:
+            self.assertEqual(can_push_down_timestep(timestep, source_timestep, function, upsample_values), target)
+
+        query = build_influxdb_query('kW', function='INTEGRAL', entities='load', timestep='15m', fill='linear')
+        self.assertTrue(query.endswith('GROUP BY time(15m) fill(linear)'))
+
+    def test_grouped_response(self):
+        response = ResultSet({
+            'statement_id': 0,
+            'series': [
+                {
+                    'name': 'kW', 'tags': {'entity_id': 'load'}, 'columns': ['time', 'integral'],
+                    'values': [['2020-01-01T00:00:00Z', 1.0], ['2020-01-01T01:00:00Z', 2.0]],
+                },
+                {
+                    'name': 'kW', 'tags': {'entity_id': 'pv'}, 'columns': ['time', 'integral'],
+                    'values': [['2020-01-01T00:00:00Z', 3.0], ['2020-01-01T01:00:00Z', None]],
+                },
+            ]
+        })
+
+        series = influxdb_grouped_response_to_series(response, 'INTEGRAL')
+        self.assertEqual(sorted(series.keys()), ['load', 'pv'])
+        self.assertEqual(list(series['load'].values), [1.0, 2.0])
+        self.assertEqual(series['pv'].iloc[0], 3.0)
+        self.assertTrue(series['pv'].index.equals(pandas.DatetimeIndex(['2020-01-01 00:00', '2020-01-01 01:00'])))
+        self.assertTrue(numpy.isnan(series['pv'].iloc[1]))
+
+
+class InfluxDBResponseDecoding(unittest.TestCase):
+
+    def test_arrays_match_points(self):
+        index = pandas.date_range(start='2020-01-01', periods=48, freq='15T', tz='UTC')
+        values = numpy.linspace(0, 1, 48)
+        values[5] = numpy.nan
+
+        def response(times):
+            rows = [[time, None if numpy.isnan(value) else value] for time, value in zip(times, values)]
+            return ResultSet({'statement_id': 0, 'series': [{'columns': ['time', 'mean'], 'values': rows}]})
+
+        string_response = response(list(index.strftime('%Y-%m-%dT%H:%M:%SZ')))
+        epoch_response = response([int(time.timestamp()) for time in index])
+
+        reference = influxdb_response_to_series(string_response, 'MEAN')
+        reference.index = pandas.to_datetime(reference.index).tz_convert(None)
+
+        for decoded, epoch in [(string_response, None), (epoch_response, 's')]:
+            times, decoded_values = influxdb_response_to_arrays(decoded, 'MEAN', epoch=epoch)
+            self.assertEqual(times.dtype, numpy.dtype('datetime64[ns]'))
+            self.assertTrue(numpy.array_equal(times, reference.index.values))
+            self.assertTrue(numpy.array_equal(decoded_values, reference.values.astype(float), equal_nan=True))
+
+
+class InfluxDBChunkedRead(unittest.TestCase):
+
+    class RecordingClient:
+        """Returns the same rows for every query, like a server ignoring the time condition."""
+
+        def __init__(self, rows):
+            self.rows = rows
+            self.queries = []
+
+        def query(self, query, epoch=None):
+            self.queries.append(query)
+            rows = self.rows
+            if epoch == 's':
+                rows = [[int(pandas.Timestamp(time).timestamp()), value] for time, value in rows]
+            return ResultSet({
+                'statement_id': 0,
+                'series': [{'name': 'kW', 'columns': ['time', 'integral'], 'values': rows}],
+            })
+
+    def test_chunked_read(self):
+        complete_index = pandas.date_range(start='2020-01-01 00:00', periods=10, freq='1H')
+        rows = [['2019-12-31T23:00:00Z', -1.0], ['2020-01-01T02:00:00Z', 2.0], ['2020-01-01T09:00:00Z', 9.0]]
+        client = self.RecordingClient(rows)
+
+        series = read_chunked_influxdb_series(
+            client, 'kW', 'load', complete_index, chunk_periods=4, function='INTEGRAL', timestep='1h'
+        )['load']
+
+        self.assertEqual(len(client.queries), 3)
+        self.assertIn("time < '2020-01-01 04:00:00'", client.queries[0])
+        self.assertIn("time < '2020-01-01 10:00:00'", client.queries[-1])
+        self.assertTrue(series.index.equals(complete_index))
+        self.assertEqual(series.iloc[2], 2.0)
+        self.assertEqual(series.iloc[9], 9.0)
+        self.assertEqual(int(numpy.isnan(series.values).sum()), 8)
+
+
+class InfluxDBBufferedWrite(unittest.TestCase):
+
+    class FlakyClient:
+
+        def __init__(self, failures=0):
+            self.failures = failures
+            self.batches = []
+
+        def write_points(self, points, time_precision=None, protocol=None):
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError('Stand-in failure.')
+            self.batches.append(list(points))
+
+    def test_line_protocol(self):
+        index = pandas.date_range(start='2020-01-01', periods=3, freq='15T')
+        lines = series_to_line_protocol('kW', 'pv 1', index.values, [1.5, numpy.nan, 2])
+        self.assertEqual(
+            lines, ['kW,entity_id=pv\\ 1 value=1.5 1577836800', 'kW,entity_id=pv\\ 1 value=2.0 1577838600']
+        )
+
+    def test_batches_and_retries(self):
+        client = self.FlakyClient(failures=2)
+        writer = InfluxDBBufferedWriter(client=client, batch_size=4, flush_interval=10, retry_backoff=0.01)
+
+        series = pandas.Series(numpy.arange(10.0), index=pandas.date_range(start='2020-01-01', periods=10, freq='1H'))
+        writer.write_series(series, measurement='kW', entity_id='load')
+        writer.write_point('%', 'soc', 50.0)
+        writer.close()
+
+        self.assertEqual([len(batch) for batch in client.batches], [4, 4, 3])
+        self.assertEqual(writer.written_lines, 11)
+        self.assertEqual(writer.dropped_lines, 0)
+
+    def test_bounded_buffer(self):
+        client = self.FlakyClient()
+        writer = InfluxDBBufferedWriter(client=client, batch_size=100, flush_interval=10, max_buffer_lines=5)
+        writer.write_lines([f'kW value={i} {i}' for i in range(8)])
+        writer.close()
+
+        self.assertEqual(writer.dropped_lines, 3)
+        self.assertEqual(client.batches, [[f'kW value={i} {i}' for i in range(3, 8)]])
+
+    def test_flush_at_exit(self):
+        script = textwrap.dedent("""
+            from pyems.core.iodata.ioinflux import InfluxDBBufferedWriter
+
+            class PrintingClient:
+                def write_points(self, points, time_precision=None, protocol=None):
+                    print(len(points))
+
+            writer = InfluxDBBufferedWriter(client=PrintingClient(), batch_size=100, flush_interval=60)
+            writer.write_lines([f'kW value={i} {i}' for i in range(7)])
+        """)  # The writer is never closed
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=60)
+        self.assertEqual(output.stdout.split(), ['7'])
+
+    def test_standin_write(self):
+        with InfluxDBStandIn() as server:
+            writer = InfluxDBBufferedWriter(
+                db_credentials={'username': 'root', 'password': 'root', 'database': 'test'},
+                db_network_route=server.network_route, batch_size=50, flush_interval=60
+            )
+            writer.write_lines([f'kW value={i} {i}' for i in range(120)])
+            self.assertTrue(writer.flush(timeout=10))
+            writer.close()
+            self.assertEqual(writer.written_lines, 120)
+            self.assertGreater(server.written_bytes, 0)
+
+
+class InfluxDBStandInQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.database = InMemoryInfluxDB()
+        self.index = pandas.date_range(start='2020-01-01', periods=2 * 24 * 60, freq='1T')
+        generator = numpy.random.default_rng(0)
+        self.values = {entity: generator.random(self.index.size) for entity in ['load', 'pv', 'temperature']}
+        for entity, values in self.values.items():
+            self.database.add_series('kW', entity, self.index, values)
+        self.client = InfluxDBFakeClient(self.database)
+        self.interval = [datetime.datetime(2020, 1, 1, 3), datetime.datetime(2020, 1, 1, 20)]
+
+    def test_query_modes(self):
+        options = {
+            'entities': {'kW': ['load', 'pv', 'temperature']}, 'time_interval': self.interval, 'timestep': '1h',
+            'client': self.client,
+        }
+        reference = get_df_from_influxdb(**options)
+        self.assertEqual(self.client.queries, 3)
+        self.assertEqual(reference.shape, (17, 3))
+
+        batched = get_df_from_influxdb(batch_entities=True, **options)
+        self.assertEqual(self.client.queries, 4)
+        self.assertTrue(reference.equals(batched))
+
+        chunked = get_df_from_influxdb(batch_entities=True, chunk_periods=5, **options)
+        self.assertTrue(numpy.allclose(reference.values, chunked.values))
+
+    def test_mean_aggregation(self):
+        df = get_df_from_influxdb(
+            {'kW': ['load']}, function='MEAN', time_interval=self.interval, timestep='1h', client=self.client
+        )
+        expected = pandas.Series(self.values['load'], index=self.index)
+        expected = expected[(expected.index >= self.interval[0]) & (expected.index < self.interval[1])]
+        self.assertTrue(numpy.allclose(df['load'].values, expected.resample('1H').mean().values))
+
+    def test_aggregation_push_down(self):
+        options = {'function': 'MEAN', 'entities': {'kW': ['load']}, 'client': self.client}
+        pushed = get_hourly_stored_series(self.interval, '15m', source_timestep='1m', **options)
+        self.assertIn('GROUP BY time(15m) fill(linear)', self.client.last_query)
+        upsampled = get_hourly_stored_series(self.interval, '15m', **options)
+        self.assertTrue(pushed.index.equals(upsampled.index))
+        self.assertTrue(numpy.allclose(
+            pushed['load'].values.reshape(-1, 4).mean(axis=1), upsampled['load'].values[::4]
+        ))
+
+    def test_future_interval_push_down(self):
+        # Series published ahead, like prices or forecasts, reach past the current time
+        start = pandas.Timestamp.utcnow().tz_localize(None).ceil('1D') + pandas.Timedelta(days=1)
+        index = pandas.date_range(start=start, periods=6 * 60, freq='1T')
+        self.database.add_series('EUR', 'price', index, numpy.arange(index.size, dtype=float))
+        interval = [start.to_pydatetime(), (start + pandas.Timedelta(hours=4)).to_pydatetime()]
+
+        options = {'function': 'MEAN', 'entities': {'EUR': ['price']}, 'client': self.client}
+        pushed = get_hourly_stored_series(interval, '15m', source_timestep='1m', **options)
+        self.assertIn('GROUP BY time(15m) fill(linear)', self.client.last_query)
+        upsampled = get_hourly_stored_series(interval, '15m', **options)
+        self.assertEqual(pushed.shape, (16, 1))
+        self.assertTrue(pushed.index.equals(upsampled.index))
+
+    def test_write_and_read(self):
+        series = pandas.Series([1.0, 2.0, 3.0], index=pandas.date_range(start='2021-01-01', periods=3, freq='1H'))
+        with InfluxDBStandIn(self.database) as server:
+            write_series_to_influxdb(
+                series, measurement='%', entity_id='soc', db_network_route=server.network_route,
+                db_credentials={'username': 'root', 'password': 'root', 'database': 'test'}
+            )
+        result = self.database.query('SELECT "value" FROM "%" WHERE "entity_id"=\'soc\'', epoch='s')
+        self.assertEqual(result['series'][0]['values'], [[1609459200, 1.0], [1609462800, 2.0], [1609466400, 3.0]])
+
+
+class SpanishPriceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = SpanishElectricityPriceCache(self.directory.name)
+        self.requests = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fetch(self, start, end):
+        self.requests.append((start, end))
+        index = pandas.date_range(start=start, end=end, freq='1H')
+        return pandas.Series(index.hour / 100, index=index)
+
+    def test_cached_days(self):
+        start, end = datetime.datetime(2020, 3, 28, 10), datetime.datetime(2020, 3, 30, 5)  # DST change on 29th
+        now = datetime.datetime(2020, 4, 1)
+
+        prices = self.cache.get_prices(start, end, 'tariff_2.0A', fetch=self.fetch, now_utc=now)
+        self.assertEqual(self.requests, [(datetime.datetime(2020, 3, 27, 23), datetime.datetime(2020, 3, 30, 21))])
+        self.assertEqual(prices.shape[0], 44)
+        self.assertEqual(len(self.cache.load_day('tariff_2.0A', datetime.date(2020, 3, 29))), 23)
+
+        cached_prices = self.cache.get_prices(start, end, 'tariff_2.0A', fetch=self.fetch, now_utc=now)
+        self.assertEqual(len(self.requests), 1)
+        self.assertTrue(prices.equals(cached_prices))
+
+        self.cache.get_prices(start, datetime.datetime(2020, 3, 31, 5), 'tariff_2.0A', fetch=self.fetch, now_utc=now)
+        self.assertEqual(self.requests[-1], (datetime.datetime(2020, 3, 30, 22), datetime.datetime(2020, 3, 31, 21)))
+
+    def test_unpublished_day(self):
+        start, end = datetime.datetime(2020, 6, 1, 22), datetime.datetime(2020, 6, 2, 21)
+        now = datetime.datetime(2020, 6, 1, 12)  # Before the publication of the prices of June 2nd
+
+        self.cache.get_prices(start, end, 'tariff_2.0A', fetch=self.fetch, now_utc=now)
+        self.assertIsNone(self.cache.load_day('tariff_2.0A', datetime.date(2020, 6, 2)))
+
+        self.cache.get_prices(start, end, 'tariff_2.0A', fetch=self.fetch, now_utc=now)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_incomplete_day(self):
+        start, end = datetime.datetime(2020, 6, 1, 22), datetime.datetime(2020, 6, 2, 21)
+        now = datetime.datetime(2020, 6, 5)
+
+        def short_fetch(start, end):
+            return self.fetch(start, end - datetime.timedelta(hours=5))  # The last hours are missing
+
+        prices = self.cache.get_prices(start, end, 'tariff_2.0A', fetch=short_fetch, now_utc=now)
+        self.assertEqual(int(prices.isna().sum()), 5)
+        self.assertIsNone(self.cache.load_day('tariff_2.0A', datetime.date(2020, 6, 2)))
+
+        class ServedCache:  # Serves the incomplete prices above
+            def get_prices(self, start_utc, end_utc, tariff, fetch):
+                return prices
+
+        with self.assertLogs('pyems.ioapis', level='WARNING'):
+            hourly = get_hourly_spanish_electricity_prices([start, end], cache=ServedCache(), last_included=True)
+        self.assertEqual(hourly.shape[0], 24)
+        self.assertEqual(int(hourly.isna().sum()), 5)
+        self.assertTrue(hourly.iloc[-5:].isna().all())
+
+
+class ExternalApiClient(unittest.TestCase):
+
+    def test_concurrent_day_requests(self):
+        with ApiStandIn(latency=0.01, fail_first=1) as server:
+            client = ApiClient(url_overrides=server.url_overrides, max_workers=3, backoff_factor=0.01)
+            prices = get_hourly_spanish_electricity_prices(
+                ['2020-01-01T00:00:00Z', '2020-01-08T00:00:00Z'], token='token', client=client
+            )
+            client.close()
+
+        self.assertEqual(prices.shape[0], 7 * 24)
+        self.assertEqual(prices.index[0], datetime.datetime(2020, 1, 1))
+        self.assertEqual(prices.index[-1], datetime.datetime(2020, 1, 7, 23))
+        self.assertEqual(server.requests, 7 + 1)  # One request per day plus the retried failure
+        self.assertLessEqual(server.max_active, 3)
+        self.assertLessEqual(len(server.connections), 4)
+
+    def test_vectorized_parsing(self):
+        start = datetime.datetime(2020, 1, 1, 22)
+        hours = [start + datetime.timedelta(hours=h) for h in range(30)]
+        values = [{'value': synthetic_price(hour), 'datetime_utc': hour.isoformat()} for hour in hours]
+
+        prices = ree_values_to_series(values, start, vector_length=26)
+        reference = pandas.Series([v['value'] / Constant.KILO for v in values[:26]], index=hours[:26], dtype=float)
+        self.assertTrue(prices.equals(reference))
+
+        interval = [datetime.datetime(2020, 1, 1, 0, 30), datetime.datetime(2020, 1, 2, 3, 15)]
+        with ApiStandIn() as server:
+            client = ApiClient(url_overrides=server.url_overrides)
+            prices = get_spanish_electricity_prices(interval, timestep='15m', token='token', client=client)
+            hourly = get_hourly_spanish_electricity_prices(
+                [datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2, 4)], token='token', client=client
+            )
+            client.close()
+
+        reference = series_upsampling(
+            hourly.to_frame('prices'), new_timestep='15m', new_time_interval=interval, old_timestep='1h'
+        )
+        self.assertEqual(prices.shape[0], 4 * 26 + 3)
+        self.assertTrue(numpy.array_equal(prices.values, reference.values))
+        self.assertTrue(numpy.array_equal(prices.index, reference.index))
+        self.assertEqual(list(prices.columns), ['prices'])
+
+    def test_incomplete_answer(self):
+        start = datetime.datetime(2020, 1, 1)
+        hours = [start + datetime.timedelta(hours=h) for h in range(20)]  # 4 hours of the day are missing
+
+        class ShortResponse:
+            status_code = 200
+
+            def json(self):
+                return {'indicator': {'values': [
+                    {'value': synthetic_price(hour), 'datetime_utc': hour.isoformat()} for hour in hours
+                ]}}
+
+        class ShortClient:
+            def get(self, url, headers=None, params=None):
+                return ShortResponse()
+
+        with self.assertLogs('pyems.ioapis', level='WARNING'):
+            prices = request_ree_prices(start, datetime.datetime(2020, 1, 1, 23), client=ShortClient())
+        self.assertEqual(prices.shape[0], 24)
+        self.assertEqual(prices.index[-1], datetime.datetime(2020, 1, 1, 23))
+        self.assertTrue(prices.iloc[-4:].isna().all())
+        self.assertFalse(prices.iloc[:20].isna().any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,311 @@
+import os
+import unittest
+import datetime
+import tempfile
+
+import numpy
+import pandas
+from pyomo.environ import SolverFactory
+
+from pyems.config import Setting, ElectricalType, ElectricalLoadSubType, ElectricalGeneratorSubType
+from pyems.core.components.electrical import ElectricalExternalGrid, ElectricalBattery
+from pyems.core.forecasting.lightweight import RidgeForecaster
+from pyems.core.optimization.cache import SolutionCache
+from pyems.core.utils.hashing import hash_inputs
+from pyems.core.optimization.coordination import CoordinatedOptimizer, split_capacity
+from pyems.core.optimization.hedging import ProgressiveHedgingOptimizer
+from pyems.core.optimization.optimizer import Optimizer
+from pyems.core.optimization.stochastic import StochasticOptimizer, scenario_index
+from pyems.core.system.system import System
+from tests.test_forecasting import START, ForecastingComponent, synthetic_history
+
+INTERVAL = [START + datetime.timedelta(days=6), START + datetime.timedelta(days=7)]
+PERIODS = 96
+
+
+def available_solver():
+    for solver in ['glpk', 'cbc']:
+        if SolverFactory(solver).available(exception_flag=False):
+            return solver
+    return None
+
+
+class PriceTable:
+    """Data handler answering prices and SOC values from a DataFrame."""
+
+    def __init__(self):
+        index = pandas.date_range(start=START, periods=8 * 96, freq='15T')
+        hours = index.hour + index.minute / 60
+        self.data = pandas.DataFrame({
+            'buy': 0.10 + 0.08 * (hours >= 18) * (hours < 22) - 0.05 * (hours < 0.25),
+            'sell': 0.04 + 0 * hours, 'soc_0': 0.5, 'soc_l': 0.5
+        }, index=index)
+
+    def get_data_series(self, labels, prediction_interval, historical_interval=None):
+        in_interval = (self.data.index >= prediction_interval[0]) & (self.data.index < prediction_interval[1])
+        return self.data.loc[in_interval, [labels] if isinstance(labels, str) else labels]
+
+    def get_data_point(self, labels, prediction_interval):
+        return float(self.data.at[pandas.Timestamp(prediction_interval[0]), labels])
+
+
+def build_stochastic_system(price_table, n_scenarios=5):
+    system = System('stochastic', n_scenarios=n_scenarios, scenario_seed=0)
+    system.load = ForecastingComponent(
+        ElectricalType.LOAD, ElectricalLoadSubType.FIX, synthetic_history(7, seed=1), RidgeForecaster()
+    )
+    system.generator = ForecastingComponent(
+        ElectricalType.GENERATOR, ElectricalGeneratorSubType.STOCHASTIC, synthetic_history(7, seed=2), RidgeForecaster()
+    )
+    system.grid = ElectricalExternalGrid(
+        purchase_label='buy', sell_label='sell', data_handler=price_table, publication_time='12:00'
+    )
+    system.battery = ElectricalBattery(
+        timestep='15m', batt_C=4, soc_lb=0.1, soc_ub=0.9, batt_chrg_speed=0.5, batt_dis_speed=0.5, batt_chrg_per=0.95,
+        batt_dis_per=0.95, data_handler=price_table, initial_soc_label='soc_0', final_soc_label='soc_l'
+    )
+    return system
+
+
+class StochasticOptimization(unittest.TestCase):
+
+    def setUp(self):
+        Setting.time_zone = 'UTC'
+        self.price_table = PriceTable()
+        self.system = build_stochastic_system(self.price_table)
+        self.config = {
+            'prediction_interval': INTERVAL, 'periods': PERIODS, 'current_time': INTERVAL[0], 'start': INTERVAL[0],
+            'timestep': '15m',
+        }
+
+    def test_scenario_index(self):
+        index = scenario_index(3, 4, shared=1)
+        self.assertTrue((index[:, 0] == 0).all())
+        self.assertEqual(numpy.unique(index).shape[0], 1 + 3 * 3)
+
+    def test_system_scenarios(self):
+        self.system.prepare_to_optimize(self.config)
+        self.assertEqual(self.system.fix_electrical_load_scenarios.shape, (5, PERIODS))
+        self.assertEqual(self.system.stochastic_electrical_gen_scenarios.shape, (5, PERIODS))
+        self.assertTrue(numpy.allclose(self.system.fix_electrical_load_scenarios[:, 0],
+                                       self.system.fix_electrical_load[0]))
+        self.assertAlmostEqual(self.system.scenario_probabilities.sum(), 1)
+
+        self.system.clear()
+        self.assertIsNone(self.system.fix_electrical_load_scenarios)
+
+    def test_model_structure(self):
+        self.system.prepare_to_optimize(self.config)
+        optimizer = StochasticOptimizer(write_solver_info=False)
+        optimizer.system = self.system
+        m = optimizer.create_optimization_model(self.config)
+
+        # The first period variables are shared, the rest are per scenario
+        self.assertEqual(len(m.E['buy']), 1 + 5 * (PERIODS - 1))
+        self.assertEqual(len(m.soc), 2 + 5 * (PERIODS - 1))
+        self.assertEqual(len(m.cl_balance), 1 + 5 * (PERIODS - 1))
+
+    @unittest.skipIf(available_solver() is None, 'No MILP solver available.')
+    def test_solve(self):
+        self.system.prepare_to_optimize(self.config)
+        optimizer = StochasticOptimizer(solver=available_solver(), write_solver_info=False)
+        results = optimizer.solve(system=self.system, config=self.config)
+
+        self.assertEqual(optimizer.solver_status['solver_summary'], 'optimal')
+        self.assertEqual(optimizer.scenario_results['power_supply_flow'].shape, (5, PERIODS))
+        first = optimizer.scenario_results['power_supply_flow'][:, 0]
+        self.assertTrue(numpy.allclose(first, first[0]))
+        self.assertAlmostEqual(results.target_soc, optimizer.scenario_results['battery_soc'][0, 1])
+        self.assertTrue((optimizer.scenario_results['battery_soc'][:, -1] >= 0.5 - 1e-6).all())
+
+
+@unittest.skipIf(available_solver() is None, 'No MILP solver available.')
+class ProgressiveHedging(unittest.TestCase):
+
+    def setUp(self):
+        Setting.time_zone = 'UTC'
+        self.price_table = PriceTable()
+        self.config = {
+            'prediction_interval': INTERVAL, 'periods': PERIODS, 'current_time': INTERVAL[0], 'start': INTERVAL[0],
+            'timestep': '15m',
+        }
+
+    def solve(self, optimizer):
+        system = build_stochastic_system(self.price_table, n_scenarios=4)
+        system.prepare_to_optimize(self.config)
+        # From a surplus to a deficit scenario: they disagree on charging in the first (cheapest) period
+        system.fix_electrical_load_scenarios[:, 1:] *= numpy.array([0.0, 0.5, 1.5, 3.0])[:, None]
+        system.stochastic_electrical_gen_scenarios[:, 1:] *= numpy.array([3.0, 1.5, 0.5, 0.0])[:, None]
+        try:
+            results = optimizer.solve(system=system, config=self.config)
+        finally:
+            if isinstance(optimizer, ProgressiveHedgingOptimizer):
+                optimizer.close()
+        return results, optimizer
+
+    def test_matches_extensive_form(self):
+        solver = available_solver()
+        _, extensive = self.solve(StochasticOptimizer(solver=solver, write_solver_info=False))
+        results, hedging = self.solve(ProgressiveHedgingOptimizer(solver=solver, rho=0.1, workers=2))
+
+        self.assertTrue(hedging.converged)
+        self.assertGreater(hedging.diagnostics[0]['deviation'], hedging.tolerance)
+        self.assertEqual(hedging.solver_status['iterations'], len(hedging.diagnostics) - 1)
+        first = hedging.scenario_results['power_supply_flow'][:, 0]
+        self.assertTrue(numpy.allclose(first, first[0]))
+
+        cost = {}
+        for name, optimizer in [('extensive', extensive), ('hedging', hedging)]:
+            flow = optimizer.scenario_results['power_supply_flow']
+            buy, sell = numpy.clip(flow, 0, None), numpy.clip(-flow, 0, None)
+            cost[name] = (buy @ optimizer.results['prices_buy'].values - sell @ optimizer.results['prices_sell'].values
+                          ).mean()
+        self.assertLessEqual(cost['extensive'], cost['hedging'] + 1e-6)
+        self.assertAlmostEqual(cost['hedging'], cost['extensive'], delta=1e-3 * abs(cost['extensive']))
+        self.assertAlmostEqual(results.target_soc, hedging.diagnostics[-1]['consensus'])
+
+    def test_iteration_cap(self):
+        _, hedging = self.solve(ProgressiveHedgingOptimizer(solver=available_solver(), max_iterations=2,
+                                                            tolerance=0))
+        self.assertLessEqual(len(hedging.diagnostics), 3)
+        self.assertFalse(hedging.converged)
+
+
+class CapacitySplit(unittest.TestCase):
+
+    def test_split(self):
+        net_imports = numpy.array([[3.0, 1.0, -2.0], [1.0, 1.0, -2.0]])
+        import_limits, export_limits = split_capacity(net_imports, numpy.full(3, 2.0), numpy.full(3, numpy.inf))
+
+        self.assertTrue(numpy.allclose(import_limits.sum(axis=0), 2))
+        self.assertTrue(numpy.allclose(import_limits[:, 0], [1.5, 0.5]))  # The cut in proportion to the imports
+        self.assertTrue(numpy.allclose(import_limits[:, 2], [1, 1]))  # The spare capacity shared equally
+        self.assertTrue(numpy.isinf(export_limits).all())
+
+
+@unittest.skipIf(available_solver() is None, 'No MILP solver available.')
+class CoordinatedOptimization(unittest.TestCase):
+
+    def setUp(self):
+        from tests.test_simulation import TableDataHandler, build_site
+
+        Setting.time_zone = 'UTC'
+        self.config = {
+            'prediction_interval': INTERVAL, 'periods': PERIODS, 'current_time': INTERVAL[0], 'start': INTERVAL[0],
+            'timestep': '15m',
+        }
+        self.handlers = [TableDataHandler(PriceTable(), latency=0) for _ in range(3)]
+        self.systems = [build_site(handler, seed) for seed, handler in enumerate(self.handlers)]
+        for system in self.systems:
+            system.prepare_to_optimize(self.config)
+
+    def solve(self, **kwargs):
+        coordinator = CoordinatedOptimizer(solver=available_solver(), **kwargs)
+        for b, system in enumerate(self.systems):
+            coordinator.add_building(f'building_{b}', system)
+        try:
+            results = coordinator.solve(self.config)
+        finally:
+            coordinator.close()
+        return results, coordinator
+
+    @staticmethod
+    def cost(results):
+        total = 0
+        for building_results in results.values():
+            data = building_results.raw_results
+            flow = data['power_supply_flow']
+            total += (flow.clip(lower=0) * data['prices_buy'] - (-flow).clip(lower=0) * data['prices_sell']).sum()
+        return total
+
+    def test_capacity_not_binding(self):
+        results, coordinator = self.solve(import_capacity=100)
+
+        self.assertTrue(coordinator.converged)
+        self.assertEqual(len(coordinator.diagnostics), 1)
+        self.assertTrue((coordinator.connection_prices == 0).all())
+        self.assertEqual(set(results), {'building_0', 'building_1', 'building_2'})
+
+    def test_capacity_binding(self):
+        free_results, _ = self.solve(import_capacity=100)
+        results, coordinator = self.solve(import_capacity=4.0, max_iterations=10, workers=2)
+
+        self.assertGreater(coordinator.diagnostics[0]['primal_residual'], coordinator.tolerance)
+        self.assertLessEqual(coordinator.net_import.max(), 4.0 + coordinator.tolerance)
+        net_import = sum(building_results.raw_results['power_supply_flow'].values for building_results in
+                         results.values())
+        self.assertTrue(numpy.allclose(net_import, coordinator.net_import))
+        self.assertGreaterEqual(self.cost(results), self.cost(free_results) - 1e-6)
+        self.assertEqual(len(coordinator.diagnostics), 11)
+
+
+class SolutionMemoization(unittest.TestCase):
+
+    def setUp(self):
+        Setting.time_zone = 'UTC'
+        self.price_table = PriceTable()
+        self.system = build_stochastic_system(self.price_table, n_scenarios=None)
+        self.config = {
+            'prediction_interval': INTERVAL, 'periods': PERIODS, 'current_time': INTERVAL[0], 'start': INTERVAL[0],
+            'timestep': '15m',
+        }
+        self.system.prepare_to_optimize(self.config)
+
+    def test_hash_inputs(self):
+        self.assertEqual(hash_inputs({'a': numpy.float64(0.5), 'b': numpy.arange(3.0)}),
+                         hash_inputs({'b': numpy.arange(3.0), 'a': 0.5}))
+        self.assertNotEqual(hash_inputs(numpy.arange(3.0)), hash_inputs(numpy.arange(3.0)[::-1]))
+        self.assertNotEqual(hash_inputs(numpy.zeros((2, 3))), hash_inputs(numpy.zeros((3, 2))))
+
+    def test_key(self):
+        optimizer = Optimizer(write_solver_info=False)
+        optimizer.system = self.system
+        key = optimizer.solution_key(self.config)
+
+        self.assertEqual(key, optimizer.solution_key(self.config))
+        self.system.get_battery_object().soc_0 = 0.6
+        self.assertNotEqual(key, optimizer.solution_key(self.config))
+        self.system.get_battery_object().soc_0 = 0.5
+
+        other = Optimizer(solver='other', write_solver_info=False)
+        other.system = self.system
+        self.assertNotEqual(key, other.solution_key(self.config))
+
+    @unittest.skipIf(available_solver() is None, 'No MILP solver available.')
+    def test_memory_tier(self):
+        cache = SolutionCache(max_size=1)
+        optimizer = Optimizer(solver=available_solver(), write_solver_info=False, solution_cache=cache)
+        first = optimizer.solve(system=self.system, config=self.config)
+        optimizer.clear()
+        second = optimizer.solve(system=self.system, config=self.config)
+
+        self.assertIsNone(optimizer.optimization_model)  # Neither built nor solved
+        self.assertTrue(second.raw_results.equals(first.raw_results))
+        self.assertEqual(second.target_soc, first.target_soc)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        self.system.get_battery_object().soc_0 = 0.6
+        optimizer.solve(system=self.system, config=self.config)
+        self.assertEqual((cache.misses, cache.evictions, len(cache)), (2, 1, 1))
+
+    @unittest.skipIf(available_solver() is None, 'No MILP solver available.')
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as path:
+            optimizer = Optimizer(solver=available_solver(), write_solver_info=False,
+                                  solution_cache=SolutionCache(path=path, max_disk_size=1))
+            first = optimizer.solve(system=self.system, config=self.config)
+
+            # Another process: same directory, empty memory tier
+            cache = SolutionCache(path=path)
+            other = Optimizer(solver=available_solver(), write_solver_info=False, solution_cache=cache)
+            second = other.solve(system=self.system, config=self.config)
+            self.assertEqual(cache.disk_hits, 1)
+            self.assertTrue(second.raw_results.equals(first.raw_results))
+
+            self.system.get_battery_object().soc_0 = 0.6
+            optimizer.solve(system=self.system, config=self.config)
+            self.assertEqual(len(os.listdir(path)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
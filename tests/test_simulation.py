@@ -0,0 +1,315 @@
+import unittest
+import datetime
+import threading
+from time import sleep
+
+import numpy
+import pandas
+
+from pyems.config import Setting, ElectricalType, ElectricalLoadSubType
+from pyems.core.components.electrical import ElectricalExternalGrid, ElectricalBattery
+from pyems.core.forecasting.lightweight import SeasonalNaiveForecaster
+from pyems.core.iodata.data_handler import BaseDataHandler, SharedSeriesCache
+from pyems.core.optimization.optimizer import Optimizer
+from pyems.core.simulation.fleet import Fleet
+from pyems.core.simulation.simulation import Simulation
+from pyems.core.simulation.trigger import ReoptimizationTrigger
+from pyems.core.system.preparation import TaskGraph
+from pyems.core.system.system import System
+from tests.test_forecasting import START, ForecastingComponent, synthetic_history
+from tests.test_optimization import PriceTable, available_solver
+
+CURRENT_TIME = START + datetime.timedelta(days=6)
+
+
+class TableDataHandler(BaseDataHandler):
+    """Data handler reading a PriceTable. The loads are counted per label and take some time, like a remote request."""
+
+    def __init__(self, table, shared_cache=None, latency=0.01):
+        super().__init__(timestep='15m', shared_cache=shared_cache)
+        self.table = table
+        self.latency = latency
+        self.loads = {}
+        self._lock = threading.Lock()
+        self.add_series_dispatcher({label: self.series_loader(label) for label in ['buy', 'sell']})
+        self.add_point_dispatcher({
+            label: lambda prediction_interval, label=label: table.get_data_point(label, prediction_interval)
+            for label in ['soc_0', 'soc_l']
+        })
+
+    def series_loader(self, label):
+        def load(prediction_interval, historical_interval):
+            with self._lock:
+                self.loads[label] = self.loads.get(label, 0) + 1
+            sleep(self.latency)
+            return self.table.get_data_series(label, prediction_interval)
+        return load
+
+
+def build_site(data_handler, seed):
+    system = System(f'site_{seed}')
+    system.load = ForecastingComponent(
+        ElectricalType.LOAD, ElectricalLoadSubType.FIX, synthetic_history(7, seed=seed), SeasonalNaiveForecaster()
+    )
+    system.grid = ElectricalExternalGrid(
+        purchase_label='buy', sell_label='sell', data_handler=data_handler, publication_time='23:59'
+    )
+    system.battery = ElectricalBattery(
+        timestep='15m', batt_C=4, soc_lb=0.1, soc_ub=0.9, batt_chrg_speed=0.5, batt_dis_speed=0.5, batt_chrg_per=0.95,
+        batt_dis_per=0.95, data_handler=data_handler, initial_soc_label='soc_0', final_soc_label='soc_l'
+    )
+    return system
+
+
+class SimulationInstances(unittest.TestCase):
+
+    def test_not_singleton(self):
+        self.assertIsNot(Simulation(timestep='15m'), Simulation(timestep='15m'))
+
+
+class SharedDataCache(unittest.TestCase):
+
+    def test_shared_labels(self):
+        cache = SharedSeriesCache(['buy'])
+        handlers = [TableDataHandler(PriceTable(), shared_cache=cache) for _ in range(4)]
+        interval = [CURRENT_TIME, CURRENT_TIME + datetime.timedelta(days=1)]
+
+        threads = [threading.Thread(target=handler.get_data_series, args=(['buy', 'sell'], interval))
+                   for handler in handlers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(handler.loads.get('buy', 0) for handler in handlers), 1)
+        self.assertEqual(sum(handler.loads['sell'] for handler in handlers), 4)  # Not shared
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        self.assertTrue(handlers[0].get_data_series('buy', interval).equals(
+            PriceTable().get_data_series('buy', interval)
+        ))
+
+    def test_failed_load(self):
+        cache = SharedSeriesCache(['buy'])
+        key = cache.make_key('buy', [CURRENT_TIME, CURRENT_TIME + datetime.timedelta(days=1)], None, '15m', {})
+
+        def fail():
+            raise ConnectionError('Data source unavailable.')
+
+        with self.assertRaises(ConnectionError):
+            cache.get_or_load(key, fail)
+        self.assertEqual(cache._loading, {})
+        self.assertEqual(cache.get_or_load(key, lambda: pandas.Series([1.0])).tolist(), [1.0])
+        self.assertEqual(cache.misses, 2)
+
+
+@unittest.skipIf(available_solver() is None, 'No MILP solver available.')
+class FleetRunner(unittest.TestCase):
+
+    def setUp(self):
+        Setting.time_zone = 'UTC'
+        self.fleet = Fleet(timestep='15m', workers=4, shared_labels=['buy', 'sell'])
+        self.handlers = []
+        for seed in range(4):
+            handler = TableDataHandler(PriceTable(), shared_cache=self.fleet.shared_cache)
+            self.handlers.append(handler)
+            optimizer = Optimizer(solver=available_solver(), write_solver_info=False)
+            self.fleet.add_site(f'site_{seed}', build_site(handler, seed), optimizer, handler)
+
+    def tearDown(self):
+        self.fleet.close()
+
+    def test_step(self):
+        results = self.fleet.run_step(CURRENT_TIME, simulation_end='midnight_ahead', midnight_ahead=0)
+
+        self.assertEqual(set(results), {'site_0', 'site_1', 'site_2', 'site_3'})
+        for site_results in results.values():
+            self.assertIsNotNone(site_results)
+        # The prices are loaded once for the whole fleet
+        self.assertEqual(sum(handler.loads.get('buy', 0) for handler in self.handlers), 1)
+
+        report = self.fleet.latency_report()
+        self.assertEqual(report['site_0']['steps'], 1)
+        self.assertEqual(report['site_0']['errors'], 0)
+        self.assertGreater(report['site_0']['last'], 0)
+
+    def test_failure_isolation(self):
+        self.fleet.sites['site_1'].system.load.history = synthetic_history(1)  # No history for this step
+        results = self.fleet.run_step(CURRENT_TIME, simulation_end='midnight_ahead', midnight_ahead=0)
+
+        self.assertIsNone(results['site_1'])
+        self.assertIsNotNone(results['site_0'])
+        self.assertEqual(self.fleet.latency_report()['site_1']['errors'], 1)
+        self.assertIsNone(self.fleet.sites['site_1'].system.fix_electrical_load_scenarios)
+
+    def test_solver_info_files(self):
+        handler = self.handlers[0]
+        self.fleet.add_site('writer', build_site(handler, 9), Optimizer(write_solver_info=True), handler)
+        with self.assertRaises(ValueError):
+            self.fleet.add_site('other_writer', build_site(handler, 9), Optimizer(write_solver_info=True), handler)
+
+
+@unittest.skipIf(available_solver() is None, 'No MILP solver available.')
+class EventDrivenReoptimization(unittest.TestCase):
+
+    def setUp(self):
+        Setting.time_zone = 'UTC'
+        self.table = PriceTable()
+        self.handler = TableDataHandler(self.table, latency=0)
+        self.system = build_site(self.handler, 0)
+        self.optimizer = Optimizer(solver=available_solver(), write_solver_info=False)
+
+    def run_steps(self, trigger, soc_offsets, **step_arguments):
+        """Runs a step every period. Before each step after the first, the measured SOC is the planned one plus the
+        offset.
+        """
+
+        step_arguments = step_arguments or {'simulation_end': 'midnight_ahead', 'midnight_ahead': 0}
+
+        simulation = Simulation(timestep='15m', trigger=trigger)
+        simulation.system = self.system
+        simulation.optimizer = self.optimizer
+        steps = []
+        for n, offset in enumerate([None] + soc_offsets):
+            current_time = CURRENT_TIME + datetime.timedelta(minutes=15 * n)
+            if offset is not None:  # The step starts at current_time
+                self.table.data.at[current_time, 'soc_0'] = trigger.plan.at[current_time, 'battery_soc'] + offset
+            steps.append(simulation.run_single_step(current_time=current_time, **step_arguments))
+            self.system.clear()
+            self.optimizer.clear()
+            simulation.clear()
+        return steps
+
+    def test_reuse_and_resolve(self):
+        trigger = ReoptimizationTrigger(soc_tolerance=0.02)
+        first, reused, solved = self.run_steps(trigger, [0.0, 0.1])
+
+        self.assertEqual([decision['reuse'] for decision in trigger.decisions], [False, True, False])
+        self.assertEqual(trigger.decisions[2]['reason'], 'SOC deviation')
+        self.assertTrue(reused.raw_results.equals(first.raw_results.iloc[1:]))
+        self.assertAlmostEqual(reused.target_soc, first.raw_results['battery_soc'].iloc[2])
+
+        summary = trigger.summary()
+        self.assertEqual((summary['solves'], summary['reuses']), (2, 1))
+        self.assertGreater(summary['saved_time'], 0)
+        self.assertIs(trigger.plan, solved.raw_results)
+
+    def test_max_reuses(self):
+        trigger = ReoptimizationTrigger(max_reuses=1)
+        self.run_steps(trigger, [0.0, 0.0])
+
+        self.assertEqual([decision['reason'] for decision in trigger.decisions],
+                         ['no previous plan', 'inputs within tolerance', 'max reuses reached'])
+
+    def test_moving_end(self):
+        trigger = ReoptimizationTrigger()
+        with self.assertLogs('pyems.Simulation', level='WARNING') as logs:
+            self.run_steps(trigger, [0.0, 0.0], simulation_end='fix', simulation_length='1h')
+
+        self.assertEqual(len(logs.records), 1)  # Only once per simulation
+        self.assertEqual([decision['reason'] for decision in trigger.decisions],
+                         ['no previous plan', 'horizon changed', 'horizon changed'])
+
+
+class ParallelPreparation(unittest.TestCase):
+
+    def setUp(self):
+        Setting.time_zone = 'UTC'
+        self.table = PriceTable()
+        self.handler = TableDataHandler(self.table, latency=0.2)
+        self.config = {
+            'prediction_interval': [CURRENT_TIME, CURRENT_TIME + datetime.timedelta(days=1)], 'periods': 96,
+            'current_time': CURRENT_TIME, 'start': CURRENT_TIME, 'timestep': '15m',
+        }
+
+    def prepare(self, preparation_workers):
+        system = build_site(self.handler, 0)
+        system.preparation_workers = preparation_workers
+        try:
+            system.prepare_to_optimize(self.config)
+        finally:
+            system.close()
+        return system
+
+    def test_concurrent_tasks(self):
+        sequential = self.prepare(None)
+        parallel = self.prepare(4)
+
+        timings = parallel.preparation_timings
+        self.assertEqual(set(timings), {
+            'forecast_component', 'forecasts', 'initial_soc', 'final_soc', 'purchase_prices', 'sell_prices'
+        })
+        self.assertTrue(all(timing['status'] == 'done' for timing in timings.values()))
+        # The price requests of a default handler overlap
+        self.assertFalse(self.handler.serialize_requests)
+        purchase, sell = timings['purchase_prices'], timings['sell_prices']
+        self.assertLess(max(purchase['start'], sell['start']),
+                        min(purchase['start'] + purchase['duration'], sell['start'] + sell['duration']))
+
+        self.assertTrue(numpy.array_equal(parallel.get_external_grid_object().electricity_purchase_prices,
+                                          sequential.get_external_grid_object().electricity_purchase_prices))
+        self.assertTrue(numpy.array_equal(parallel.fix_electrical_load, sequential.fix_electrical_load))
+        self.assertEqual(parallel.get_battery_object().soc_0, sequential.get_battery_object().soc_0)
+
+    def test_failure_isolation(self):
+        self.table.data = self.table.data.drop(columns='soc_0')
+
+        system = build_site(self.handler, 0)
+        system.preparation_workers = 4
+        with self.assertRaises(KeyError):
+            system.prepare_to_optimize(self.config)
+        system.close()
+
+        timings = system.preparation_timings
+        self.assertEqual(timings['initial_soc']['status'], 'failed')
+        self.assertEqual(timings['final_soc']['status'], 'done')
+        self.assertEqual(timings['sell_prices']['status'], 'done')
+        self.assertIsNotNone(system.get_external_grid_object().electricity_selling_prices)
+
+    def test_forecast_tasks(self):
+        system = build_site(self.handler, 0)
+        system.load_1 = ForecastingComponent(
+            ElectricalType.LOAD, ElectricalLoadSubType.FIX, synthetic_history(7, seed=1), SeasonalNaiveForecaster()
+        )
+        system.preparation_workers = 4
+        try:
+            system.prepare_to_optimize(self.config)
+        finally:
+            system.close()
+
+        timings = system.preparation_timings
+        forecasts = [timings['forecast_component'], timings[f'forecast_{system.load_1.id}']]
+        self.assertGreaterEqual(timings['forecasts']['start'],
+                                max(timing['start'] + timing['duration'] for timing in forecasts))
+        self.assertTrue(numpy.allclose(system.fix_electrical_load, system.load.stored_forecast['load'].values
+                                       + system.load_1.stored_forecast['load'].values))
+
+    def test_serialized_handler(self):
+        self.handler.serialize_requests = True
+        system = self.prepare(4)
+
+        purchase, sell = system.preparation_timings['purchase_prices'], system.preparation_timings['sell_prices']
+        # The requests take 0.2 s each and do not overlap
+        span = max(purchase['start'] + purchase['duration'], sell['start'] + sell['duration']) - min(
+            purchase['start'], sell['start'])
+        self.assertGreaterEqual(span, 0.4)
+        self.assertTrue(numpy.array_equal(system.get_external_grid_object().electricity_selling_prices,
+                                          self.table.data['sell'].values[6 * 96:7 * 96]))
+
+    def test_dependencies(self):
+        order = []
+        graph = TaskGraph()
+        graph.add('a', lambda: order.append('a') or 1 / 0)
+        graph.add('b', lambda: order.append('b'), depends=['a'])
+        graph.add('c', lambda: order.append('c'))
+        with self.assertRaises(ValueError):
+            graph.add('d', lambda: None, depends=['unknown'])
+
+        timings = graph.run()
+        self.assertEqual(sorted(order), ['a', 'c'])
+        self.assertEqual([timings[name]['status'] for name in 'abc'], ['failed', 'skipped', 'done'])
+        with self.assertRaises(ZeroDivisionError):
+            graph.raise_failure()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,8 @@ import numpy
 
 from pyems.core.utils.time import (
     timestep_to_seconds, timestep_conversion,  get_following_midnight_utc_timestamp,
-    find_next_step_start, check_timestep, series_upsampling, time_unit_conversion, split_timestep
+    find_next_step_start, check_timestep, series_upsampling, time_unit_conversion, split_timestep,
+    series_upsampling_repeat
 )
 
 
@@ -182,6 +183,35 @@ class TimeStep(unittest.TestCase):
             self.assertTrue(numpy.array_equal(df['test_data'].values, tgt_values))
             self.assertTrue(numpy.array_equal(df['test_data'].index, tgt_index))
 
+    def test_series_upsample_repeat(self):
+
+        steps = 10
+        index = pandas.date_range(start=datetime.datetime(2019, 12, 31, 23, 0), periods=steps, freq='1H')
+        series = pandas.DataFrame({'test_data': list(range(steps))}, index=index)
+
+        cases = [
+            ('15m', [datetime.datetime(2019, 12, 31, 23, 30), datetime.datetime(2020, 1, 1, 1, 30)], '1h'),
+            ('15m', [datetime.datetime(2020, 1, 1, 2), datetime.datetime(2020, 1, 1, 12)], '1h'),  # Padded end
+            ('10m', None, '1h'),
+            ('1h', [datetime.datetime(2020, 1, 1, 1), datetime.datetime(2020, 1, 1, 5)], '1h'),
+        ]
+
+        for new_timestep, interval, old_timestep in cases:
+            for upsample_values in (True, False):
+                reference = series_upsampling(
+                    series.copy(), new_timestep=new_timestep, old_timestep=old_timestep,
+                    new_time_interval=interval, upsample_values=upsample_values
+                )
+                df = series_upsampling_repeat(
+                    series, new_timestep=new_timestep, old_timestep=old_timestep,
+                    new_time_interval=interval, upsample_values=upsample_values
+                )
+                self.assertTrue(numpy.array_equal(df['test_data'].values, reference['test_data'].values))
+                self.assertTrue(numpy.array_equal(df.index, reference.index))
+
+        with self.assertRaises(ValueError):
+            series_upsampling_repeat(series, new_timestep='25m', old_timestep='1h')
+
 
 if __name__ == '__main__':
     unittest.main()